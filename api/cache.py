@@ -0,0 +1,246 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, Union
+
+
+def content_key(*parts: Union[str, bytes, None]) -> str:
+    """
+    Builds a content-addressed cache key (sha256 hex digest) from a list of parts.
+    Every part is length-prefixed so that ("ab", "c") and ("a", "bc") never collide.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b""
+        elif isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class DiskLRUCache:
+    """
+    A size-bounded, content-addressed file cache shared by all workers.
+
+    Files live on disk under `directory/<key[:2]>/<key><suffix>` so every
+    gunicorn worker (and every game) can reuse them. Each worker keeps an
+    in-memory LRU index of keys and sizes, seeded from disk at startup, which
+    decides what to evict once the cache grows above `max_bytes`.
+    Writes are atomic (temp file + rename) so concurrent workers never
+    see a half-written file.
+    """
+
+    def __init__(self, directory: Union[str, Path], max_bytes: int, suffix: str = ""):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        # oldest access first, so the LRU order survives restarts
+        entries = []
+        for path in self.directory.glob(f"*/*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path.name[:len(path.name) - len(self.suffix)], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+
+    def path_for(self, key: str) -> Path:
+        return Path(self.directory, key[:2], f"{key}{self.suffix}")
+
+    def get(self, key: str) -> Optional[Path]:
+        """
+        Returns the path of the cached file for `key`, or None on a miss.
+        """
+        path = self.path_for(key)
+        with self._lock:
+            try:
+                # touch the file so that the LRU order is shared with other workers
+                os.utime(path)
+                size = path.stat().st_size
+            except FileNotFoundError:
+                # the file might have been evicted by another worker
+                if key in self._index:
+                    self._total_bytes -= self._index.pop(key)
+                self.misses += 1
+                return None
+
+            if key not in self._index:
+                # added by another worker
+                self._total_bytes += size
+            else:
+                self._total_bytes += size - self._index[key]
+            self._index[key] = size
+            self._index.move_to_end(key)
+            self.hits += 1
+        return path
+
+    def put_bytes(self, key: str, data: bytes) -> Path:
+        """
+        Atomically stores `data` under `key` and returns its path.
+        """
+        path = self.path_for(key)
+        os.makedirs(path.parent, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # readable like any other asset, game assets may be hardlinks to the entry
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove_quietly(tmp_path)
+            raise
+        self._track(key, len(data))
+        return path
+
+    def put_file(self, key: str, source_path: Union[str, Path]) -> Path:
+        """
+        Atomically copies `source_path` into the cache under `key` and returns its path.
+        """
+        path = self.path_for(key)
+        os.makedirs(path.parent, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        os.close(fd)
+        try:
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove_quietly(tmp_path)
+            raise
+        self._track(key, path.stat().st_size)
+        return path
+
+    def tee(self, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Yields `chunks` as they arrive while writing them to a temp file, which is
+        atomically added to the cache under `key` once the stream completes.
+        A stream that is interrupted (e.g. the client disconnects) is discarded.
+        """
+        path = self.path_for(key)
+        os.makedirs(path.parent, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove_quietly(tmp_path)
+            raise
+        self._track(key, size)
+
+    async def tee_async(self, key: str, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """
+        `tee` for an async stream. The chunks are small and go to the page cache,
+        so they are written inline rather than on a thread.
+        """
+        path = self.path_for(key)
+        os.makedirs(path.parent, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove_quietly(tmp_path)
+            raise
+        self._track(key, size)
+
+    def _track(self, key: str, size: int):
+        with self._lock:
+            self._total_bytes += size - self._index.pop(key, 0)
+            self._index[key] = size
+            self._evict()
+
+    def _evict(self):
+        # called with the lock held, never evicts the entry that was just added
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            _remove_quietly(self.path_for(key))
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _remove_quietly(path: Union[str, Path]):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def write_file(path: Union[str, Path], data: bytes):
+    """
+    Atomically writes `data` to `path`, replacing the file rather than writing into it.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+
+
+def link_file(source: Union[str, Path], destination: Union[str, Path]):
+    """
+    Atomically hardlinks `source` to `destination` (copies it across file systems).
+    The destination is replaced, so whatever it linked to before is left untouched.
+    """
+    destination = Path(destination)
+    fd, tmp_path = tempfile.mkstemp(dir=destination.parent, prefix=f".{destination.name}-")
+    os.close(fd)
+    os.remove(tmp_path)
+    try:
+        try:
+            os.link(source, tmp_path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
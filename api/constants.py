@@ -29,8 +29,126 @@ STATIC_DIR = Path("static")
 ASSETS_DIR = Path("assets")
 MOCK_DATA_DIR = Path(DATA_DIR, "mock")
 GAME_DATA_DIR = Path(ASSETS_DIR, "games")
+# Game directories are sharded by the first characters of the game id: <GAME_DATA_DIR>/<id[:2]>/<id>
+GAME_SHARD_CHARS = 2
+# Games nobody played for this long are deleted (images & session) by the collector.
+GAME_ASSETS_TTL_SECONDS = 3 * 24 * 3600
+# Disk quota of all game directories, the least recently played games are evicted first.
+GAME_ASSETS_MAX_BYTES = 5 * 1024 ** 3  # 5 GB
+# Games played this recently are never evicted for the quota.
+GAME_ASSETS_MIN_IDLE_SECONDS = 30 * 60
+GAME_ASSETS_GC_INTERVAL_SECONDS = 10 * 60  # one collection per node per interval
+GAME_ASSETS_TOUCH_SECONDS = 60  # a game's last access is recorded at most once a minute per worker
+# The mock images, copied once next to the game assets so that games can hardlink them
+MOCK_ASSET_POOL_DIR = Path(ASSETS_DIR, "mock_pool")
+# Pregenerated stories, laid out as <theme>/story_N/story.json
+STORY_DATA_DIR = Path(__file__).resolve().parent / "data"
 
 
 
 IMAGE_MODEL_ID = "gemini-2.5-flash-image-preview"
-TEXT_MODEL_ID = "gemini-2.0-flash-lite"
\ No newline at end of file
+TEXT_MODEL_ID = "gemini-2.0-flash-lite"
+
+# Speculative pre-generation of the next steps while the player reads.
+PREFETCH_BUDGET_PER_GAME = 6  # maximum number of speculative step renders per game
+PREFETCH_MAX_CONCURRENCY = 4  # maximum number of prefetches running at once per worker
+PREFETCH_IDLE_SECONDS = 3600  # the budget of a game nobody played for an hour is dropped
+
+# Optional pre-generation of the whole story once the character sheet exists (PREGENERATE_STORY=1).
+PREGENERATE_BUDGET_PER_GAME = 12  # maximum number of step renders per game, most likely steps first
+PREGENERATE_CONCURRENCY_PER_GAME = 2  # steps of one game rendered at once
+PREGENERATE_MAX_CONCURRENCY = 4  # pre-generated steps rendered at once per worker
+
+# Content-addressed caches shared by all games & workers.
+CACHE_DIR = Path(ASSETS_DIR, "cache")
+SCENE_CACHE_DIR = Path(CACHE_DIR, "scenes")
+SCENE_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 2 GB of generated scene PNGs
+NARRATION_CACHE_DIR = Path(CACHE_DIR, "narration")
+NARRATION_CACHE_MAX_BYTES = 1024 ** 3  # 1 GB of narration mp3s
+
+# Game sessions shared by every worker, override with the SESSION_STORE_URL env variable
+# (e.g. redis://localhost:6379/0 to share them between nodes).
+DEFAULT_SESSION_STORE_URL = f"sqlite:///{Path(ASSETS_DIR, 'sessions.db')}"
+
+# Per-worker LRU of game images (character sheets & scenes), decoded + encoded bytes.
+IMAGE_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+# Default sizes of the named thread pools, override with EXECUTOR_<NAME>_WORKERS.
+EXECUTOR_DEFAULT_WORKERS = {
+    "provider": 16,  # blocking provider calls (story generation & the scripts, the API's are async)
+    "codec": 2,  # image decode/encode & hashing
+    "io": 8,  # file & session store reads/writes
+}
+
+# Responsive, compressed variants of the game images served by /api/images.
+IMAGE_VARIANT_WIDTHS = (480, 960, 1600)
+IMAGE_WEBP_QUALITY = 80
+IMAGE_AVIF_ENABLED = False  # AVIF is smaller than WebP but much slower to encode
+IMAGE_AVIF_QUALITY = 55
+
+# Reference images (selfie, character sheet, previous scene) are downscaled & re-encoded
+# before they are sent to the image model, which doesn't use more detail than this.
+REFERENCE_IMAGE_MAX_DIMENSION = 1024  # longest side, in pixels
+REFERENCE_IMAGE_FORMAT = "JPEG"  # or "WEBP"
+REFERENCE_IMAGE_QUALITY = 85
+
+# Concurrent TTS requests allowed by each ElevenLabs plan, and the plan we are on.
+ELEVENLABS_PLAN_CONCURRENCY = {"free": 2, "starter": 3, "creator": 5, "pro": 10, "scale": 15, "business": 15}
+ELEVENLABS_PLAN = "creator"
+
+# Node-wide admission control for the providers, shared by all workers through PROVIDER_GATEWAY_DB.
+# rate_per_second is the ceiling of the adaptive rate, which halves on every 429.
+PROVIDER_GATEWAY_DB = Path(ASSETS_DIR, "provider_gateway.db")
+PROVIDER_LIMITS = {
+    "gemini": {
+        "max_concurrency": 8,
+        "rate_per_second": 2.0,
+        "min_rate_per_second": 0.1,
+        "burst": 4,
+        "lease_seconds": 180,  # a lease outliving this is considered lost (e.g. a killed worker)
+        "max_backoff_seconds": 30,
+    },
+    "gemini_text": {  # story generation, separate quota from the image model
+        "max_concurrency": 16,
+        "rate_per_second": 10.0,
+        "min_rate_per_second": 0.5,
+        "burst": 16,
+        "lease_seconds": 120,
+        "max_backoff_seconds": 30,
+    },
+    "elevenlabs": {
+        "max_concurrency": ELEVENLABS_PLAN_CONCURRENCY[ELEVENLABS_PLAN],
+        "rate_per_second": 3.0,
+        "min_rate_per_second": 0.2,
+        "burst": 6,
+        "lease_seconds": 180,
+        "max_backoff_seconds": 30,
+    },
+}
+PROVIDER_MAX_RETRIES = 4  # retries of a call that was answered with a 429
+
+# Connection pool of each provider's async HTTP client, one per worker. The gateway
+# bounds the calls in flight, the pool keeps their connections alive between calls.
+PROVIDER_HTTP_MAX_CONNECTIONS = 100  # per client, i.e. per provider host
+PROVIDER_HTTP_MAX_KEEPALIVE = 32
+PROVIDER_HTTP_KEEPALIVE_SECONDS = 90
+PROVIDER_HTTP_CONNECT_TIMEOUT_SECONDS = 10
+PROVIDER_HTTP_TIMEOUT_SECONDS = 240  # an image generation can take minutes
+# Connections per provider opened by the startup warm-up, so the first calls skip the TLS handshake
+PROVIDER_HTTP_WARM_CONNECTIONS = 2
+PROVIDER_BASE_URLS = {
+    "gemini": "https://generativelanguage.googleapis.com/",
+    "elevenlabs": "https://api.elevenlabs.io/",
+}
+
+# Narration pre-rendered offline by scripts/generate_narration.py, served instead of calling TTS.
+NARRATION_PRERENDER_DIR = Path(__file__).resolve().parent / "narration"
+NARRATION_PRERENDER_MANIFEST = Path(NARRATION_PRERENDER_DIR, "manifest.json")
+
+# All the stories compiled into one memory-mapped file by scripts/build_story_bundle.py,
+# loaded instead of the story json files when present.
+STORY_BUNDLE_PATH = Path(STORY_DATA_DIR, "stories.bundle")
+
+# Per-worker metrics snapshots, merged by /metrics so that a scrape covers every worker of the node.
+METRICS_DIR = Path(ASSETS_DIR, "metrics")
+METRICS_FLUSH_SECONDS = 5.0
@@ -0,0 +1,166 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator
+
+from api.constants import EXECUTOR_DEFAULT_WORKERS
+
+
+class BoundedExecutor:
+    """
+    A named thread pool that keeps track of its queue depth and of how long
+    work waits before a thread picks it up.
+    Work that is cancelled while still queued never runs.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"{name}-pool")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs `fn(*args, **kwargs)` on the pool and awaits its result.
+        """
+        submitted_at = time.perf_counter()
+        # carry context variables over to the thread, like asyncio.to_thread does
+        context = contextvars.copy_context()
+
+        def task():
+            wait = time.perf_counter() - submitted_at
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+
+        with self._lock:
+            self._queued += 1
+        future = self._executor.submit(task)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def _on_done(self, future: Future):
+        # work that was cancelled before it started never ran `task`
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            started = self._completed + self._active
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "avg_wait_ms": round(self._total_wait / started * 1000, 2) if started else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 2),
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _pool_size(name: str) -> int:
+    # e.g. EXECUTOR_PROVIDER_WORKERS=32
+    return int(os.environ.get(f"EXECUTOR_{name.upper()}_WORKERS", EXECUTOR_DEFAULT_WORKERS[name]))
+
+
+# provider: blocking Gemini & ElevenLabs calls, mostly waiting on the network
+# codec:    CPU bound image decode/encode & hashing
+# io:       file & session store reads/writes
+executors: Dict[str, BoundedExecutor] = {
+    name: BoundedExecutor(name, _pool_size(name)) for name in EXECUTOR_DEFAULT_WORKERS
+}
+
+
+async def run_in(pool: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs a blocking function on one of the named pools ("provider", "codec" or "io").
+    """
+    return await executors[pool].run(fn, *args, **kwargs)
+
+
+class _PulledIterator:
+    """
+    A blocking iterator pulled item by item from a pool, that can be stopped while an
+    item is being produced: the iterator is then closed right after that item, in
+    the pool thread that produced it, since a running generator can't be closed.
+    """
+
+    def __init__(self, iterator: Iterator[Any], sentinel: Any):
+        self.iterator = iterator
+        self.sentinel = sentinel
+        self._lock = threading.Lock()
+        self._running = False
+        self._stopped = False
+
+    def pull(self) -> Any:
+        with self._lock:
+            if self._stopped:
+                return self.sentinel
+            self._running = True
+        try:
+            return next(self.iterator, self.sentinel)
+        finally:
+            with self._lock:
+                self._running = False
+                close_now = self._stopped
+            if close_now:
+                self.close()
+
+    def stop(self) -> bool:
+        """
+        Stops pulling, returns whether the iterator is idle and can be closed now.
+        """
+        with self._lock:
+            self._stopped = True
+            return not self._running
+
+    def close(self):
+        # e.g. the client disconnected, let a generator clean up after itself
+        close = getattr(self.iterator, "close", None)
+        if close:
+            try:
+                close()
+            except Exception as e:
+                print(f"❌ Failed to close {self.iterator!r}. Error: {e}")
+
+
+async def iterate_in(pool: str, iterator: Iterator[Any]) -> AsyncIterator[Any]:
+    """
+    Iterates a blocking iterator, pulling every item on one of the named pools.
+    The iterator is closed when the iteration ends early, as soon as it's idle.
+    """
+    sentinel = object()
+    pulled = _PulledIterator(iterator, sentinel)
+    try:
+        while True:
+            item = await run_in(pool, pulled.pull)
+            if item is sentinel:
+                break
+            yield item
+    finally:
+        if pulled.stop():
+            await run_in(pool, pulled.close)
+
+
+def executor_stats() -> dict:
+    return {name: executor.stats() for name, executor in executors.items()}
@@ -0,0 +1,261 @@
+import os
+import random
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from api.constants import (GAME_ASSETS_GC_INTERVAL_SECONDS, GAME_ASSETS_MAX_BYTES, GAME_ASSETS_MIN_IDLE_SECONDS,
+                           GAME_ASSETS_TOUCH_SECONDS, GAME_ASSETS_TTL_SECONDS, GAME_SHARD_CHARS)
+from api.provider_gateway import provider_gateway
+
+# Niceness of the collector thread: it deletes files when the CPU & disk have nothing better to do.
+COLLECTOR_NICENESS = 19
+# Pause between two deleted games, so a large collection doesn't hog the disk.
+DELETE_PAUSE_SECONDS = 0.005
+# Games whose last access this worker remembers, to record it at most every `touch_seconds`.
+MAX_TOUCHED_GAMES = 10_000
+
+
+class GameAssets:
+    """
+    The directories of the games' images, from creation to collection.
+
+    A game's files live in `directory/<id[:shard_chars]>/<id>/`, so that no directory
+    holds more than a few thousand entries however many games the node served. The
+    game directory's mtime is the game's last access: writing a file updates it and
+    `touch` (on every request of the game) refreshes it.
+
+    A low priority collector thread, run by one worker of the node per interval,
+    deletes the games idle for longer than `ttl_seconds` and then, while the games
+    take more than `max_bytes`, the least recently played ones (never one played in
+    the last `min_idle_seconds`). Only the bytes a game owns count toward the quota,
+    its hardlinks into the scene cache or the mock pool are accounted there.
+    """
+
+    def __init__(self, directory: Union[str, Path], url_prefix: str, ttl_seconds: float = GAME_ASSETS_TTL_SECONDS,
+                 max_bytes: int = GAME_ASSETS_MAX_BYTES, min_idle_seconds: float = GAME_ASSETS_MIN_IDLE_SECONDS,
+                 shard_chars: int = GAME_SHARD_CHARS, on_collect: Optional[Callable[[str], None]] = None):
+        self.directory = Path(directory)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.min_idle_seconds = min_idle_seconds
+        self.shard_chars = shard_chars
+        # called with the id of every collected game, e.g. to delete its session
+        self.on_collect = on_collect
+        self._touched: "OrderedDict[str, float]" = OrderedDict()
+        # game directory -> (mtime_ns, bytes of the files it owns, (name, inode, size) of its
+        # linked files), so idle games aren't scanned on every pass
+        self._sizes: Dict[str, Tuple[int, int, List[Tuple[str, int, int]]]] = {}
+        self._lock = threading.Lock()
+        self._collector = None
+        self._stats = {"games": 0, "bytes": 0, "expired": 0, "evicted": 0, "migrated": 0,
+                       "collections": 0, "last_collection_s": None}
+
+    # --- Paths & urls ---
+
+    def _relative(self, game_id: str) -> str:
+        return f"{game_id[:self.shard_chars]}/{game_id}"
+
+    def directory_for(self, game_id: str) -> Path:
+        return self.directory / self._relative(game_id)
+
+    def path(self, game_id: str, filename: str) -> Path:
+        """
+        Path of a game file, e.g. `path(game_id, "prologue.png")`.
+        """
+        return self.directory / self._relative(game_id) / filename
+
+    def url(self, game_id: str, filename: str) -> str:
+        """
+        Public url of a game file, served by the static mount of `directory`.
+        """
+        return f"{self.url_prefix}/{self._relative(game_id)}/{filename}"
+
+    def create(self, game_id: str) -> Path:
+        directory = self.directory_for(game_id)
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def touch(self, game_id: str):
+        """
+        Records that the game was just played. A metadata-only update, at most once
+        every `GAME_ASSETS_TOUCH_SECONDS` per game & worker, cheap enough to run inline.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get(game_id, 0.0) < GAME_ASSETS_TOUCH_SECONDS:
+                return
+            self._touched[game_id] = now
+            self._touched.move_to_end(game_id)
+            while len(self._touched) > MAX_TOUCHED_GAMES:
+                self._touched.popitem(last=False)
+        try:
+            os.utime(self.directory_for(game_id))
+        except FileNotFoundError:
+            pass
+
+    # --- Collection ---
+
+    def _games(self) -> Iterator[Tuple[str, str, int]]:
+        """
+        (game id, directory, mtime_ns) of every game. Moves the games of the flat,
+        unsharded layout into their shard and removes leftovers of interrupted deletes.
+        """
+        if not self.directory.is_dir():
+            return
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir(follow_symlinks=False) or entry.name.startswith("."):
+                continue
+            if len(entry.name) > self.shard_chars:
+                migrated = self._migrate(entry.name, entry.path)
+                if migrated is not None:
+                    yield migrated
+                continue
+            for game in os.scandir(entry.path):
+                if not game.is_dir(follow_symlinks=False):
+                    continue
+                if game.name.startswith(".trash-"):
+                    shutil.rmtree(game.path, ignore_errors=True)
+                    continue
+                yield game.name, game.path, game.stat(follow_symlinks=False).st_mtime_ns
+
+    def _migrate(self, game_id: str, path: str) -> Optional[Tuple[str, str, int]]:
+        # a game directory of the flat layout, moved into its shard (keeping its mtime)
+        destination = self.directory_for(game_id)
+        try:
+            os.makedirs(destination.parent, exist_ok=True)
+            os.rename(path, destination)
+        except OSError as e:
+            print(f"❌ Failed to move game {game_id} into its shard. Error: {e}")
+            return None
+        self._stats["migrated"] += 1
+        return game_id, str(destination), destination.stat().st_mtime_ns
+
+    def _owned_bytes(self, path: str, mtime_ns: int) -> int:
+        cached = self._sizes.get(path)
+        if cached is None or cached[0] != mtime_ns:
+            owned, linked = 0, []
+            for entry in os.scandir(path):
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                # a file also linked from a cache or the mock pool is not freed by deleting the game
+                if stat.st_nlink == 1:
+                    owned += stat.st_size
+                else:
+                    linked.append((entry.name, stat.st_ino, stat.st_size))
+            cached = self._sizes[path] = (mtime_ns, owned, linked)
+
+        # ... until the cache evicts its entry, the game is then the file's last link
+        _, owned, linked = cached
+        for name, inode, size in linked:
+            try:
+                stat = os.stat(os.path.join(path, name), follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if stat.st_ino == inode and stat.st_nlink == 1:
+                owned += size
+        return owned
+
+    def _delete(self, game_id: str, path: str, mtime_ns: int) -> bool:
+        """
+        Deletes a game unless it was played since it was scanned.
+        """
+        try:
+            if os.stat(path).st_mtime_ns != mtime_ns:
+                return False
+            # renamed first, so that no request finds a half deleted game
+            trash = Path(path).parent / f".trash-{game_id}-{os.getpid()}"
+            os.rename(path, trash)
+        except FileNotFoundError:
+            return False
+        shutil.rmtree(trash, ignore_errors=True)
+        self._sizes.pop(path, None)
+        if self.on_collect is not None:
+            try:
+                self.on_collect(game_id)
+            except Exception as e:
+                print(f"❌ Failed to forget collected game {game_id}. Error: {e}")
+        time.sleep(DELETE_PAUSE_SECONDS)
+        return True
+
+    def collect(self) -> dict:
+        """
+        One collection pass: expires the idle games, then evicts the least recently
+        played ones down to the quota. Blocking & disk heavy, see `start_collector`.
+        """
+        started = time.perf_counter()
+        now = time.time()
+        expired = evicted = 0
+        games = []
+        for game_id, path, mtime_ns in self._games():
+            if now - mtime_ns / 1e9 > self.ttl_seconds:
+                expired += self._delete(game_id, path, mtime_ns)
+                continue
+            games.append((mtime_ns, game_id, path, self._owned_bytes(path, mtime_ns)))
+
+        total_bytes = sum(game[3] for game in games)
+        # least recently played first
+        for mtime_ns, game_id, path, size in sorted(games):
+            if total_bytes <= self.max_bytes or now - mtime_ns / 1e9 < self.min_idle_seconds:
+                break
+            if size == 0:
+                # only links to shared files (e.g. a mock game), deleting it frees nothing
+                continue
+            if self._delete(game_id, path, mtime_ns):
+                total_bytes -= size
+                evicted += 1
+
+        live = {path for _, _, path, _ in games}
+        for path in [path for path in self._sizes if path not in live]:
+            del self._sizes[path]
+        self._stats.update(games=len(games) - evicted, bytes=total_bytes, collections=self._stats["collections"] + 1,
+                           last_collection_s=round(time.perf_counter() - started, 3))
+        self._stats["expired"] += expired
+        self._stats["evicted"] += evicted
+        if expired or evicted:
+            print(f"🧹 Collected {expired} expired & {evicted} evicted games, "
+                  f"{len(games) - evicted} games use {total_bytes / 1024 ** 2:.0f} MB")
+        return dict(self._stats)
+
+    def start_collector(self, interval_seconds: float = GAME_ASSETS_GC_INTERVAL_SECONDS):
+        """
+        Collects in a low priority background thread, started once per worker. Every
+        worker wakes up once per interval, the first one to claim the interval collects.
+        """
+        if self._collector is not None:
+            return
+
+        def run():
+            _lower_priority()
+            # the first pass soon after startup, at a different time in every worker
+            time.sleep(random.uniform(0.05, 0.25) * interval_seconds)
+            while True:
+                try:
+                    if provider_gateway.claim("game_assets_collection", str(os.getpid()), interval_seconds):
+                        self.collect()
+                except Exception as e:
+                    print(f"❌ Failed to collect game assets. Error: {e}")
+                time.sleep(interval_seconds)
+
+        self._collector = threading.Thread(target=run, name="game-assets-collector", daemon=True)
+        self._collector.start()
+
+    def stats(self) -> dict:
+        """
+        The games & bytes seen by the last collection that ran in this worker.
+        """
+        return {**self._stats, "max_bytes": self.max_bytes, "ttl_seconds": self.ttl_seconds}
+
+
+def _lower_priority():
+    # Linux applies a niceness to a single thread (by its native id), elsewhere it's best effort
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), COLLECTOR_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Tuple, Union
+
+from PIL import Image
+
+from api.constants import REFERENCE_IMAGE_FORMAT, REFERENCE_IMAGE_MAX_DIMENSION, REFERENCE_IMAGE_QUALITY
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def compact_image(
+    image: Image.Image,
+    max_dimension: int = REFERENCE_IMAGE_MAX_DIMENSION,
+    fmt: str = REFERENCE_IMAGE_FORMAT,
+    quality: int = REFERENCE_IMAGE_QUALITY,
+) -> Tuple[bytes, str]:
+    """
+    Downscales an image so that its longest side is at most `max_dimension` and
+    re-encodes it, to keep the payloads sent to the image model small.
+
+    Returns:
+        (encoded bytes, mime type)
+    """
+    if max(image.size) > max_dimension:
+        image = image.copy()
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    if fmt == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue(), MIME_TYPES[fmt]
+
+
+class CachedImage:
+    """
+    An encoded image (as stored on disk & sent to the provider) that is
+    decoded lazily, at most once, when its pixels are actually needed.
+    `path` is a file that already holds exactly `encoded` (e.g. a scene cache
+    entry), so that saving the image elsewhere can be a hardlink instead of a write.
+    """
+
+    def __init__(self, encoded: bytes, mime_type: str = "image/png", image: Optional[Image.Image] = None,
+                 path: Optional[Union[str, Path]] = None):
+        self.encoded = encoded
+        self.mime_type = mime_type
+        self.path = Path(path) if path else None
+        self._image = image
+        self._version = None
+        self._reference: Optional[Tuple[bytes, str]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def image(self) -> Image.Image:
+        with self._lock:
+            if self._image is None:
+                image = Image.open(BytesIO(self.encoded))
+                image.load()
+                self._image = image
+            return self._image
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """
+        (width, height), read from the image header without decoding the pixels.
+        """
+        if self._image is not None:
+            return self._image.size
+        return Image.open(BytesIO(self.encoded)).size
+
+    @property
+    def version(self) -> str:
+        """
+        Short content hash, used to version image urls.
+        """
+        if self._version is None:
+            self._version = hashlib.sha256(self.encoded).hexdigest()[:16]
+        return self._version
+
+    @property
+    def part(self) -> "types.Part":
+        """
+        The image as a provider-ready content part, no re-encoding needed.
+        """
+        return _content_part(self.encoded, self.mime_type)
+
+    def reference_part(self) -> "types.Part":
+        """
+        The image as a compacted content part for the image model (see `compact_image`).
+        Encoded once per image and kept, CPU heavy the first time so run it on the codec pool.
+        """
+        if self._reference is None:
+            encoded, mime_type = compact_image(self.image)
+            if len(encoded) >= len(self.encoded):
+                # already small, e.g. a low resolution mock image
+                encoded, mime_type = self.encoded, self.mime_type
+            self._reference = (encoded, mime_type)
+        return _content_part(*self._reference)
+
+    @property
+    def resident_bytes(self) -> int:
+        size = len(self.encoded)
+        if self._reference is not None and self._reference[0] is not self.encoded:
+            size += len(self._reference[0])
+        if self._image is not None:
+            size += self._image.width * self._image.height * len(self._image.getbands())
+        return size
+
+    def as_png(self) -> "CachedImage":
+        """
+        This image if it's a PNG, otherwise a PNG re-encoding of it (game assets are PNGs).
+        """
+        if self.mime_type == "image/png":
+            return self
+        return CachedImage.from_image(self.image)
+
+    @classmethod
+    def from_image(cls, image: Image.Image) -> "CachedImage":
+        """
+        Encodes a PIL image to PNG once and keeps both forms.
+        """
+        buffer = BytesIO()
+        image.save(buffer, format="PNG")
+        return cls(buffer.getvalue(), "image/png", image)
+
+
+class ImageLRU:
+    """
+    A per-worker, memory-bounded LRU of game images (character sheets & scenes)
+    keyed by (game_id, name), so that consecutive steps of a game skip the PNG
+    decode and re-encode. Entries remember the file's inode & size and are
+    reloaded if another worker replaced the file.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[CachedImage, tuple]]" = OrderedDict()
+
+    def put(self, game_id: str, name: str, cached_image: CachedImage, path: str):
+        signature = _file_signature(path)
+        with self._lock:
+            self._entries[(game_id, name)] = (cached_image, signature)
+            self._entries.move_to_end((game_id, name))
+            self._evict()
+
+    def load(self, game_id: str, name: str, path: str) -> CachedImage:
+        """
+        Returns the cached image, reading it from `path` on a miss.
+        """
+        key = (game_id, name)
+        signature = _file_signature(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        with open(path, "rb") as f:
+            cached_image = CachedImage(f.read())
+        with self._lock:
+            self._entries[key] = (cached_image, signature)
+            self._entries.move_to_end(key)
+            self._evict()
+        return cached_image
+
+    def drop_game(self, game_id: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == game_id]:
+                del self._entries[key]
+
+    def _resident_bytes(self) -> int:
+        return sum(entry[0].resident_bytes for entry in self._entries.values())
+
+    def _evict(self):
+        # called with the lock held, never evicts the most recent entry
+        resident_bytes = self._resident_bytes()
+        while resident_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (cached_image, _) = self._entries.popitem(last=False)
+            resident_bytes -= cached_image.resident_bytes
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self._resident_bytes(),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _file_signature(path: str) -> tuple:
+    # game files are only ever replaced (by a rename), never written into, so a new
+    # content is a new inode; the mtime isn't used since a file linked from the scene
+    # cache shares the cache entry's, touched on every cache hit
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino, stat.st_size
+
+
+def _content_part(data: bytes, mime_type: str) -> "types.Part":
+    # google.genai takes ~0.5s to import, only import it once an image is sent to the model
+    from google.genai import types
+    return types.Part.from_bytes(data=data, mime_type=mime_type)
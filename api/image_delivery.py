@@ -0,0 +1,118 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from PIL import Image, features
+
+from api.constants import IMAGE_AVIF_ENABLED, IMAGE_AVIF_QUALITY, IMAGE_VARIANT_WIDTHS, IMAGE_WEBP_QUALITY
+
+# format -> (mime type, PIL save options), in order of preference
+VARIANT_FORMATS = {
+    "avif": ("image/avif", {"quality": IMAGE_AVIF_QUALITY}),
+    "webp": ("image/webp", {"quality": IMAGE_WEBP_QUALITY, "method": 4}),
+}
+
+# Variant urls are versioned with the image content, so they can be cached forever.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def enabled_formats() -> List[str]:
+    formats = []
+    if IMAGE_AVIF_ENABLED and features.check("avif"):
+        formats.append("avif")
+    if features.check("webp"):
+        formats.append("webp")
+    return formats
+
+
+def variant_path(directory: Union[str, Path], name: str, width: int, fmt: str) -> Path:
+    return Path(directory, f"{name}.{width}.{fmt}")
+
+
+def variant_widths(original_width: int) -> List[int]:
+    """
+    The configured widths that don't upscale the original, plus the original
+    width itself when it's smaller than the largest configured width.
+    """
+    widths = [width for width in IMAGE_VARIANT_WIDTHS if width < original_width]
+    if original_width <= IMAGE_VARIANT_WIDTHS[-1]:
+        widths.append(original_width)
+    return widths or [IMAGE_VARIANT_WIDTHS[-1]]
+
+
+def build_variants(image: Image.Image, directory: Union[str, Path], name: str) -> List[Path]:
+    """
+    Saves compressed, resized variants of an image next to the original.
+    CPU heavy, run it on the codec pool.
+    """
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+
+    paths = []
+    for width in variant_widths(image.width):
+        height = round(image.height * width / image.width)
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for fmt in enabled_formats():
+            path = variant_path(directory, name, width, fmt)
+            # write to a temp file first so a half-written variant is never served,
+            # unique per builder since two workers may build the same variants
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    resized.save(f, format=fmt.upper(), **VARIANT_FORMATS[fmt][1])
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+            paths.append(path)
+    return paths
+
+
+def negotiate_format(accept: Optional[str]) -> Optional[str]:
+    """
+    Picks the best variant format the browser accepts, None for the original png.
+    """
+    accept = accept or ""
+    for fmt in enabled_formats():
+        if VARIANT_FORMATS[fmt][0] in accept:
+            return fmt
+    return None
+
+
+def find_variant(directory: Union[str, Path], name: str, width: Optional[int],
+                 fmt: str) -> Optional[Tuple[Path, int]]:
+    """
+    The smallest existing variant at least `width` wide (or the largest one).
+    Returns (path, width) or None if no variant was built yet.
+    """
+    available = sorted(int(path.name.split(".")[-2])
+                       for path in Path(directory).glob(f"{name}.*.{fmt}"))
+    if not available:
+        return None
+    chosen = available[-1]
+    if width:
+        chosen = next((w for w in available if w >= width), available[-1])
+    return variant_path(directory, name, chosen, fmt), chosen
+
+
+def srcset(base_url: str, version: str, original_width: Optional[int] = None) -> str:
+    """
+    A `srcset` attribute for the variants served from `base_url`.
+    """
+    widths = variant_widths(original_width) if original_width else list(IMAGE_VARIANT_WIDTHS)
+    return ", ".join(f"{base_url}?w={width}&v={version} {width}w" for width in widths)
+
+
+def etag_for(path: Union[str, Path]) -> str:
+    """
+    An ETag for a game image or variant, from its inode & size: the files are
+    replaced rather than rewritten, and a scene linked from the scene cache gets
+    its mtime touched by every cache hit.
+    """
+    stat = os.stat(path)
+    return f'"{stat.st_ino:x}-{stat.st_size:x}"'
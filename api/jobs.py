@@ -0,0 +1,171 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from api.executors import run_in
+from api.session_store import SessionStore
+
+# Events a step job publishes, in the order they usually arrive.
+NARRATION_READY = "narration_ready"
+IMAGE_READY = "image_ready"
+STEP_COMPLETE = "step_complete"
+JOB_FAILED = "error"
+FINAL_EVENTS = (STEP_COMPLETE, JOB_FAILED)
+
+Event = Tuple[int, str, Dict[str, Any]]
+
+
+class JobBoard:
+    """
+    Tracks background step jobs and their progress events.
+
+    Jobs & events are written to the game session, so a client can follow a
+    job from any worker (e.g. its event stream landed on another worker than
+    the job). The worker running the job also keeps the events in memory and
+    wakes its local subscribers right away, other workers poll the session.
+    """
+
+    def __init__(self, session_store: SessionStore, poll_seconds: float = 0.25, max_jobs_per_game: int = 10):
+        self.session_store = session_store
+        self.poll_seconds = poll_seconds
+        self.max_jobs_per_game = max_jobs_per_game
+        # job id -> event id -> event, the ids are assigned by the session
+        self._events: Dict[str, Dict[int, Event]] = {}
+        self._conditions: Dict[str, asyncio.Condition] = {}
+        self._tasks = set()
+
+    async def create(self, game_id: str, kind: str, step_id: str) -> str:
+        job_id = uuid.uuid4().hex
+
+        def mutate(session):
+            jobs = session.setdefault("jobs", {})
+            jobs[job_id] = {"kind": kind, "step_id": step_id, "status": "running",
+                            "events": [], "created_at": time.time()}
+            # only keep the most recent jobs of the game
+            for old_job_id in sorted(jobs, key=lambda key: jobs[key]["created_at"])[:-self.max_jobs_per_game]:
+                del jobs[old_job_id]
+
+        await run_in("io", self.session_store.update, game_id, mutate)
+        self._events[job_id] = {}
+        self._conditions[job_id] = asyncio.Condition()
+        return job_id
+
+    def start(self, game_id: str, job_id: str, work):
+        """
+        Runs the `work` coroutine in the background. A failure is published as an
+        `error` event, and the in-memory events are dropped once the job is done
+        (late subscribers read them from the session).
+        """
+        async def run():
+            try:
+                await work
+            except Exception as e:
+                print(f"❌ Job {job_id} failed. Error: {e}")
+                await self.publish(game_id, job_id, JOB_FAILED, {"error": str(e)})
+            finally:
+                # give the local subscribers a moment to drain the last events
+                await asyncio.sleep(self.poll_seconds)
+                self._events.pop(job_id, None)
+                condition = self._conditions.pop(job_id, None)
+                if condition is not None:
+                    async with condition:
+                        condition.notify_all()
+
+        task = asyncio.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def publish(self, game_id: str, job_id: str, event: str, data: Dict[str, Any]):
+        event_id = None
+
+        def mutate(session):
+            nonlocal event_id
+            job = session.get("jobs", {}).get(job_id)
+            if job is None:
+                return
+            job["events"].append({"event": event, "data": data})
+            # the event's position in the session, whatever order concurrent publishes end in
+            event_id = len(job["events"])
+            if event in FINAL_EVENTS:
+                job["status"] = "failed" if event == JOB_FAILED else "complete"
+
+        await run_in("io", self.session_store.update, game_id, mutate)
+
+        events = self._events.get(job_id)
+        if events is not None and event_id is not None:
+            events[event_id] = (event_id, event, data)
+            condition = self._conditions[job_id]
+            async with condition:
+                condition.notify_all()
+
+    async def subscribe(self, game_id: str, job_id: str, last_event_id: int = 0) -> AsyncIterator[Event]:
+        """
+        Yields the job's events (id, event, data) after `last_event_id`, until the job ends.
+        """
+        sent = last_event_id
+        while True:
+            events = await self._read(game_id, job_id, sent)
+            if events is None:
+                yield sent + 1, JOB_FAILED, {"error": "Job not found"}
+                return
+            for event in events:
+                sent = event[0]
+                yield event
+                if event[1] in FINAL_EVENTS:
+                    return
+
+    async def _read(self, game_id: str, job_id: str, after: int) -> Optional[List[Event]]:
+        # waits until there are events after `after`, None if the job doesn't exist
+        condition = self._conditions.get(job_id)
+        if condition is not None:
+            async with condition:
+                await condition.wait_for(lambda: after + 1 in self._events.get(job_id, ())
+                                         or job_id not in self._events)
+            events = self._events.get(job_id)
+            if events is not None:
+                # the events without gaps, a later one may land before an earlier one
+                read = []
+                while after + len(read) + 1 in events:
+                    read.append(events[after + len(read) + 1])
+                return read
+
+        while True:
+            session = await run_in("io", self.session_store.get_fresh, game_id)
+            job = (session or {}).get("jobs", {}).get(job_id)
+            if job is None:
+                return None
+            if len(job["events"]) > after:
+                return [(index, event["event"], event["data"])
+                        for index, event in enumerate(job["events"], start=1)][after:]
+            await asyncio.sleep(self.poll_seconds)
+
+
+def format_sse(event_id: int, event: str, data: Dict[str, Any]) -> str:
+    """
+    A server-sent event, see https://html.spec.whatwg.org/multipage/server-sent-events.html
+    """
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def sse_stream(events: AsyncIterator[Event], keepalive_seconds: float = 15.0) -> AsyncIterator[str]:
+    """
+    Formats events as server-sent events, with a keep-alive comment whenever
+    nothing happened for `keepalive_seconds` so that proxies don't drop the connection.
+    """
+    next_event = asyncio.ensure_future(events.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_event}, timeout=keepalive_seconds)
+            if not done:
+                yield ": keep-alive\n\n"
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield format_sse(*event)
+            next_event = asyncio.ensure_future(events.__anext__())
+    finally:
+        next_event.cancel()
@@ -1,29 +1,83 @@
 
+# Imported first: the startup profile times the app import from here.
+from api.startup import IMPORT_STARTED, startup_profile
+from dotenv import load_dotenv
+# once, before the modules below read their settings from the environment
+load_dotenv()
 import asyncio
-from fastapi import FastAPI, UploadFile, File, Form
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from PIL import Image
-import io
 import uuid
 import json
-import shutil
-
-from api.character_generator import generate_character_asset, generate_fictional_character_asset
-from api.constants import GAME_DATA_DIR
-from api.narration_generator import generate_narration
-from api.scene_generator import generate_scene
+import re
+import time
+
+from api.character_generator import generate_character_asset_async, generate_fictional_character_asset_async
+from api.cache import DiskLRUCache, link_file, write_file
+from api.game_assets import GameAssets
+from api.executors import executor_stats, run_in
+from api.constants import NARRATION_CACHE_DIR, NARRATION_PRERENDER_DIR, DEFAULT_SESSION_STORE_URL, GAME_DATA_DIR, IMAGE_CACHE_MAX_BYTES, PREFETCH_BUDGET_PER_GAME, PREFETCH_MAX_CONCURRENCY, PREGENERATE_BUDGET_PER_GAME, PREGENERATE_CONCURRENCY_PER_GAME, PREGENERATE_MAX_CONCURRENCY, SCENE_CACHE_DIR, SCENE_CACHE_MAX_BYTES
+from api.image_cache import CachedImage, ImageLRU
+from api.mock_assets import PooledImage, mock_asset_pool
+from api.metrics import CACHE_HITS, CACHE_MISSES, EXECUTOR_ACTIVE, EXECUTOR_QUEUE_DEPTH, MetricsMiddleware, registry, span
+from api.jobs import IMAGE_READY, NARRATION_READY, STEP_COMPLETE, JobBoard, sse_stream
+from api.image_delivery import IMMUTABLE_CACHE_CONTROL, VARIANT_FORMATS, build_variants, etag_for, find_variant, negotiate_format, srcset
+from api.narration_generator import cached_narration, generate_narration, narration_cache, narration_cache_key, narration_url, stream_narration
+from api.prefetch import PrefetchEngine
+from api.pregenerate import StoryPregenerator
+from api.provider_gateway import provider_gateway, single_flight
+from api.providers import provider_clients
+from api.scene_generator import generate_scene_async, scene_cache_key
+from api.session_store import create_session_store
 from api.story_generator import generate_story
-from api.schemas import Story
-from google import genai
+from api.story_index import get_story_index
 import os
-from dotenv import load_dotenv
-load_dotenv()
+
+
+async def warm_up():
+    """
+    Runs in the background once the worker serves requests, so that the first game
+    doesn't pay for it: imports the provider SDKs & creates the clients (off the event
+    loop), then pre-opens the provider connections or, in mock mode, reads the mock images.
+    """
+    try:
+        with startup_profile.phase("provider_clients"):
+            await run_in("io", provider_clients.start)
+        if mock:
+            # read the mock images once, mock games then run at memory speed
+            with startup_profile.phase("mock_assets"):
+                await run_in("io", mock_asset_pool.preload)
+        elif warm_up_connections:
+            with startup_profile.phase("provider_connections"):
+                await provider_clients.connect()
+        startup_profile.mark_warm()
+    except Exception as e:
+        print(f"❌ Warm-up failed. Error: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    with startup_profile.phase("lifespan"):
+        # per worker: flush this worker's metrics for the /metrics scrapes served by the others
+        registry.start_flusher()
+        # per worker too, but only one of them collects the node's games per interval
+        game_assets.start_collector()
+    startup_profile.mark_ready()
+    # the game collector's thread hands the collected games over to this loop
+    app.state.event_loop = asyncio.get_running_loop()
+    # one set of async provider clients (& connection pools) per worker, created after
+    # the fork so that a preloaded app never shares sockets between workers
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    warm_up_task.cancel()
+    await provider_clients.close()
 
 
 # Create an instance of the FastAPI class
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # --- Middleware ---
 # This is crucial for allowing our React frontend (on a different URL)
@@ -41,45 +95,337 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods (GET, POST, etc.)
     allow_headers=["*"],  # Allows all headers
 )
+# Request latency & in-flight requests, exported on /metrics.
+app.add_middleware(MetricsMiddleware)
 
-# In-memory storage for game states (for simplicity in a hackathon)
-# A real app would use a database.
-game_states = {}
 mock = False
+# Return a streaming narration url instead of waiting for the whole mp3 when the player is waiting.
+stream_audio = True
+# Render the whole story in the background while the player reads the prologue.
+pregenerate_story = os.environ.get("PREGENERATE_STORY", "0") == "1"
+# Open the provider connections (TLS handshakes) in the startup warm-up instead of on the first calls.
+warm_up_connections = os.environ.get("PROVIDER_WARM_UP", "1") == "1"
+
+# All pregenerated stories, loaded once at startup. Games reference them by key.
+story_index = get_story_index()
+
+# Game sessions (story reference, current step, generated assets & timings) shared by all workers.
+session_store = create_session_store(
+    os.environ.get("SESSION_STORE_URL", DEFAULT_SESSION_STORE_URL))
+
+# Renders both children of the current step in the background while the player reads.
+prefetch_engine = PrefetchEngine(
+    budget_per_game=PREFETCH_BUDGET_PER_GAME, max_concurrency=PREFETCH_MAX_CONCURRENCY)
+
+# Renders every step of a new game's story, most likely first, when `pregenerate_story` is on.
+story_pregenerator = StoryPregenerator(
+    budget_per_game=PREGENERATE_BUDGET_PER_GAME, concurrency_per_game=PREGENERATE_CONCURRENCY_PER_GAME,
+    max_concurrency=PREGENERATE_MAX_CONCURRENCY)
+
+# Generated scenes shared across games, so replaying a story with the same hero skips the image model.
+scene_cache = DiskLRUCache(SCENE_CACHE_DIR, max_bytes=SCENE_CACHE_MAX_BYTES, suffix=".png")
+
+# Character sheets & scenes of recent games, kept encoded (provider-ready) and decoded on demand.
+image_cache = ImageLRU(max_bytes=IMAGE_CACHE_MAX_BYTES)
+
+# Background step jobs (/api/jobs/...) and their progress events, followed from any worker.
+job_board = JobBoard(session_store)
+
+# Background jobs building the WebP/AVIF variants of saved images.
+variant_tasks = set()
+
+
+def _forget_game(game_id):
+    # a collected game's session goes with its images, its requests then answer "Game not found"
+    session_store.delete(game_id)
+    image_cache.drop_game(game_id)
+    # runs in the collector's thread, the background renders live on the event loop
+    loop = getattr(app.state, "event_loop", None)
+    if loop is not None and not loop.is_closed():
+        loop.call_soon_threadsafe(_forget_background_work, game_id)
+
+
+def _forget_background_work(game_id):
+    # cancels a game's prefetches & pre-generation, and drops their budgets & scenes
+    prefetch_engine.forget(game_id)
+    story_pregenerator.forget(game_id)
 
-# read api key
-API_KEY = os.environ.get("GEMINI_API_KEY")
 
+# Game directories, sharded by game id, collected once idle for a while or over the disk quota.
+game_assets = GameAssets(GAME_DATA_DIR, "/assets/games", on_collect=_forget_game)
 
-# configure the client with your API key
-client = genai.Client(api_key=API_KEY)
 
-# Ensure the 'static' directory exists for saving images
-os.makedirs("static/games", exist_ok=True)
-os.makedirs("data/games", exist_ok=True)
-os.makedirs("assets/games", exist_ok=True)
+def _collect_stats():
+    # exports the pool & cache stats with the metrics
+    for pool, stats in executor_stats().items():
+        EXECUTOR_QUEUE_DEPTH.set(stats["queue_depth"], pool=pool)
+        EXECUTOR_ACTIVE.set(stats["active"], pool=pool)
+    for name, cache in (("scene", scene_cache), ("narration", narration_cache), ("image", image_cache)):
+        stats = cache.stats()
+        CACHE_HITS.set(stats["hits"], cache=name)
+        CACHE_MISSES.set(stats["misses"], cache=name)
+
+
+registry.add_collector(_collect_stats)
+
+# Ensure the game assets directory exists, it is mounted below
+os.makedirs(GAME_DATA_DIR, exist_ok=True)
 # app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+# --- Helpers ---
+async def _load_game(game_id):
+    """
+    Reads the game's session and resolves its story from the story index.
+    Returns (session, story) or None if the game doesn't exist.
+    """
+    session = await run_in("io", session_store.get, game_id)
+    if not session:
+        return None
+    # keeps the game's assets from being collected while it's played
+    game_assets.touch(game_id)
+    with span("story_load"):
+        story = story_index.get(session["story_key"])
+    return session, story
+
+
+async def _record_step(game_id, step_id, previous_step_id, narration_audio_url, render_seconds):
+    """
+    Records a rendered step in the game session, so any worker can serve it.
+    """
+    def mutate(session):
+        session["assets"][step_id] = {
+            "scene": f"{step_id}.png",
+            "narration_url": narration_audio_url,
+            "previous_step_id": previous_step_id,
+        }
+        session["timings"][step_id] = round(render_seconds, 3)
+
+    await run_in("io", session_store.update, game_id, mutate)
+
+
+async def _set_current_step(game_id, step_id):
+    def mutate(session):
+        session["current_step_id"] = step_id
+
+    await run_in("io", session_store.update, game_id, mutate)
+
+
+def _image_srcset(game_id, name, cached_image):
+    """
+    `srcset` of the responsive variants of a game image, versioned by its content.
+    """
+    return srcset(f"/api/images/{game_id}/{name}", cached_image.version, cached_image.size[0])
+
+
+def _image_urls(game_id, step_id, scene=None):
+    urls = {"scene_image_url": game_assets.url(game_id, f"{step_id}.png")}
+    if scene:
+        urls["scene_image_srcset"] = _image_srcset(game_id, step_id, scene)
+    return urls
+
+
+def _step_response(game_id, step, narration_audio_url=None, scene=None):
+    """
+    Builds the json returned to the frontend for a story node.
+    """
+    return_data = step.model_dump(exclude_none=True)
+    return_data.update(_image_urls(game_id, step.id, scene))
+    return_data["character_sheet_url"] = game_assets.url(game_id, "character_sheet.png")
+    if narration_audio_url:
+        return_data["narration_audio_url"] = narration_audio_url
+    return return_data
+
+
+async def _load_image(game_id, name):
+    """
+    Loads a game image (e.g. "character_sheet" or a step id) through the image cache.
+    """
+    with span("image_load"):
+        return await run_in("io", image_cache.load, game_id, name, game_assets.path(game_id, f"{name}.png"))
+
+
+def _write_image(game_id, name, cached_image):
+    image_path = game_assets.path(game_id, f"{name}.png")
+    linked = False
+    if cached_image.path is not None:
+        try:
+            # the bytes are already on disk (scene cache, mock pool), link them instead of writing them again
+            link_file(cached_image.path, image_path)
+            linked = True
+        except FileNotFoundError:
+            # evicted from the scene cache in the meantime
+            pass
+    if not linked:
+        write_file(image_path, cached_image.encoded)
+    image_cache.put(game_id, name, cached_image, image_path)
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _as_png(image):
+    """
+    A generated image as a PNG CachedImage, only encoded when the provider sent another format.
+    """
+    if isinstance(image, CachedImage) and image.mime_type == "image/png":
+        return image
+    with span("png_encode"):
+        if isinstance(image, CachedImage):
+            return await run_in("codec", image.as_png)
+        return await run_in("codec", CachedImage.from_image, image)
+
+
+async def _save_image(game_id, name, image):
+    """
+    Writes a generated image to the game directory in one write (or a hardlink) and
+    keeps it in the image cache for the next steps of the game.
+    """
+    cached_image = await _as_png(image)
+    with span("png_save"):
+        await run_in("io", _write_image, game_id, name, cached_image)
+
+    # build the compressed variants in the background, the original is served until they exist
+    task = asyncio.create_task(_build_variants(game_id, name, cached_image))
+    variant_tasks.add(task)
+    task.add_done_callback(variant_tasks.discard)
+    return cached_image
+
+
+async def _build_variants(game_id, name, cached_image):
+    try:
+        with span("image_variants"):
+            if isinstance(cached_image, PooledImage):
+                await run_in("codec", mock_asset_pool.link_variants, cached_image, game_assets.directory_for(game_id), name)
+            else:
+                await run_in("codec", build_variants, cached_image.image, game_assets.directory_for(game_id), name)
+    except Exception as e:
+        print(f"❌ Failed to build image variants for {game_id}/{name}. Error: {e}")
+
+
+async def _generate_scene_cached(game_id, theme, step_id, story, character_sheet, previous_scene, is_prologue=False):
+    """
+    Generates a scene through the shared scene cache and saves it to the game directory.
+    The character sheet & previous scene are CachedImages, compacted before they are
+    sent to the provider.
+    """
+    if mock:
+        # mock scenes are read from disk
+        with span("scene_generation"):
+            scene = await generate_scene_async(theme, step_id, story, None, None, provider_clients.gemini,
+                                               mock=mock, is_prologue=is_prologue)
+        return await _save_image(game_id, step_id, scene)
+
+    # the cache key covers the exact images that go into the prompt
+    character_sheet_bytes = None if is_prologue else character_sheet.encoded
+    previous_scene_bytes = previous_scene.encoded if previous_scene else None
+    cache_key = await run_in("codec", scene_cache_key, theme, step_id, story,
+                             character_sheet_bytes, previous_scene_bytes)
+
+    async def cached():
+        with span("scene_cache_lookup"):
+            cached_scene_path = await run_in("io", scene_cache.get, cache_key)
+            if not cached_scene_path:
+                return None
+            return CachedImage(await run_in("io", _read_bytes, cached_scene_path), path=cached_scene_path)
+
+    async def generate():
+        # only compact the reference images on a cache miss, the prologue doesn't use them
+        character_sheet_part = None if is_prologue else await run_in("codec", character_sheet.reference_part)
+        previous_scene_part = await run_in("codec", previous_scene.reference_part) if previous_scene else None
+        with span("scene_generation"):
+            scene = await generate_scene_async(theme, step_id, story, character_sheet_part, previous_scene_part,
+                                               provider_clients.gemini, mock=mock, is_prologue=is_prologue)
+        generated_scene = await _as_png(scene)
+        generated_scene.path = await run_in("io", scene_cache.put_bytes, cache_key, generated_scene.encoded)
+        return generated_scene
+
+    cached_scene = await cached()
+    if cached_scene:
+        print(f"♻️ Scene cache hit for step: {step_id}")
+    else:
+        # identical renders in flight (e.g. a double-clicked choice) share one provider call
+        cached_scene = await single_flight.run(cache_key, generate, lookup=cached)
+    return await _save_image(game_id, step_id, cached_scene)
+
+
+async def _render_step(game_id, theme, step_id, story, character_sheet, previous_scene, previous_step_id=None,
+                       stream=False, publish=None):
+    """
+    Generates the scene image & narration for a step in parallel and saves the image
+    to the game directory. Returns the scene (a CachedImage) and the narration url.
+    With `stream`, narration that isn't cached yet is returned as a streaming url
+    so that playback can start before the synthesis is done.
+    `publish(event, data)` is awaited as soon as each of them is ready.
+    """
+    step = story.node(step_id)
+    started_at = time.perf_counter()
+
+    async def image_task():
+        scene = await _generate_scene_cached(game_id, theme, step_id,
+                                             story, character_sheet, previous_scene)
+        if publish:
+            await publish(IMAGE_READY, _image_urls(game_id, step_id, scene))
+        return scene
+
+    async def audio_task():
+        if stream:
+            narration_audio_url = narration_url(narration_cache_key(step.narration), game_id, step_id)
+        else:
+            narration_audio_url = await generate_narration(step.narration, game_id, step_id)
+        if publish:
+            await publish(NARRATION_READY, {"narration_audio_url": narration_audio_url})
+        return narration_audio_url
+
+    # Run both tasks at the same time and wait for them both to complete
+    scene, narration_audio_url = await asyncio.gather(image_task(), audio_task())
+
+    await _record_step(game_id, step_id, previous_step_id, narration_audio_url,
+                       time.perf_counter() - started_at)
+    return scene, narration_audio_url
+
+
+def _prefetch_children(game_id, theme, step_id, story, character_sheet, scene):
+    """
+    Starts rendering every step reachable with one choice from `step_id`,
+    using the scene that is currently shown for continuity.
+    """
+    if story.node(step_id).is_ending:
+        prefetch_engine.forget(game_id)
+        story_pregenerator.forget(game_id)
+        return
+
+    for child_id in story.children[step_id]:
+        if story_pregenerator.covers(game_id, child_id, step_id):
+            # already rendered (or rendering) by the whole-story pre-generation
+            continue
+        prefetch_engine.schedule(game_id, child_id, lambda child_id=child_id: _render_step(
+            game_id, theme, child_id, story, character_sheet, scene, step_id))
+
+
 # --- API Endpoints ---
 @app.post("/api/restart_game")
 async def restart_game(game_id: str = Form(...)):
     """
     Restarts a game that has already been created.
     """
-    current_game_path = os.path.join(GAME_DATA_DIR, game_id)
-    if not os.path.exists(current_game_path):
-        return {"error": "Game not found"}, 404
+    game = await _load_game(game_id)
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+    session, story = game
 
-    with open(f"{current_game_path}/story.json", "r") as f:
-        story_data = json.load(f)
+    # the player is going back to the start, drop any speculative work
+    prefetch_engine.forget(game_id)
+    await _set_current_step(game_id, story.start_id)
 
-    step_id = story_data["story_tree"][0]["id"]
-    return_data = story_data["story_tree"][0]
-    return_data["scene_image_url"] = f"/assets/games/{game_id}/{step_id}.png"
-    return_data["character_sheet_url"] = f"/assets/games/{game_id}/character_sheet.png"
-
-    return {"game_id": game_id, "step": return_data}
+    try:
+        start_scene = await _load_image(game_id, story.start_id)
+    except FileNotFoundError:
+        # the start scene isn't rendered yet (e.g. its job failed), send the step without its srcset
+        start_scene = None
+    return {"game_id": game_id, "step": _step_response(game_id, story.node(story.start_id), scene=start_scene)}
 
 
 @app.post("/api/prologue")
@@ -96,77 +442,169 @@ async def prologue(
     game_id = str(uuid.uuid4())
 
     # create game_id folder to store details
-    current_game_path = os.path.join(GAME_DATA_DIR, game_id)
-    os.makedirs(current_game_path, exist_ok=True)
+    await run_in("io", game_assets.create, game_id)
 
     print(f"Starting prologue with ID: {game_id}")
 
     # Step 1 - Generate Story
-    story_data = generate_story(
-        theme=theme, step_count=3, client=client, mock=mock)
-    story_data["theme"] = theme
+    with span("story_load"):
+        story = generate_story(
+            theme=theme, step_count=3, client=provider_clients.gemini, mock=mock)
 
-    # save story to game data json
-    with open(f"{current_game_path}/story.json", "w") as f:
-        json.dump(story_data, f, indent=4)
+    # save a reference to the story (not a copy of it) in the game session
+    await run_in("io", session_store.put, game_id, {
+        "game_id": game_id,
+        "theme": theme,
+        "story_key": story.key,
+        "current_step_id": None,
+        "assets": {},
+        "timings": {},
+        "created_at": time.time(),
+    })
 
     # Step 2 - Generate Character Asset
     if selfie_file:
         # Read the uploaded file's content
         contents = await selfie_file.read()
 
-        # Open the image using PIL from the in-memory bytes
-        image = Image.open(io.BytesIO(contents))
+        # Downscale & re-encode the selfie, phone photos are much larger than the model needs
+        with span("selfie_decode"):
+            selfie = CachedImage(contents, selfie_file.content_type or "image/png")
+            selfie_part = await run_in("codec", selfie.reference_part)
 
         # Generate the character asset
-        character_asset = generate_character_asset(
-            theme=theme, gender=gender, selfie_image=image, client=client, mock=mock
-        )
+        with span("character_generation"):
+            character_asset = await generate_character_asset_async(
+                theme=theme, gender=gender, selfie_image=selfie_part, client=provider_clients.gemini, mock=mock
+            )
     else:
         # Use a mock character sheet for fictional characters
-        character_asset = generate_fictional_character_asset(theme=theme, animal=animal, personalities=json.loads(
-            personalities), accessories=json.loads(accessories), client=client, mock=mock)
+        with span("character_generation"):
+            character_asset = await generate_fictional_character_asset_async(
+                theme=theme, animal=animal, personalities=json.loads(personalities),
+                accessories=json.loads(accessories), client=provider_clients.gemini, mock=mock)
 
     # save character_asset to game data
-    character_asset_image_path = f"{current_game_path}/character_sheet.png"
-    character_asset.save(character_asset_image_path)
+    character_sheet = await _save_image(game_id, "character_sheet", character_asset)
+
+    if pregenerate_story:
+        # each step continues from the scene of the step it was rendered after
+        story_pregenerator.start(game_id, story, lambda step_id, parent_id, parent_result: _render_step(
+            game_id, theme, step_id, story, character_sheet, parent_result[0] if parent_result else None, parent_id))
 
     # Step 3 - Generate Prologue Assets
-    prologue_text = story_data.get("prologue", "The adventure begins....")
+    prologue_text = story.story.prologue or "The adventure begins...."
 
     # Create parallel tasks for generating prologue image and narration
-    prologue_image_task = asyncio.to_thread(
-        generate_scene,
+    prologue_image_task = _generate_scene_cached(
+        game_id,
         theme,
         "prologue",
-        story_data,
-        character_asset,
+        story,
+        character_sheet,
         None,
-        client,
-        mock=mock,
         is_prologue=True
     )
-    prologue_narration_task = generate_narration(
-        prologue_text, game_id, "prologue_narration")
-
-    # Run both tasks at the same time
-    prologue_image, prologue_narration_url = await asyncio.gather(
-        prologue_image_task, prologue_narration_task
-    )
+    if stream_audio:
+        prologue_image = await prologue_image_task
+        prologue_narration_url = narration_url(narration_cache_key(prologue_text), game_id, "prologue")
+    else:
+        prologue_narration_task = generate_narration(
+            prologue_text, game_id, "prologue")
 
-    # Save the generated assets
-    prologue_image_path = f"{current_game_path}/prologue.png"
-    prologue_image.save(prologue_image_path)
+        # Run both tasks at the same time, the prologue image is saved by the scene task
+        prologue_image, prologue_narration_url = await asyncio.gather(
+            prologue_image_task, prologue_narration_task
+        )
 
     return {
         "game_id": game_id,
         "theme": theme,
-        "prologue_image_url": f"/assets/games/{game_id}/prologue.png",
+        "prologue_image_url": game_assets.url(game_id, "prologue.png"),
+        "prologue_image_srcset": _image_srcset(game_id, "prologue", prologue_image),
         "prologue_narration_url": prologue_narration_url,
         "prologue": prologue_text
     }
 
 
+async def _play_step(game_id, theme, story, step_id, previous_step_id=None, publish=None):
+    """
+    Makes `step_id` the current step of the game and returns its step response.
+    The scene & narration are the prefetched ones if we have them, otherwise they
+    are rendered now; `publish(event, data)` is awaited as soon as each is ready.
+    """
+    character_sheet = await _load_image(game_id, "character_sheet")
+
+    # serve the prefetched scene & narration if we have one, this also
+    # cancels the prefetch of the branch the player didn't pick
+    prefetch_task = prefetch_engine.claim(game_id, step_id)
+    if prefetch_task is None:
+        prefetch_task = story_pregenerator.claim(game_id, step_id, previous_step_id)
+    scene = None
+    if prefetch_task is not None and not prefetch_task.cancelled():
+        try:
+            # shield so that a dropped request doesn't throw the render away
+            scene, narration_audio_url = await asyncio.shield(prefetch_task)
+            print(f"⚡ Serving prefetched step: {step_id}")
+        except asyncio.CancelledError:
+            if not prefetch_task.cancelled():
+                # the request itself was cancelled
+                raise
+            # the prefetch was cancelled while we waited (e.g. the game was forgotten), render it now
+            print(f"❌ Prefetch cancelled for step: {step_id}")
+        except Exception as e:
+            print(f"❌ Prefetch failed for step: {step_id}. Error: {e}")
+
+    # or the step was already rendered by any worker, e.g. by its prefetch
+    if scene is None:
+        session = await run_in("io", session_store.get, game_id)
+        if session is None:
+            # collected while the step was being played
+            raise HTTPException(status_code=404, detail="Game not found")
+        asset = session["assets"].get(step_id)
+        if asset and asset["previous_step_id"] == previous_step_id:
+            print(f"⚡ Serving already rendered step: {step_id}")
+            scene = await _load_image(game_id, step_id)
+            narration_audio_url = asset["narration_url"]
+
+    if scene is not None:
+        if publish:
+            await publish(NARRATION_READY, {"narration_audio_url": narration_audio_url})
+            await publish(IMAGE_READY, _image_urls(game_id, step_id, scene))
+    else:
+        # otherwise generate & save the scene & narration now
+        previous_scene = await _load_image(game_id, previous_step_id) if previous_step_id else None
+        scene, narration_audio_url = await _render_step(
+            game_id, theme, step_id, story, character_sheet, previous_scene, previous_step_id,
+            stream=stream_audio, publish=publish)
+
+    await _set_current_step(game_id, step_id)
+
+    # start rendering both possible next steps while the player reads
+    _prefetch_children(game_id, theme, step_id,
+                       story, character_sheet, scene)
+
+    return _step_response(game_id, story.node(step_id), narration_audio_url, scene)
+
+
+def _next_step_id(story, current_step_id, choice_index):
+    """
+    Resolves the step a choice leads to. Returns (next_step_id, error message).
+    """
+    current_step_data = story.node(current_step_id)
+    if not current_step_data:
+        return None, "Invalid current_step_id"
+
+    if not 0 <= choice_index < len(current_step_data.choices):
+        return None, "Invalid choice_index"
+    next_step_id = current_step_data.choices[choice_index].next_id
+
+    if not story.node(next_step_id):
+        # Handle the case where an invalid step_id is provided
+        return None, "Invalid next_step_id"
+    return next_step_id, None
+
+
 @app.post("/api/start_game")
 async def start_game(
     theme: str = Form(...),
@@ -177,104 +615,238 @@ async def start_game(
     Generates story, character, and initial scene if it's a new game.
     """
 
-    # create game_id folder to store details
-    current_game_path = os.path.join(GAME_DATA_DIR, game_id)
-    os.makedirs(current_game_path, exist_ok=True)
-
     print(f"Starting new game with ID: {game_id}")
 
-    # step 1 : load story
-    with open(f"{current_game_path}/story.json", "r") as f:
-        story_data = json.load(f)
+    # step 1 : resolve the game's story
+    game = await _load_game(game_id)
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+    session, story = game
 
-    # step 2 : generate screen & naration
-    narration_text = story_data["story_tree"][0]["narration"]
-    step_id = story_data["story_tree"][0]["id"]
+    # step 2 : generate screen & naration, and prefetch the next steps
+    step = await _play_step(game_id, session["theme"], story, story.start_id)
 
-    character_asset = Image.open(f"{current_game_path}/character_sheet.png")
+    return {"game_id": game_id, "step": step}
 
-    # create parallel tasks
-    image_task = asyncio.to_thread(
-        generate_scene, theme, step_id, story_data, character_asset, None, client, mock=mock)
-    audio_task = generate_narration(narration_text, game_id, step_id)
 
-    # Run both tasks at the same time
-    results = await asyncio.gather(image_task, audio_task)
+@app.post("/api/next_step")
+async def next_step(
+    game_id: str = Form(...),
+    current_step_id: str = Form(...),
+    choice_index: int = Form(...),
+):
+    # step 1 - resolve the story of the current game
+    game = await _load_game(game_id)
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+    session, story = game
 
-    # Unpack the results
-    first_scene, first_scene_narration_audio_url = results
+    # step 2 - get the next step id from the story data
+    next_step_id, error = _next_step_id(story, current_step_id, choice_index)
+    if error:
+        raise HTTPException(status_code=404, detail=error)
 
-    first_scene_image_path = f"{current_game_path}/{step_id}.png"
-    first_scene.save(first_scene_image_path)
+    # step 3 - serve or generate the next scene & narration, and prefetch its children
+    step = await _play_step(game_id, session["theme"], story, next_step_id, current_step_id)
 
-    return_data = story_data["story_tree"][0]
-    return_data["scene_image_url"] = f"/assets/games/{game_id}/{step_id}.png"
-    return_data["character_sheet_url"] = f"/assets/games/{game_id}/character_sheet.png"
-    return_data["narration_audio_url"] = first_scene_narration_audio_url
+    return {"step": step}
 
-    return {"game_id": game_id, "step": return_data}
 
+async def _submit_step_job(game_id, kind, theme, story, step_id, previous_step_id=None):
+    """
+    Plays a step in the background and returns right away with the job id, the
+    url of its event stream and the step's text, so the player can start reading.
+    """
+    job_id = await job_board.create(game_id, kind, step_id)
 
-@app.post("/api/next_step")
-async def next_step(
+    async def publish(event, data):
+        await job_board.publish(game_id, job_id, event, data)
+
+    async def work():
+        step = await _play_step(game_id, theme, story, step_id, previous_step_id, publish=publish)
+        await publish(STEP_COMPLETE, {"step": step})
+
+    job_board.start(game_id, job_id, work())
+    return {
+        "job_id": job_id,
+        "events_url": f"/api/games/{game_id}/jobs/{job_id}/events",
+        "step": story.node(step_id).model_dump(exclude_none=True),
+    }
+
+
+@app.post("/api/jobs/start_game")
+async def start_game_job(
+    theme: str = Form(...),
+    game_id: str = Form(None),
+):
+    """
+    Like /api/start_game, but returns a job right away, see `job_events`.
+    """
+    game = await _load_game(game_id)
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+    session, story = game
+
+    return await _submit_step_job(game_id, "start_game", session["theme"], story, story.start_id)
+
+
+@app.post("/api/jobs/next_step")
+async def next_step_job(
     game_id: str = Form(...),
     current_step_id: str = Form(...),
     choice_index: int = Form(...),
 ):
-    current_game_path = os.path.join(GAME_DATA_DIR, game_id)
-    # step 1 - read story data from current game
-    with open(f"{current_game_path}/story.json", "r") as f:
-        story_data = json.load(f)
-    theme = story_data["theme"]
-
-    # step 2 - load the chracter_asset for the current game
-    character_asset_path = f"{current_game_path}/character_sheet.png"
-    character_asset = Image.open(character_asset_path)
-
-    # step 3 - load the previous scene for current game
-    previous_scene_path = f"{current_game_path}/{current_step_id}.png"
-    previous_scene = Image.open(previous_scene_path)
-
-    # step 4 - get the next step id from the story data
-    current_step_data = next(
-        (step for step in story_data["story_tree"] if step["id"] == current_step_id), None)
-    if not current_step_data:
-        return {"error": "Invalid current_step_id"}, 404
+    """
+    Like /api/next_step, but returns a job right away, see `job_events`.
+    """
+    game = await _load_game(game_id)
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+    session, story = game
 
-    next_step_id = current_step_data["choices"][choice_index]["next_id"]
+    next_step_id, error = _next_step_id(story, current_step_id, choice_index)
+    if error:
+        raise HTTPException(status_code=404, detail=error)
 
-    # step 5 - extract scene details from story data based on step_id
-    next_step_data = next(
-        (step for step in story_data["story_tree"] if step["id"] == next_step_id), None)
+    return await _submit_step_job(game_id, "next_step", session["theme"], story, next_step_id, current_step_id)
 
-    if not next_step_data:
-        # Handle the case where an invalid step_id is provided
-        return {"error": "Invalid next_step_id"}, 404
 
-    # step 6 - generate the next scene & narration
-    next_step_narration_text = next_step_data["narration"]
+@app.get("/api/games/{game_id}/jobs/{job_id}/events")
+async def job_events(game_id: str, job_id: str, last_event_id: str = Header(None)):
+    """
+    Server-sent events of a step job: `narration_ready` and `image_ready` with their
+    urls as soon as each is done, then `step_complete` with the full step (or `error`).
+    Reconnecting clients resume after their Last-Event-ID.
+    """
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    return StreamingResponse(
+        sse_stream(job_board.subscribe(game_id, job_id, after)),
+        media_type="text/event-stream",
+        # don't let proxies buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    # create parallel tasks
-    image_task = asyncio.to_thread(generate_scene, theme, next_step_id,
-                                   story_data, character_asset, previous_scene, client, mock=mock)
-    audio_task = generate_narration(
-        next_step_narration_text, game_id, next_step_id)
 
-    # Run both tasks at the same time and wait for them both to complete
-    results = await asyncio.gather(image_task, audio_task)
+@app.get("/api/narration/{game_id}/{step_id}")
+async def narration(game_id: str, step_id: str):
+    """
+    The narration of a step (or of the prologue): the cached file if we have it,
+    otherwise streamed to the browser while it's being synthesised and teed into
+    the shared narration cache, so an evicted narration is synthesised again.
+    """
+    game = await _load_game(game_id)
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+    session, story = game
+
+    if step_id == "prologue":
+        text = story.story.prologue or "The adventure begins...."
+    else:
+        step = story.node(step_id)
+        if not step:
+            raise HTTPException(status_code=404, detail="Invalid step_id")
+        text = step.narration
+
+    cached_path = await run_in("io", cached_narration, narration_cache_key(text))
+    if cached_path:
+        # a file response, so the audio element can seek with range requests
+        return FileResponse(cached_path, media_type="audio/mpeg")
+    # chunks are forwarded as the async TTS client receives them
+    return StreamingResponse(stream_narration(text), media_type="audio/mpeg")
+
+
+@app.get("/api/images/{game_id}/{name}")
+async def game_image(
+    game_id: str,
+    name: str,
+    w: int = None,
+    v: str = None,
+    accept: str = Header(None),
+    if_none_match: str = Header(None),
+):
+    """
+    Serves a game image as the best compressed variant the browser accepts
+    (AVIF/WebP) at the smallest width >= `w`, falling back to the original png.
+    Versioned urls (`v`) are cached forever by the browser.
+    """
+    if not re.fullmatch(r"[\w-]+", game_id) or not re.fullmatch(r"[\w-]+", name):
+        return Response(status_code=404)
+
+    game_path = game_assets.directory_for(game_id)
+    game_assets.touch(game_id)
+    fmt = negotiate_format(accept)
+    variant = await run_in("io", find_variant, game_path, name, w, fmt) if fmt else None
+    if variant:
+        path, media_type = variant[0], VARIANT_FORMATS[fmt][0]
+    else:
+        path, media_type = game_assets.path(game_id, f"{name}.png"), "image/png"
+
+    try:
+        etag = await run_in("io", etag_for, path)
+    except FileNotFoundError:
+        return Response(status_code=404)
+
+    headers = {
+        "ETag": etag,
+        "Vary": "Accept",
+        # the png fallback is only temporary while the variants are being built
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if v and variant else "no-cache",
+    }
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
 
-    # Unpack the results
-    next_scene, next_scene_narration_audio_url = results
 
-    # step 7 - save the next scene
-    next_scene_image_path = f"{current_game_path}/{next_step_id}.png"
-    next_scene.save(next_scene_image_path)
+@app.get("/api/cache_stats")
+def cache_stats():
+    """
+    Reports hit/miss/eviction counters of the shared caches, used to size them.
+    """
+    return {
+        "scene_cache": scene_cache.stats(),
+        "narration_cache": narration_cache.stats(),
+        "session_store": session_store.stats(),
+        "image_cache": image_cache.stats(),
+        "story_pregenerator": story_pregenerator.stats(),
+        "mock_asset_pool": mock_asset_pool.stats(),
+        "game_assets": game_assets.stats(),
+    }
 
-    next_step_data["scene_image_url"] = f"/assets/games/{game_id}/{next_step_id}.png"
-    next_step_data["character_sheet_url"] = f"/assets/games/{game_id}/character_sheet.png"
-    next_step_data["narration_audio_url"] = next_scene_narration_audio_url
 
-    return {"step": next_step_data}
+@app.get("/api/provider_stats")
+async def provider_stats():
+    """
+    Node-wide provider admission (active calls, adaptive rate, backoff) and this worker's
+    call, throttle & coalescing counters and connection pools.
+    """
+    stats = await run_in("io", provider_gateway.stats)
+    stats["single_flight"] = single_flight.stats()
+    stats["clients"] = provider_clients.stats()
+    return stats
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Request & stage latency histograms, provider counters and in-flight gauges of
+    every worker on the node, in the Prometheus text format.
+    """
+    return Response(await run_in("io", registry.render), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/startup_stats")
+def startup_stats():
+    """
+    Reports how long this worker took to import the app, to serve & to warm up.
+    """
+    return startup_profile.stats()
+
+
+@app.get("/api/executor_stats")
+def executor_stats_endpoint():
+    """
+    Reports queue depth & wait time of the provider, codec and io thread pools.
+    """
+    return executor_stats()
 
 
 @app.get("/ping")
@@ -288,9 +860,17 @@ def ping():
 # --- Corrected Static File Mounting ---
 
 # THE FIX: Mount your game assets at /assets to avoid conflict with React's /static folder.
+# Shared, content-addressed assets (e.g. narration) used by every game.
+app.mount("/assets/narration", StaticFiles(directory=NARRATION_PRERENDER_DIR, check_dir=False),
+          name="narration")
+# Cached narration, only for the urls sessions stored before it was served by /api/narration.
+app.mount("/assets/cache/narration", StaticFiles(directory=NARRATION_CACHE_DIR, check_dir=False),
+          name="narration_cache")
 app.mount("/assets/games", StaticFiles(directory=GAME_DATA_DIR),
           name="game_assets")
 
 # This mount serves the entire built React application. It MUST be the LAST mount.
 app.mount("/", StaticFiles(directory="frontend/build",
           html=True), name="react_app")
+
+startup_profile.record("import", time.perf_counter() - IMPORT_STARTED)
@@ -0,0 +1,436 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from api.constants import METRICS_DIR, METRICS_FLUSH_SECONDS
+
+# Latency buckets (seconds) from a session read to a slow image render.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0, 120.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# The counters & histograms of the workers that exited, summed into one snapshot.
+RETIRED_SNAPSHOT = "retired.json"
+
+
+def _labels(values: Dict[str, str]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in values.items()))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(map(list, key)), value] for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def dec(self, value: float = 1, **labels):
+        self.inc(-value, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """
+        Counts the block as in flight while it runs.
+        """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    snapshot = Counter.snapshot
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(map(list, key)), [list(counts), total]] for key, (counts, total) in self._values.items()]
+
+
+class MetricsRegistry:
+    """
+    The app's counters, gauges & histograms, exported in the Prometheus text format.
+
+    Every gunicorn worker has its own registry and flushes a snapshot of it to
+    `directory` every `flush_seconds`, so that a scrape served by any worker reports
+    the whole node: counters & histograms are summed over every worker that ever ran
+    (a restarted worker doesn't reset them), gauges only over the live ones. The
+    snapshots of exited workers are folded into one retired snapshot and deleted.
+    """
+
+    def __init__(self, directory: Optional[Union[str, Path]] = None, flush_seconds: float = 5.0):
+        self.directory = Path(directory) if directory else None
+        self.flush_seconds = flush_seconds
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._register(Gauge(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+
+    def add_collector(self, collect: Callable[[], None]):
+        """
+        `collect()` runs before every snapshot, e.g. to set gauges from existing stats.
+        """
+        self._collectors.append(collect)
+
+    def snapshot(self) -> dict:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"❌ Metrics collector failed. Error: {e}")
+        pid = os.getpid()
+        return {
+            "pid": pid,
+            "started": _process_started(pid),
+            "metrics": {name: {"kind": metric.kind, "help": metric.help,
+                               "buckets": list(getattr(metric, "buckets", ())), "values": metric.snapshot()}
+                        for name, metric in self._metrics.items()},
+        }
+
+    def flush(self) -> dict:
+        """
+        Writes this worker's snapshot to the metrics directory (atomically) and returns it.
+        """
+        snapshot = self.snapshot()
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".metrics-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.directory / f"{_snapshot_name(snapshot)}.json")
+        return snapshot
+
+    def start_flusher(self):
+        """
+        Flushes the snapshot in a background thread, started once per worker.
+        """
+        if self.directory is None or self._flusher is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.flush_seconds)
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"❌ Failed to flush metrics. Error: {e}")
+
+        self._flusher = threading.Thread(target=run, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+
+    def _snapshots(self) -> Iterator[dict]:
+        own = self.flush()
+        yield own
+        if self.directory is None:
+            return
+        self._retire()
+        for path in self.directory.glob("*.json"):
+            if path.stem == _snapshot_name(own):
+                continue
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, json.JSONDecodeError):
+                continue
+            snapshot["alive"] = path.name != RETIRED_SNAPSHOT and _is_alive(snapshot["pid"], snapshot.get("started"))
+            yield snapshot
+
+    def _retire(self):
+        """
+        Folds the counters & histograms of the exited workers into the retired
+        snapshot and deletes their snapshots, so the directory doesn't grow with
+        every restart. Skipped when another worker is already at it.
+        """
+        with open(self.directory / ".retire.lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            retired_path = self.directory / RETIRED_SNAPSHOT
+            try:
+                retired = json.loads(retired_path.read_text())
+            except (OSError, json.JSONDecodeError):
+                retired = {"pid": None, "metrics": {}, "folded": []}
+            # snapshots already folded in, left behind by an interrupted retirement
+            folded = set(retired["folded"])
+            dead = []
+            for path in self.directory.glob("*.json"):
+                if path.name == RETIRED_SNAPSHOT:
+                    continue
+                try:
+                    snapshot = json.loads(path.read_text())
+                except (OSError, json.JSONDecodeError):
+                    continue
+                if path.stem in folded or not _is_alive(snapshot["pid"], snapshot.get("started")):
+                    dead.append((path, snapshot))
+            if not dead:
+                return
+
+            merged = _merged([retired] + [snapshot for path, snapshot in dead if path.stem not in folded], gauges=False)
+            retired = {"pid": None, "folded": [path.stem for path, _ in dead],
+                       "metrics": {name: {**metric, "values": [[list(map(list, key)), value]
+                                                                for key, value in metric["values"].items()]}
+                                   for name, metric in merged.items()}}
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".metrics-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(retired, f)
+            os.replace(tmp_path, retired_path)
+            for path, _ in dead:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def render(self) -> str:
+        """
+        The node's metrics in the Prometheus text exposition format.
+        """
+        merged: Dict[str, dict] = {}
+        for snapshot in self._snapshots():
+            _merge(merged, snapshot, gauges=snapshot.get("alive", True))
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            for labels, value in sorted(metric["values"].items()):
+                if metric["kind"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip([*metric["buckets"], "+Inf"], counts):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(merged: Dict[str, dict], snapshot: dict, gauges: bool = True):
+    # adds a snapshot's values to `merged`: name -> metric with values by labels
+    for name, metric in snapshot["metrics"].items():
+        if metric["kind"] == "gauge" and not gauges:
+            continue
+        target = merged.setdefault(name, {**metric, "values": {}})
+        for labels, value in metric["values"]:
+            key = _labels(dict(labels))
+            if metric["kind"] == "histogram":
+                counts, total = target["values"].get(key, [[0] * len(value[0]), 0.0])
+                target["values"][key] = [[a + b for a, b in zip(counts, value[0])], total + value[1]]
+            else:
+                target["values"][key] = target["values"].get(key, 0.0) + value
+
+
+def _merged(snapshots: List[dict], gauges: bool = True) -> Dict[str, dict]:
+    merged: Dict[str, dict] = {}
+    for snapshot in snapshots:
+        _merge(merged, snapshot, gauges)
+    return merged
+
+
+def _snapshot_name(snapshot: dict) -> str:
+    # the start time tells apart the workers that got the same pid
+    if snapshot.get("started") is None:
+        return str(snapshot["pid"])
+    return f"{snapshot['pid']}-{snapshot['started']}"
+
+
+def _process_started(pid: int) -> Optional[int]:
+    # the process' start time in clock ticks since boot (Linux), None elsewhere
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # the fields after the command, which may contain spaces & parentheses
+    return int(stat.rsplit(")", 1)[1].split()[19])
+
+
+def _is_alive(pid: int, started: Optional[int] = None) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # the pid may have been reused by another process since
+    return started is None or _process_started(pid) in (None, started)
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency (until the response starts, so a streamed
+    response counts its time to first byte) & status of every API request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status):
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            # the route template (e.g. /api/images/{game_id}/{name}), not the path, to bound the labels
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                    route=route, method=scope["method"], status=status)
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        with REQUESTS_IN_FLIGHT.track():
+            try:
+                await self.app(scope, receive, send_and_record)
+            finally:
+                record(500)
+
+
+# The registry shared by the API, the generators & the gateway.
+registry = MetricsRegistry(METRICS_DIR, METRICS_FLUSH_SECONDS)
+
+REQUEST_SECONDS = registry.histogram(
+    "bss_http_request_duration_seconds", "Latency of the API requests, by route, method & status.")
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "bss_http_requests_in_flight", "API requests being served.")
+STAGE_SECONDS = registry.histogram(
+    "bss_stage_duration_seconds", "Latency of the stages of a request, e.g. scene generation or TTS.")
+STAGES_IN_FLIGHT = registry.gauge(
+    "bss_stages_in_flight", "Stages running right now, by stage.")
+STAGE_ERRORS = registry.counter(
+    "bss_stage_errors_total", "Stages that raised, by stage & error type.")
+PROVIDER_CALLS = registry.counter(
+    "bss_provider_calls_total", "Provider calls by provider & outcome (ok, throttled, error).")
+PROVIDER_IN_FLIGHT = registry.gauge(
+    "bss_provider_calls_in_flight", "Provider calls holding a gateway slot, by provider.")
+PROVIDER_WAIT_SECONDS = registry.histogram(
+    "bss_provider_wait_seconds", "Time spent waiting for a provider gateway slot, by provider.")
+EXECUTOR_QUEUE_DEPTH = registry.gauge(
+    "bss_executor_queue_depth", "Work waiting for a thread, by pool.")
+EXECUTOR_ACTIVE = registry.gauge(
+    "bss_executor_active", "Busy threads, by pool.")
+CACHE_HITS = registry.gauge(
+    "bss_cache_hits", "Cache hits since the worker started, by cache.")
+CACHE_MISSES = registry.gauge(
+    "bss_cache_misses", "Cache misses since the worker started, by cache.")
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Times a stage of the request (`with span("scene_generation"): ...`, in sync or
+    async code) into the stage latency histogram, and counts it in flight & its errors.
+    """
+    started = time.perf_counter()
+    STAGES_IN_FLIGHT.inc(stage=stage)
+    try:
+        yield
+    except Exception as e:
+        STAGE_ERRORS.inc(stage=stage, error=type(e).__name__)
+        raise
+    finally:
+        STAGES_IN_FLIGHT.dec(stage=stage)
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
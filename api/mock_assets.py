@@ -0,0 +1,102 @@
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Union
+
+from api.cache import link_file, write_file
+from api.constants import MOCK_ASSET_POOL_DIR, MOCK_DATA_DIR
+from api.image_cache import CachedImage
+from api.image_delivery import build_variants, enabled_formats, variant_widths
+
+
+class PooledImage(CachedImage):
+    """
+    A mock image shared by every game: the encoded bytes are kept in memory
+    once per worker and its file (& variants) live in the pool directory.
+    """
+
+    def __init__(self, encoded: bytes, path: Path):
+        super().__init__(encoded, "image/png", path=path)
+        self.variants_built = False
+        self.variants_lock = threading.Lock()
+
+
+class MockAssetPool:
+    """
+    The mock images of every theme, read once instead of on every mock generation.
+
+    The pool copies `source_dir/<theme>/*.png` to `pool_dir/<theme>/` once, next to
+    the game assets, so a game's copy of a mock image is a hardlink to the pooled
+    file and its variants are built once per image instead of once per game.
+    """
+
+    def __init__(self, source_dir: Union[str, Path] = MOCK_DATA_DIR, pool_dir: Union[str, Path] = MOCK_ASSET_POOL_DIR):
+        self.source_dir = Path(source_dir)
+        self.pool_dir = Path(pool_dir)
+        self._themes: Dict[str, Dict[str, PooledImage]] = {}
+        self._lock = threading.Lock()
+
+    def _load_theme(self, theme: str) -> Dict[str, PooledImage]:
+        directory = self.pool_dir / theme
+        os.makedirs(directory, exist_ok=True)
+        images = {}
+        for source in sorted(Path(self.source_dir, theme).glob("*.png")):
+            encoded = source.read_bytes()
+            path = directory / source.name
+            if not path.exists() or path.stat().st_size != len(encoded):
+                write_file(path, encoded)
+            images[source.stem] = PooledImage(encoded, path)
+        return images
+
+    def theme(self, theme: str) -> Dict[str, PooledImage]:
+        """
+        The images of a theme by name (e.g. "start", "character_sheet"), loaded on first use.
+        """
+        images = self._themes.get(theme)
+        if images is None:
+            with self._lock:
+                images = self._themes.get(theme)
+                if images is None:
+                    images = self._themes[theme] = self._load_theme(theme)
+                    print(f"🙃 Pooled {len(images)} mock images for theme: {theme}")
+        return images
+
+    def get(self, theme: str, name: str) -> PooledImage:
+        image = self.theme(theme).get(name)
+        if image is None:
+            raise FileNotFoundError(f"No mock image '{name}' for theme: {theme}")
+        return image
+
+    def preload(self) -> int:
+        """
+        Loads every theme, e.g. at startup. Returns the number of pooled images.
+        """
+        themes = [path.name for path in self.source_dir.iterdir() if path.is_dir()] if self.source_dir.is_dir() else []
+        return sum(len(self.theme(theme)) for theme in themes)
+
+    def link_variants(self, image: PooledImage, directory: Union[str, Path], name: str):
+        """
+        Builds the variants of a pooled image once and links them into a game directory as `name`.
+        CPU heavy the first time, run it on the codec pool.
+        """
+        with image.variants_lock:
+            variants = list(image.path.parent.glob(f"{image.path.stem}.*.*"))
+            # another worker may have built them already
+            if not image.variants_built and len(variants) < len(variant_widths(image.size[0])) * len(enabled_formats()):
+                variants = build_variants(image.image, image.path.parent, image.path.stem)
+            image.variants_built = True
+        for variant in variants:
+            # <stem>.<width>.<format>
+            width_and_format = variant.name[len(image.path.stem):]
+            link_file(variant, Path(directory, f"{name}{width_and_format}"))
+
+    def stats(self) -> dict:
+        return {
+            "themes": len(self._themes),
+            "images": sum(len(images) for images in self._themes.values()),
+            "bytes": sum(len(image.encoded) for images in self._themes.values() for image in images.values()),
+        }
+
+
+# Shared by the mock generators & the game asset writer.
+mock_asset_pool = MockAssetPool()
@@ -1,53 +1,260 @@
 import os
+import json
+import uuid
 import asyncio
-from elevenlabs.client import ElevenLabs
-from elevenlabs import play
-from elevenlabs import Voice, VoiceSettings, play, save
-from api.constants import GAME_DATA_DIR
-from dotenv import load_dotenv
-load_dotenv()
-# Initialize the ElevenLabs client
-# It will automatically pick up the ELEVENLABS_API_KEY from your environment
-ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
-client = ElevenLabs(
-    api_key=ELEVENLABS_API_KEY
-)
+from functools import lru_cache
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from api.cache import DiskLRUCache, content_key
+from api.executors import iterate_in, run_in
+from api.metrics import span
+from api.provider_gateway import provider_gateway, single_flight
+from api.providers import provider_clients
+from api.constants import NARRATION_CACHE_DIR, NARRATION_CACHE_MAX_BYTES, NARRATION_PRERENDER_DIR, NARRATION_PRERENDER_MANIFEST
+
+# The blocking ElevenLabs client used by the scripts (the API calls TTS through
+# `provider_clients.elevenlabs`), created on first use so importing the API doesn't
+# import the SDK. It picks up ELEVENLABS_API_KEY from the environment.
+client = None
+
+
+def _blocking_client():
+    global client
+    if client is None:
+        from elevenlabs.client import ElevenLabs
+        client = ElevenLabs(api_key=os.environ.get("ELEVENLABS_API_KEY"))
+    return client
 
 
 # A good, deep voice for a Dungeon Master. You can find other voice IDs on the ElevenLabs website.
 VOICE_ID = "HAvvFKatz0uu0Fv55Riy"  # Adam
+# Pinned explicitly since they are part of the narration cache key.
+TTS_MODEL_ID = "eleven_multilingual_v2"
+TTS_OUTPUT_FORMAT = "mp3_44100_128"
 
+# Narration only depends on the text & voice, so every game shares the same mp3s.
+narration_cache = DiskLRUCache(
+    NARRATION_CACHE_DIR, max_bytes=NARRATION_CACHE_MAX_BYTES, suffix=".mp3")
 
-async def generate_narration(text_to_speak: str, game_id: str, step_id: str) -> str:
+
+def narration_cache_key(text_to_speak: str) -> str:
+    return content_key(text_to_speak, VOICE_ID, TTS_MODEL_ID, TTS_OUTPUT_FORMAT)
+
+
+@lru_cache(maxsize=None)
+def prerendered_narration() -> Dict[str, str]:
     """
-    Generates narration audio from text, saves it, and returns the public URL.
-    This is an async function that runs the blocking I/O in a separate thread.
+    Map of narration cache key -> file (relative to NARRATION_PRERENDER_DIR) of
+    the narration pre-rendered by scripts/generate_narration.py.
     """
+    try:
+        with open(NARRATION_PRERENDER_MANIFEST, "r") as f:
+            return json.load(f)["files"]
+    except FileNotFoundError:
+        return {}
+
+
+def prerendered_path(cache_key: str) -> Path:
+    return Path(NARRATION_PRERENDER_DIR, cache_key[:2], f"{cache_key}.mp3")
+
+
+def cached_narration(cache_key: str) -> Optional[Path]:
+    """
+    Path of the pre-rendered or cached narration for a key, None if it was never synthesised.
+    """
+    prerendered_file = prerendered_narration().get(cache_key)
+    if prerendered_file:
+        return Path(NARRATION_PRERENDER_DIR, prerendered_file)
+    return narration_cache.get(cache_key)
+
 
-    def _generate_and_save():
-        """The actual blocking work to be run in a thread."""
-        
-        audio_bytes = client.text_to_speech.convert(
+def narration_url(cache_key: str, game_id: str, step_id: str) -> str:
+    """
+    Public URL of the narration of a step: the pre-rendered file (never evicted) if
+    there is one, otherwise the narration endpoint, which serves the cached file and
+    synthesises it again if the cache evicted it.
+    """
+    prerendered_file = prerendered_narration().get(cache_key)
+    if prerendered_file:
+        return f"/assets/narration/{prerendered_file}"
+    return f"/api/narration/{game_id}/{step_id}"
+
+
+def synthesise(text_to_speak: str) -> bytes:
+    """
+    Converts text to speech within an ElevenLabs provider slot. Blocking.
+    """
+    def _convert():
+        # the response is streamed, read all of it within the provider slot
+        return b"".join(_blocking_client().text_to_speech.convert(
             text=text_to_speak,
-            voice_id=VOICE_ID)
+            voice_id=VOICE_ID,
+            model_id=TTS_MODEL_ID,
+            output_format=TTS_OUTPUT_FORMAT))
+
+    with span("tts"):
+        return provider_gateway.call("elevenlabs", _convert)
+
+
+async def synthesise_async(text_to_speak: str) -> bytes:
+    """
+    `synthesise` on the worker's async ElevenLabs client, for the API.
+    """
+    async def _convert():
+        return b"".join([chunk async for chunk in provider_clients.elevenlabs.text_to_speech.convert(
+            text=text_to_speak,
+            voice_id=VOICE_ID,
+            model_id=TTS_MODEL_ID,
+            output_format=TTS_OUTPUT_FORMAT)])
+
+    with span("tts"):
+        return await provider_gateway.call_async("elevenlabs", _convert)
+
+
+class _NarrationStream:
+    """
+    The chunks of a TTS stream in flight, replayed to every listener of the same
+    narration (two tabs, the audio element's repeated requests) as they arrive.
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def append(self, chunk: bytes):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def listen(self) -> AsyncIterator[bytes]:
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+# cache key -> the narration this worker is streaming from the provider
+_streams: Dict[str, _NarrationStream] = {}
+_stream_tasks = set()
+
+
+async def _synthesise_stream(cache_key: str, text_to_speak: str, stream: _NarrationStream, owner: str):
+    # runs to the end even if every listener left, the narration then lands in the cache
+    try:
+        print("🎙️ Streaming narration...")
+        # the provider slot is held until the whole stream is consumed
+        with span("tts_stream"):
+            async with provider_gateway.slot_async("elevenlabs"):
+                audio_chunks = provider_clients.elevenlabs.text_to_speech.stream(
+                    text=text_to_speak,
+                    voice_id=VOICE_ID,
+                    model_id=TTS_MODEL_ID,
+                    output_format=TTS_OUTPUT_FORMAT)
+                async for chunk in narration_cache.tee_async(cache_key, audio_chunks):
+                    stream.append(chunk)
+        stream.finish()
+        print("✅ Narration streamed & cached")
+    except BaseException as e:
+        stream.finish(e)
+        if not isinstance(e, Exception):
+            raise
+        print(f"❌ Failed to stream narration. Error: {e}")
+    finally:
+        _streams.pop(cache_key, None)
+        await run_in("io", provider_gateway.release_claim, cache_key, owner)
+
+
+async def stream_narration(text_to_speak: str) -> AsyncIterator[bytes]:
+    """
+    Streams narration audio chunks as the TTS provider produces them.
+    The chunks are teed into the shared narration cache, so the next request for
+    the same text is served from disk. Requests for a narration that is already
+    being streamed share that stream: in this worker they follow its chunks, in
+    another worker (holding the narration's gateway claim) they wait for its file.
+    """
+    cache_key = narration_cache_key(text_to_speak)
+    while True:
+        cached_path = await run_in("io", cached_narration, cache_key)
+        if cached_path:
+            async for chunk in iterate_in("io", _read_chunks(cached_path)):
+                yield chunk
+            return
+
+        stream = _streams.get(cache_key)
+        if stream is None:
+            # a claim of its own, never the one of a `generate_narration` of this worker
+            # (the gateway lets an owner claim a key it holds again)
+            owner = f"{single_flight.owner}-{uuid.uuid4().hex[:8]}"
+            claimed = await run_in("io", provider_gateway.claim, cache_key, owner, single_flight.claim_seconds)
+            if not claimed:
+                # being synthesised by another request, of this worker or another one,
+                # its stream or its file lands in the shared cache
+                await asyncio.sleep(single_flight.poll_seconds)
+                continue
+            if await run_in("io", cached_narration, cache_key):
+                # cached while we were claiming it
+                await run_in("io", provider_gateway.release_claim, cache_key, owner)
+                continue
+            stream = _streams[cache_key] = _NarrationStream()
+            task = asyncio.create_task(_synthesise_stream(cache_key, text_to_speak, stream, owner))
+            _stream_tasks.add(task)
+            task.add_done_callback(_stream_tasks.discard)
+
+        async for chunk in stream.listen():
+            yield chunk
+        return
+
+
+def _read_chunks(path: Path) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        yield from iter(lambda: f.read(64 * 1024), b"")
+
+
+async def generate_narration(text_to_speak: str, game_id: str, step_id: str) -> str:
+    """
+    Generates narration audio from text, saves it, and returns the public URL
+    (`step_id` is the step, or "prologue", whose narration `text_to_speak` is).
+    The audio is stored once in the shared narration cache and reused by every game.
+    The TTS call runs on the worker's async ElevenLabs client, the file I/O on the io pool.
+    """
+    cache_key = narration_cache_key(text_to_speak)
 
-        # Define the file path
-        file_name = f"{step_id}_narration.mp3"
-        file_path = os.path.join(GAME_DATA_DIR, game_id, file_name)
+    async def _generate_and_save():
+        cached_path = await run_in("io", cached_narration, cache_key)
+        if cached_path:
+            print(f"♻️ Narration cache hit for step: {step_id}")
+            return cached_path
 
-        # Save the audio bytes to the file
-        save(audio_bytes, file_path)
+        audio_bytes = await synthesise_async(text_to_speak)
 
+        # Save the audio bytes to the shared cache (atomically, other workers may race us)
+        return await run_in("io", narration_cache.put_bytes, cache_key, audio_bytes)
 
-        # Construct the public URL for the frontend
-        public_url = f"/assets/games/{game_id}/{file_name}"
-        return public_url
+    async def _cached_path():
+        return await run_in("io", cached_narration, cache_key)
 
     print(f"🎙️ Generating narration for step: {step_id}...")
-    # Run the synchronous, blocking function in a separate thread
-    # so it doesn't block our main FastAPI application loop.
-    loop = asyncio.get_running_loop()
-    public_url = await loop.run_in_executor(None, _generate_and_save)
+    # Identical narrations in flight (in any worker) are only synthesised once, the
+    # callers share the cached file but each one gets the URL of its own game's step
+    await single_flight.run(cache_key, _generate_and_save, lookup=_cached_path)
+    public_url = narration_url(cache_key, game_id, step_id)
     print(f"✅ Narration saved to {public_url}")
 
     return public_url
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from api.constants import PREFETCH_IDLE_SECONDS
+from api.provider_gateway import provider_calls_started
+
+
+class PrefetchEngine:
+    """
+    Speculatively renders the next steps of a game in the background.
+
+    As soon as a step is shown to the player we already know both of its
+    children (the `next_id` of each choice), so we start generating them while
+    the player reads. When the player picks a choice, `next_step` claims the
+    finished (or still running) task for that child and the losing branch is
+    cancelled.
+
+    Every game has a budget of speculative renders so that prefetching can at
+    most add a bounded amount of provider spend per game. Renders that are
+    cancelled before they call a provider do not count against the budget. The
+    budget of a game nobody played for `idle_seconds` is dropped, most games are
+    abandoned before their ending. Its prefetches go with it, their scenes included.
+    """
+
+    def __init__(self, budget_per_game: int, max_concurrency: int, idle_seconds: float = PREFETCH_IDLE_SECONDS):
+        self.budget_per_game = budget_per_game
+        self.max_concurrency = max_concurrency
+        self.idle_seconds = idle_seconds
+        self._tasks: Dict[str, Dict[str, asyncio.Task]] = {}
+        # game id -> [renders spent, last scheduled at]
+        self._spent: Dict[str, list] = {}
+        self._pruned_at = time.monotonic()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # created lazily so that it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def remaining_budget(self, game_id: str) -> int:
+        return self.budget_per_game - self._spent.get(game_id, (0, 0.0))[0]
+
+    def _prune(self, now: float):
+        # forgets the games that went idle, at most once a minute: their finished
+        # prefetches hold on to scenes until claimed, and nobody will claim them
+        if now - self._pruned_at < 60:
+            return
+        self._pruned_at = now
+        for game_id in [game_id for game_id, (_, used_at) in self._spent.items()
+                        if now - used_at > self.idle_seconds]:
+            self.forget(game_id)
+
+    def schedule(self, game_id: str, step_id: str, render: Callable[[], Awaitable[Any]]) -> bool:
+        """
+        Starts rendering `step_id` in the background.
+
+        Args:
+            game_id: The game the step belongs to.
+            step_id: The story node to render.
+            render: A coroutine function that renders (and saves) the step.
+
+        Returns:
+            True if a task was scheduled (or is already running) for the step.
+        """
+        now = time.monotonic()
+        self._prune(now)
+        game_tasks = self._tasks.setdefault(game_id, {})
+        if step_id in game_tasks:
+            return True
+
+        if self.remaining_budget(game_id) <= 0:
+            print(f"💸 Prefetch budget exhausted for game: {game_id}")
+            return False
+
+        # reserve the budget now, it is refunded if the task never calls a provider
+        spent = self._spent.setdefault(game_id, [0, now])
+        spent[0] += 1
+        spent[1] = now
+        game_tasks[step_id] = asyncio.create_task(
+            self._run(game_id, step_id, render))
+        return True
+
+    async def _run(self, game_id: str, step_id: str, render: Callable[[], Awaitable[Any]]) -> Any:
+        # counts the provider calls of the render, including those of the tasks it starts
+        calls = [0]
+        provider_calls_started.set(calls)
+        try:
+            async with self._get_semaphore():
+                print(f"🔮 Prefetching step: {step_id} for game: {game_id}")
+                return await render()
+        except asyncio.CancelledError:
+            # cancelled while waiting for a slot, a cache lookup or a gateway slot: nothing was spent
+            spent = self._spent.get(game_id)
+            if not calls[0] and spent:
+                spent[0] -= 1
+            raise
+
+    def claim(self, game_id: str, step_id: str) -> Optional[asyncio.Task]:
+        """
+        Takes ownership of the prefetch task for `step_id` and cancels every
+        other pending prefetch of the game (the branches the player did not pick).
+        """
+        game_tasks = self._tasks.pop(game_id, {})
+        task = game_tasks.pop(step_id, None)
+        for sibling in game_tasks.values():
+            sibling.cancel()
+        return task
+
+    def forget(self, game_id: str):
+        """
+        Cancels all pending prefetches of a game and drops its budget bookkeeping.
+        """
+        for task in self._tasks.pop(game_id, {}).values():
+            task.cancel()
+        self._spent.pop(game_id, None)
@@ -0,0 +1,173 @@
+import asyncio
+import heapq
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from api.story_index import StoryEntry
+
+# (step id, parent step id, probability to reach the step)
+PlannedStep = Tuple[str, Optional[str], float]
+
+# Games whose pre-generated steps are remembered once their pre-generation is done.
+MAX_FINISHED_GAMES = 10_000
+
+
+def plan_story(story: StoryEntry) -> List[PlannedStep]:
+    """
+    Every step reachable from the start, in breadth-first order, with the parent it
+    is rendered after (the first one it's reached from, its scene is the previous
+    scene for continuity) and the chance that a player picking choices at random
+    reaches it, from the story metadata when it was verified.
+    """
+    known = story.metadata.get("steps", {})
+    plan = [(story.start_id, None, 1.0)]
+    probability = {story.start_id: 1.0}
+    for step_id, _, _ in plan:
+        children = story.children.get(step_id, ())
+        for child_id in children:
+            if child_id in probability:
+                continue
+            probability[child_id] = (known[child_id]["reach_probability"] if child_id in known
+                                     else probability[step_id] / len(children))
+            plan.append((child_id, step_id, probability[child_id]))
+    return plan
+
+
+class StoryPregenerator:
+    """
+    Renders the steps of a whole story in the background while the player reads the prologue.
+
+    A step is rendered once its parent's scene exists (continuity), the most likely
+    ready step first, up to `budget_per_game` renders per game. `start_game` and
+    `next_step` claim the finished (or running) render of a step instead of
+    rendering it again, as long as the player came from the parent it was rendered after.
+    """
+
+    def __init__(self, budget_per_game: int, concurrency_per_game: int, max_concurrency: int):
+        self.budget_per_game = budget_per_game
+        self.concurrency_per_game = concurrency_per_game
+        self.max_concurrency = max_concurrency
+        self._drivers: Dict[str, asyncio.Task] = {}
+        # game id -> step id -> (parent step id, render task)
+        self._tasks: Dict[str, Dict[str, Tuple[Optional[str], asyncio.Task]]] = {}
+        # game id -> step id -> parent step id, of the steps rendered by a finished pre-generation
+        self._rendered: "OrderedDict[str, Dict[str, Optional[str]]]" = OrderedDict()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # created lazily so that it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def start(self, game_id: str, story: StoryEntry,
+              render: Callable[[str, Optional[str], Any], Awaitable[Any]]):
+        """
+        Starts pre-generating the story of a game.
+
+        Args:
+            game_id: The game to render the steps of.
+            story: The game's story.
+            render: `render(step_id, parent_id, parent_result)` renders (and saves) a step,
+                `parent_result` being what the parent's render returned (None for the start).
+        """
+        if game_id in self._drivers:
+            return
+        self._tasks[game_id] = {}
+        driver = asyncio.create_task(self._drive(game_id, plan_story(story), render))
+        self._drivers[game_id] = driver
+        driver.add_done_callback(lambda _: self._done(game_id, driver))
+
+    def _done(self, game_id: str, driver: asyncio.Task):
+        # the rendered steps are in the game session by now, drop the scenes we held on to
+        # but remember which steps they were, so that they're not prefetched again
+        if self._drivers.get(game_id) is driver:
+            del self._drivers[game_id]
+            tasks = self._tasks.pop(game_id, {})
+            self._rendered[game_id] = {step_id: parent_id for step_id, (parent_id, task) in tasks.items()
+                                       if task.done() and not task.cancelled() and task.exception() is None}
+            while len(self._rendered) > MAX_FINISHED_GAMES:
+                self._rendered.popitem(last=False)
+
+    async def _drive(self, game_id: str, plan: List[PlannedStep],
+                     render: Callable[[str, Optional[str], Any], Awaitable[Any]]):
+        children: Dict[Optional[str], List[PlannedStep]] = {}
+        for planned in plan:
+            children.setdefault(planned[1], []).append(planned)
+
+        # (-probability, plan order) so that ties keep the breadth-first order
+        order = {step_id: index for index, (step_id, _, _) in enumerate(plan)}
+        ready = [(-probability, order[step_id], step_id, parent_id) for step_id, parent_id, probability
+                 in children.get(None, [])]
+        results: Dict[str, Any] = {}
+        running: Dict[asyncio.Task, str] = {}
+        spent = 0
+
+        while ready or running:
+            while ready and len(running) < self.concurrency_per_game and spent < self.budget_per_game:
+                _, _, step_id, parent_id = heapq.heappop(ready)
+                spent += 1
+                task = asyncio.create_task(self._render(game_id, step_id, parent_id, results.get(parent_id), render))
+                self._tasks[game_id][step_id] = (parent_id, task)
+                running[task] = step_id
+            if not running:
+                break
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                step_id = running.pop(task)
+                if task.cancelled() or task.exception() is not None:
+                    # its subtree needs its scene, the live path renders it if the player goes there
+                    continue
+                results[step_id] = task.result()
+                for child_id, parent_id, probability in children.get(step_id, []):
+                    heapq.heappush(ready, (-probability, order[child_id], child_id, parent_id))
+
+        print(f"🗺️ Pre-generated {len(results)}/{len(plan)} steps for game: {game_id} "
+              f"({spent}/{self.budget_per_game} of the budget)")
+
+    async def _render(self, game_id, step_id, parent_id, parent_result, render) -> Any:
+        async with self._get_semaphore():
+            print(f"🗺️ Pre-generating step: {step_id} for game: {game_id}")
+            try:
+                return await render(step_id, parent_id, parent_result)
+            except Exception as e:
+                print(f"❌ Pre-generation failed for step: {step_id}. Error: {e}")
+                raise
+
+    def claim(self, game_id: str, step_id: str, previous_step_id: Optional[str]) -> Optional[asyncio.Task]:
+        """
+        The finished or running render of `step_id`, if it was rendered after `previous_step_id`.
+        Once the whole story is done, the steps are served from the game session instead.
+        """
+        parent_id, task = self._tasks.get(game_id, {}).get(step_id, (None, None))
+        if task is None or parent_id != previous_step_id:
+            return None
+        return task
+
+    def covers(self, game_id: str, step_id: str, previous_step_id: Optional[str]) -> bool:
+        """
+        Whether the pre-generation rendered (or is rendering) `step_id` after `previous_step_id`.
+        """
+        rendered = self._rendered.get(game_id)
+        if rendered is not None and step_id in rendered:
+            return rendered[step_id] == previous_step_id
+        return self.claim(game_id, step_id, previous_step_id) is not None
+
+    def forget(self, game_id: str):
+        """
+        Stops pre-generating a game, e.g. once the player reached an ending.
+        """
+        driver = self._drivers.pop(game_id, None)
+        if driver is not None:
+            driver.cancel()
+        for _, task in self._tasks.pop(game_id, {}).values():
+            task.cancel()
+        self._rendered.pop(game_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "games": len(self._drivers),
+            "finished_games": len(self._rendered),
+            "rendering": sum(1 for tasks in self._tasks.values() for _, task in tasks.values() if not task.done()),
+        }
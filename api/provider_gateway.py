@@ -0,0 +1,396 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+from api.constants import PROVIDER_GATEWAY_DB, PROVIDER_LIMITS, PROVIDER_MAX_RETRIES
+from api.executors import run_in
+from api.metrics import PROVIDER_CALLS, PROVIDER_IN_FLIGHT, PROVIDER_WAIT_SECONDS
+
+# Provider errors that mean "slow down": HTTP 429 (google-genai exposes it as `code`,
+# ElevenLabs as `status_code`).
+THROTTLE_STATUS_CODES = {429}
+
+
+# Provider calls started by the current task (& the tasks it starts), for callers that need
+# to know whether their work reached a provider, e.g. a prefetch refunds its budget if not.
+provider_calls_started: ContextVar[Optional[list]] = ContextVar("provider_calls_started", default=None)
+
+
+def _call_started():
+    counter = provider_calls_started.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def is_throttled(error: BaseException) -> bool:
+    return (getattr(error, "code", None) in THROTTLE_STATUS_CODES
+            or getattr(error, "status_code", None) in THROTTLE_STATUS_CODES)
+
+
+class ProviderGateway:
+    """
+    Admission control for the image & TTS providers, shared by every worker on
+    the node through a small SQLite database.
+
+    Each provider has a concurrency limit (leases that expire if a worker dies)
+    and a token bucket. The bucket's refill rate adapts to the provider (AIMD):
+    a 429 halves it and blocks new calls for a backoff period, every successful
+    call adds back a little of the configured rate. Callers wait for a slot
+    instead of hammering the provider, so throughput stays at the ceiling
+    without 429 storms. `call` & `slot` block and are meant for the provider
+    pool, `call_async` & `slot_async` wait on the event loop.
+    """
+
+    def __init__(self, path: Union[str, Path], limits: Dict[str, dict], max_retries: int = PROVIDER_MAX_RETRIES):
+        self.path = str(path)
+        self.limits = limits
+        self.max_retries = max_retries
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._stats_lock = threading.Lock()
+        self._stats = {provider: {"calls": 0, "throttled": 0, "retries": 0, "wait_s": 0.0} for provider in limits}
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # a connection opened before a fork (gunicorn --preload) belongs to the parent,
+        # keep it referenced but never use it
+        self._parent_local = self._local
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads, keep one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._create_schema(connection)
+        return connection
+
+    def _create_schema(self, connection: sqlite3.Connection):
+        # created on first use, so that importing the module doesn't touch the disk
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (provider TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+                "rate REAL NOT NULL, updated_at REAL NOT NULL, blocked_until REAL NOT NULL, strikes INTEGER NOT NULL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases (id TEXT PRIMARY KEY, provider TEXT NOT NULL, expires_at REAL NOT NULL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self._schema_ready = True
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        # take the write lock up front so concurrent workers can't interleave
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _bucket(self, connection: sqlite3.Connection, provider: str, now: float) -> list:
+        limit = self.limits[provider]
+        row = connection.execute(
+            "SELECT tokens, rate, updated_at, blocked_until, strikes FROM buckets WHERE provider = ?",
+            (provider,)).fetchone()
+        if row is None:
+            return [limit["burst"], limit["rate_per_second"], now, 0.0, 0]
+        tokens, rate, updated_at, blocked_until, strikes = row
+        tokens = min(limit["burst"], tokens + max(0.0, now - updated_at) * rate)
+        return [tokens, rate, now, blocked_until, strikes]
+
+    def _save_bucket(self, connection: sqlite3.Connection, provider: str, bucket: list):
+        connection.execute(
+            "INSERT OR REPLACE INTO buckets (provider, tokens, rate, updated_at, blocked_until, strikes) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (provider, *bucket))
+
+    def _try_acquire(self, provider: str) -> tuple:
+        """
+        Takes a lease & a token if both are available.
+        Returns (lease id, 0) or (None, seconds to wait before trying again).
+        """
+        limit = self.limits[provider]
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            active = connection.execute(
+                "SELECT COUNT(*) FROM leases WHERE provider = ?", (provider,)).fetchone()[0]
+            bucket = self._bucket(connection, provider, now)
+            tokens, rate, _, blocked_until, _ = bucket
+
+            if now >= blocked_until and active < limit["max_concurrency"] and tokens >= 1:
+                bucket[0] -= 1
+                lease_id = uuid.uuid4().hex
+                connection.execute("INSERT INTO leases (id, provider, expires_at) VALUES (?, ?, ?)",
+                                   (lease_id, provider, now + limit["lease_seconds"]))
+                self._save_bucket(connection, provider, bucket)
+                return lease_id, 0.0
+
+            self._save_bucket(connection, provider, bucket)
+            wait = max(blocked_until - now, (1 - tokens) / rate if tokens < 1 else 0.0, 0.05)
+            return None, wait
+
+    def _acquired(self, provider: str, started: float):
+        waited = time.perf_counter() - started
+        self._count(provider, "wait_s", waited)
+        PROVIDER_WAIT_SECONDS.observe(waited, provider=provider)
+
+    def acquire(self, provider: str) -> str:
+        """
+        Blocks until the provider has a free slot and a token, returns the lease id.
+        """
+        started = time.perf_counter()
+        while True:
+            lease_id, wait = self._try_acquire(provider)
+            if lease_id:
+                self._acquired(provider, started)
+                return lease_id
+            # a little jitter so that waiting workers don't retry in lockstep
+            time.sleep(min(wait, 1.0) * random.uniform(1.0, 1.2))
+
+    async def acquire_async(self, provider: str) -> str:
+        """
+        `acquire` that waits on the event loop instead of blocking a thread.
+        """
+        started = time.perf_counter()
+        while True:
+            lease_id, wait = await run_in("io", self._try_acquire, provider)
+            if lease_id:
+                self._acquired(provider, started)
+                return lease_id
+            await asyncio.sleep(min(wait, 1.0) * random.uniform(1.0, 1.2))
+
+    def release(self, provider: str, lease_id: str, throttled: bool = False):
+        """
+        Returns the lease and adapts the refill rate: additive increase after a
+        success, multiplicative decrease & exponential backoff after a 429.
+        """
+        limit = self.limits[provider]
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+            bucket = self._bucket(connection, provider, now)
+            if throttled:
+                strikes = bucket[4] + 1
+                bucket[0] = 0.0
+                bucket[1] = max(limit["min_rate_per_second"], bucket[1] / 2)
+                bucket[3] = max(bucket[3], now + min(limit["max_backoff_seconds"], 2 ** (strikes - 1)))
+                bucket[4] = strikes
+            else:
+                bucket[1] = min(limit["rate_per_second"], bucket[1] + limit["rate_per_second"] / 20)
+                bucket[4] = 0
+            self._save_bucket(connection, provider, bucket)
+
+    @contextmanager
+    def slot(self, provider: str):
+        """
+        Holds a provider slot for the duration of the block, e.g. a streamed response.
+        """
+        lease_id = self.acquire(provider)
+        error = None
+        _call_started()
+        PROVIDER_IN_FLIGHT.inc(provider=provider)
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.release(provider, lease_id, self._finished(provider, error))
+
+    @asynccontextmanager
+    async def slot_async(self, provider: str):
+        """
+        `slot` for async code, nothing blocks the event loop while it waits.
+        """
+        lease_id = await self.acquire_async(provider)
+        error = None
+        _call_started()
+        PROVIDER_IN_FLIGHT.inc(provider=provider)
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            await run_in("io", self.release, provider, lease_id, self._finished(provider, error))
+
+    def _finished(self, provider: str, error: Optional[BaseException]) -> bool:
+        # records the call's outcome, returns whether the provider throttled it
+        throttled = error is not None and is_throttled(error)
+        outcome = "ok" if error is None else "throttled" if throttled else "error"
+        PROVIDER_IN_FLIGHT.dec(provider=provider)
+        PROVIDER_CALLS.inc(provider=provider, outcome=outcome)
+        return throttled
+
+    def call(self, provider: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Calls `fn(*args, **kwargs)` within a provider slot, retrying 429s with backoff.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.slot(provider):
+                    self._count(provider, "calls")
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_throttled(e) or attempt == self.max_retries:
+                    raise
+                self._count(provider, "throttled")
+                self._count(provider, "retries")
+                print(f"🐢 {provider} is throttling us, backing off (attempt {attempt + 1})")
+
+    async def call_async(self, provider: str, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Awaits `fn(*args, **kwargs)` within a provider slot, retrying 429s with backoff.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.slot_async(provider):
+                    self._count(provider, "calls")
+                    return await fn(*args, **kwargs)
+            except Exception as e:
+                if not is_throttled(e) or attempt == self.max_retries:
+                    raise
+                self._count(provider, "throttled")
+                self._count(provider, "retries")
+                print(f"🐢 {provider} is throttling us, backing off (attempt {attempt + 1})")
+
+    def claim(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        """
+        Marks `key` as being generated by `owner`, unless another owner holds a live claim.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute("SELECT owner, expires_at FROM claims WHERE key = ?", (key,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            connection.execute("INSERT OR REPLACE INTO claims (key, owner, expires_at) VALUES (?, ?, ?)",
+                               (key, owner, now + ttl_seconds))
+            return True
+
+    def release_claim(self, key: str, owner: str):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM claims WHERE key = ? AND owner = ?", (key, owner))
+
+    def _count(self, provider: str, name: str, value: float = 1):
+        with self._stats_lock:
+            self._stats[provider][name] += value
+
+    def stats(self) -> dict:
+        now = time.time()
+        connection = self._connection()
+        shared = {}
+        for provider in self.limits:
+            active = connection.execute(
+                "SELECT COUNT(*) FROM leases WHERE provider = ? AND expires_at >= ?", (provider, now)).fetchone()[0]
+            row = connection.execute(
+                "SELECT rate, blocked_until FROM buckets WHERE provider = ?", (provider,)).fetchone()
+            shared[provider] = {
+                "active": active,
+                "rate_per_second": round(row[0], 3) if row else self.limits[provider]["rate_per_second"],
+                "blocked_for_s": round(max(0.0, row[1] - now), 2) if row else 0.0,
+            }
+        with self._stats_lock:
+            return {
+                provider: {**shared[provider], **{name: round(value, 3) for name, value in stats.items()}}
+                for provider, stats in self._stats.items()
+            }
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight generations (same cache key) so that all the
+    callers share one result, e.g. a double-clicked choice.
+
+    Within a worker the callers await the same task. Across workers, the first
+    one claims the key in the gateway database and the others poll `lookup`
+    (usually a shared cache) until the result shows up or the claim expires.
+    """
+
+    def __init__(self, gateway: ProviderGateway, claim_seconds: float = 300.0, poll_seconds: float = 0.25):
+        self.gateway = gateway
+        self.claim_seconds = claim_seconds
+        self.poll_seconds = poll_seconds
+        self.owner = self._new_owner()
+        self.coalesced = 0
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # in-flight task -> callers awaiting it
+        self._waiters: Dict[asyncio.Task, int] = {}
+        # workers forked from a preloaded app must not share the master's claims
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    @staticmethod
+    def _new_owner() -> str:
+        return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def _after_fork(self):
+        self.owner = self._new_owner()
+
+    async def run(self, key: str, work: Callable[[], Awaitable[Any]],
+                  lookup: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """
+        Returns `await work()`, or the result of an identical call already in flight.
+        `lookup` returns the result produced by another worker, or None. The work is
+        cancelled when all of its callers are.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(key, work, lookup))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.coalesced += 1
+            print(f"🔗 Joining in-flight generation: {key[:12]}")
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # a cancelled caller must not cancel the work the other callers wait for
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # ... but the last one does, nobody wants the result anymore
+            if self._waiters[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    async def _run(self, key: str, work: Callable[[], Awaitable[Any]],
+                   lookup: Optional[Callable[[], Awaitable[Any]]]) -> Any:
+        while not await run_in("io", self.gateway.claim, key, self.owner, self.claim_seconds):
+            if lookup:
+                result = await lookup()
+                if result is not None:
+                    self.coalesced += 1
+                    return result
+            await asyncio.sleep(self.poll_seconds)
+        try:
+            # another worker may have finished it while we were waiting for the claim
+            result = await lookup() if lookup else None
+            return result if result is not None else await work()
+        finally:
+            await run_in("io", self.gateway.release_claim, key, self.owner)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._tasks), "coalesced": self.coalesced}
+
+
+# Shared by the generators (scripts included) and the API.
+provider_gateway = ProviderGateway(PROVIDER_GATEWAY_DB, PROVIDER_LIMITS)
+single_flight = SingleFlight(provider_gateway)
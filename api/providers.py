@@ -0,0 +1,179 @@
+import asyncio
+import importlib
+import importlib.util
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, Optional
+
+import httpx
+
+from api.constants import (PROVIDER_BASE_URLS, PROVIDER_HTTP_CONNECT_TIMEOUT_SECONDS, PROVIDER_HTTP_KEEPALIVE_SECONDS,
+                           PROVIDER_HTTP_MAX_CONNECTIONS, PROVIDER_HTTP_MAX_KEEPALIVE, PROVIDER_HTTP_TIMEOUT_SECONDS,
+                           PROVIDER_HTTP_WARM_CONNECTIONS)
+from api.image_cache import CachedImage
+
+if TYPE_CHECKING:
+    from elevenlabs.client import AsyncElevenLabs
+    from google import genai
+    from google.genai import types
+
+# The provider SDKs (& httpx's transport, imported with the first client) take most
+# of the app's import time (~0.8s), they are imported on first use or by the warm-up,
+# not when the app is imported.
+PROVIDER_MODULES = ("google.genai", "google.genai.types", "elevenlabs.client", "httpcore")
+
+
+def import_provider_modules():
+    """
+    Imports the provider SDKs, e.g. in the warm-up or in the gunicorn master before it forks.
+    """
+    for module in PROVIDER_MODULES:
+        importlib.import_module(module)
+
+
+def http2_available() -> bool:
+    # httpx only speaks HTTP/2 when the h2 package is installed
+    return importlib.util.find_spec("h2") is not None
+
+
+def pooled_http_client() -> httpx.AsyncClient:
+    """
+    An async HTTP client with a bounded pool of keep-alive connections (multiplexed
+    over HTTP/2 when available), meant to be shared by every call to one provider.
+    """
+    return httpx.AsyncClient(
+        http2=http2_available(),
+        limits=httpx.Limits(max_connections=PROVIDER_HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=PROVIDER_HTTP_MAX_KEEPALIVE,
+                            keepalive_expiry=PROVIDER_HTTP_KEEPALIVE_SECONDS),
+        timeout=httpx.Timeout(PROVIDER_HTTP_TIMEOUT_SECONDS, connect=PROVIDER_HTTP_CONNECT_TIMEOUT_SECONDS),
+    )
+
+
+class ProviderClients:
+    """
+    The async Gemini & ElevenLabs clients of a worker, created once (on first use or
+    by the warm-up in the app lifespan) so that every call reuses the same connection
+    pools. A call in flight is a coroutine waiting on a socket, not a thread, so a
+    worker can hold as many as the provider gateway admits.
+    """
+
+    def __init__(self):
+        self._gemini: Optional["genai.Client"] = None
+        self._elevenlabs: Optional["AsyncElevenLabs"] = None
+        # provider -> the pool of the client we created (not the fakes')
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._lock = threading.Lock()
+        self.connected = 0
+
+    @property
+    def gemini(self) -> "genai.Client":
+        if self._gemini is None:
+            self.start()
+        return self._gemini
+
+    @gemini.setter
+    def gemini(self, client: "genai.Client"):
+        self._gemini = client
+
+    @property
+    def elevenlabs(self) -> "AsyncElevenLabs":
+        if self._elevenlabs is None:
+            self.start()
+        return self._elevenlabs
+
+    @elevenlabs.setter
+    def elevenlabs(self, client: "AsyncElevenLabs"):
+        self._elevenlabs = client
+
+    def _http_client(self, provider: str) -> httpx.AsyncClient:
+        http_client = self._http_clients[provider] = pooled_http_client()
+        return http_client
+
+    def start(self):
+        """
+        Creates the clients that weren't set already (e.g. fakes in the load test).
+        Imports the provider SDKs the first time, run it on the io pool from async code.
+        """
+        with self._lock:
+            if self._gemini is None:
+                from google import genai
+                from google.genai import types
+                # use `gemini.aio`, the sync surface keeps its own (unused) client
+                self._gemini = genai.Client(
+                    api_key=os.environ.get("GEMINI_API_KEY"),
+                    http_options=types.HttpOptions(httpx_async_client=self._http_client("gemini")))
+            if self._elevenlabs is None:
+                from elevenlabs.client import AsyncElevenLabs
+                self._elevenlabs = AsyncElevenLabs(api_key=os.environ.get("ELEVENLABS_API_KEY"),
+                                                   httpx_client=self._http_client("elevenlabs"))
+
+    async def connect(self, connections: int = PROVIDER_HTTP_WARM_CONNECTIONS) -> int:
+        """
+        Opens `connections` keep-alive connections (TCP & TLS handshakes) to each provider
+        ahead of the first call, with cheap HEAD requests. Returns the number opened.
+        """
+        requests = [http_client.head(PROVIDER_BASE_URLS[provider], timeout=PROVIDER_HTTP_CONNECT_TIMEOUT_SECONDS)
+                    for provider, http_client in self._http_clients.items() for _ in range(connections)]
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        # any answer, even a 404, leaves a connection in the pool
+        failed = [result for result in results if isinstance(result, Exception)]
+        for error in failed[:1]:
+            print(f"⚠️ Failed to pre-open a provider connection. Error: {error!r}")
+        self.connected += len(results) - len(failed)
+        return len(results) - len(failed)
+
+    async def close(self):
+        for http_client in self._http_clients.values():
+            await http_client.aclose()
+        self._http_clients.clear()
+        self._gemini = None
+        self._elevenlabs = None
+
+    def stats(self) -> dict:
+        return {
+            "http2": http2_available(),
+            "max_connections": PROVIDER_HTTP_MAX_CONNECTIONS,
+            "max_keepalive_connections": PROVIDER_HTTP_MAX_KEEPALIVE,
+            "clients": len(self._http_clients),
+            "pre_opened_connections": self.connected,
+        }
+
+
+def image_from_response(response: "types.GenerateContentResponse") -> Optional[CachedImage]:
+    """
+    The image of an image model response, still encoded as the provider sent it,
+    or None if the response has none (e.g. it was blocked).
+    """
+    # --- DEFENSIVE CHECKING ---
+    # First, check if there are any candidates at all.
+    if not response.candidates:
+        print(
+            "❌ ERROR: No candidates returned from API. The request may have been blocked.")
+        print("--- FULL RESPONSE ---")
+        print(response)
+        return None
+
+    # Now, check the specific candidate
+    candidate = response.candidates[0]
+
+    # Let's inspect the finish reason! This is the key piece of evidence.
+    print(f"ℹ️ Finish Reason: {candidate.finish_reason}")
+
+    if candidate.content is None or not candidate.content.parts:
+        print("❌ ERROR: Candidate content is None or has no parts.")
+        print("--- FULL RESPONSE ---")
+        print(response)
+        return None
+    # --- END DEFENSIVE CHECKING ---
+
+    image = None
+    for part in candidate.content.parts:
+        if part.inline_data is not None:
+            # keep the provider's encoded bytes, they are only decoded if the pixels are needed
+            image = CachedImage(part.inline_data.data, part.inline_data.mime_type or "image/png")
+    return image
+
+
+# Shared by the generators & the API, started on first use or by the app's warm-up.
+provider_clients = ProviderClients()
@@ -1,50 +1,73 @@
-from io import BytesIO
-from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import TYPE_CHECKING, Optional, Union
 from PIL import Image
-from google import genai
 
-from api.constants import IMAGE_MODEL_ID, AI_IMAGE_DIR, MOCK_DATA_DIR
+from api.cache import content_key
+from api.constants import (IMAGE_MODEL_ID, AI_IMAGE_DIR, REFERENCE_IMAGE_FORMAT,
+                           REFERENCE_IMAGE_MAX_DIMENSION, REFERENCE_IMAGE_QUALITY)
+from api.image_cache import CachedImage
+from api.mock_assets import mock_asset_pool
+from api.provider_gateway import provider_gateway
+from api.providers import image_from_response
+from api.story_index import StoryEntry
 
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
 
-def _mock_scene_generation(theme: str, step_id: str) -> Image.Image:
+# Bump this whenever the scene prompt below changes so that cached scenes are not reused.
+SCENE_PROMPT_VERSION = "1"
+
+
+def _mock_scene_generation(theme: str, step_id: str) -> CachedImage:
     """
     Helper funtion to mock the scene generation to avoid expensive API calls
 
     Returns:
-        Image.Image: Image from saved disk
+        CachedImage: The saved image from the mock asset pool, shared by every game
     """
     print("🙃 mocking scene generation...")
+    return mock_asset_pool.get(theme, step_id)
 
-    # open image file from mock data directory
-    # TODO: Make the function little bit dynamic to return image from a pool of saved images.
-    scene = Image.open(Path(MOCK_DATA_DIR, theme, f"{step_id}.png"))
-    return scene
 
-
-def generate_scene(
+def scene_cache_key(
     theme: str,
     step_id: str,
-    story_data: Dict[str, Any],
-    character_asset: Image.Image,
-    previous_scene_image: Optional[Image.Image],
-    client: genai.Client,
-    mock: bool = False,
-    is_prologue: bool = False,
-) -> Image.Image:
+    story: StoryEntry,
+    character_sheet_bytes: Optional[bytes],
+    previous_scene_bytes: Optional[bytes],
+) -> str:
     """
-    Generates the visual scene for a specific step in the story.
-    This final version uses a unified prompt structure for clarity and power.
+    Builds the scene cache key from everything that goes into the scene prompt,
+    including how the reference images are compacted. Two games that replay the same story with the same hero produce the same key.
+
+    Args:
+        theme: The story theme.
+        step_id: The step being rendered ("prologue" for the prologue).
+        story: The story the step belongs to.
+        character_sheet_bytes: The encoded character sheet, None for the prologue.
+        previous_scene_bytes: The encoded previous scene, None for the first scene.
+
+    Returns:
+        str: A sha256 hex digest.
     """
+    reference_settings = f"{REFERENCE_IMAGE_FORMAT}:{REFERENCE_IMAGE_MAX_DIMENSION}:{REFERENCE_IMAGE_QUALITY}"
+    return content_key(SCENE_PROMPT_VERSION, IMAGE_MODEL_ID, reference_settings, theme, story.digest,
+                       step_id, character_sheet_bytes, previous_scene_bytes)
 
-    if mock:
-        # For prologue, we need a different mock image
-        if is_prologue:
-            step_id = "start" # using start image for prologue
-        return _mock_scene_generation(theme, step_id=step_id)
 
+def scene_prompt(
+    theme: str,
+    step_id: str,
+    story: StoryEntry,
+    character_asset: Union[Image.Image, "types.Part"],
+    previous_scene_image: Optional[Union[Image.Image, "types.Part"]],
+    is_prologue: bool = False,
+) -> list:
+    """
+    The prompt parts of a scene, see `generate_scene`.
+    """
     if is_prologue:
-        scene_description = story_data.get("prologue", "A cinematic opening shot for the story.")
+        scene_description = story.story.prologue or "A cinematic opening shot for the story."
         full_narrative_prompt = f"Generate a cinematic, establishing shot for a story with the following theme: {theme}. The scene should be described as: {scene_description}. This is the opening shot of the story, so it should be epic and inviting. Do not include any characters in this shot."
         prompt_parts = [
             full_narrative_prompt,
@@ -53,13 +76,12 @@ def generate_scene(
         ]
     else:
         # 1. Look up the current step's data.
-        current_step = next(
-            (step for step in story_data["story_tree"] if step["id"] == step_id), None)
+        current_step = story.node(step_id)
         if not current_step:
             raise ValueError(f"Step with ID '{step_id}' not found in story_tree.")
 
-        scene_description = current_step["scene_description"]
-        pose_description = current_step["character_pose_description"]
+        scene_description = current_step.scene_description
+        pose_description = current_step.character_pose_description
 
         # 2. Combine the narrative descriptions into a single, cohesive paragraph.
         full_narrative_prompt = f"{scene_description}. Our hero is {pose_description}."
@@ -85,40 +107,71 @@ def generate_scene(
                 previous_scene_image
             ])
 
+    return prompt_parts
+
+
+def generate_scene(
+    theme: str,
+    step_id: str,
+    story: StoryEntry,
+    character_asset: Union[Image.Image, "types.Part"],
+    previous_scene_image: Optional[Union[Image.Image, "types.Part"]],
+    client: "genai.Client",
+    mock: bool = False,
+    is_prologue: bool = False,
+) -> CachedImage:
+    """
+    Generates the visual scene for a specific step in the story.
+    This final version uses a unified prompt structure for clarity and power.
+    The reference images can be PIL images or already encoded content parts
+    (see `CachedImage.reference_part` for compacted ones). The scene is returned
+    as the provider encoded it, decoding it is left to whoever needs the pixels.
+    """
+
+    if mock:
+        # For prologue, we need a different mock image
+        if is_prologue:
+            step_id = "start" # using start image for prologue
+        return _mock_scene_generation(theme, step_id=step_id)
+
+    prompt_parts = scene_prompt(theme, step_id, story, character_asset, previous_scene_image, is_prologue)
+
     # 5. Make the API call.
     print(f"🚀 Generating scene for step: {step_id}...")
-    response = client.models.generate_content(
+    response = provider_gateway.call(
+        "gemini",
+        client.models.generate_content,
         model=IMAGE_MODEL_ID,
         contents=prompt_parts
     )
     print("✅ Scene Generated!")
+    return image_from_response(response)
+
 
-    # --- DEFENSIVE CHECKING ---
-    # First, a`SBC`check if there are any candidates at all.
-    if not response.candidates:
-        print(
-            "❌ ERROR: No candidates returned from API. The request may have been blocked.")
-        print("--- FULL RESPONSE ---")
-        print(response)
-        # Return a placeholder or raise an error
-        # For now, let's return None to see the error handled.
-        return None
-
-    # Now, check the specific candidate
-    candidate = response.candidates[0]
-
-    # Let's inspect the finish reason! This is the key piece of evidence.
-    print(f"ℹ️ Finish Reason: {candidate.finish_reason}")
-
-    if candidate.content is None or not candidate.content.parts:
-        print("❌ ERROR: Candidate content is None or has no parts.")
-        print("--- FULL RESPONSE ---")
-        print(response)
-        return None
-    # --- END DEFENSIVE CHECKING ---
-
-    for part in response.candidates[0].content.parts:
-        if part.inline_data is not None:
-            image = Image.open(BytesIO(part.inline_data.data))
-
-    return image
+async def generate_scene_async(
+    theme: str,
+    step_id: str,
+    story: StoryEntry,
+    character_asset: Union[Image.Image, "types.Part"],
+    previous_scene_image: Optional[Union[Image.Image, "types.Part"]],
+    client: "genai.Client",
+    mock: bool = False,
+    is_prologue: bool = False,
+) -> CachedImage:
+    """
+    `generate_scene` on the client's async surface (`client.aio`), for the API.
+    """
+    if mock:
+        return _mock_scene_generation(theme, step_id="start" if is_prologue else step_id)
+
+    prompt_parts = scene_prompt(theme, step_id, story, character_asset, previous_scene_image, is_prologue)
+
+    print(f"🚀 Generating scene for step: {step_id}...")
+    response = await provider_gateway.call_async(
+        "gemini",
+        client.aio.models.generate_content,
+        model=IMAGE_MODEL_ID,
+        contents=prompt_parts
+    )
+    print("✅ Scene Generated!")
+    return image_from_response(response)
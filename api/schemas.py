@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional, Literal
 
 # No changes are needed for the Choice class.
@@ -6,6 +6,8 @@ class Choice(BaseModel):
     """
     Represents a single choice a player can make.
     """
+    model_config = ConfigDict(frozen=True)
+
     text: str
     next_id: str
 
@@ -15,6 +17,8 @@ class StoryNode(BaseModel):
     Represents a single step in the story.
     We've added the 'id' field here to uniquely identify each node.
     """
+    model_config = ConfigDict(frozen=True)
+
     id: str  # <-- The new field you suggested!
     scene_description: str
     character_pose_description: str
@@ -30,5 +34,8 @@ class Story(BaseModel):
     The 'story_tree' is now a List of StoryNode objects instead of a Dictionary.
     This resolves the `additionalProperties` error with the Gemini API.
     """
+    model_config = ConfigDict(frozen=True)
+
     prologue: str
-    story_tree: List[StoryNode]
\ No newline at end of file
+    story_tree: List[StoryNode]
+    theme: Optional[str] = None
\ No newline at end of file
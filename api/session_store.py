@@ -0,0 +1,265 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from api.metrics import span
+
+# A game session looks like:
+# {
+#     "game_id": "...",
+#     "theme": "Haunted Space Station",
+#     "story_key": "Haunted Space Station/story_2",
+#     "current_step_id": "start",
+#     "assets": {"<step_id>": {"scene": "<step_id>.png", "narration_url": "...", "previous_step_id": "..."}},
+#     "timings": {"<step_id>": <seconds to render>},
+#     "jobs": {"<job_id>": {"kind": "next_step", "step_id": "...", "status": "running", "events": [...]}},
+#     "created_at": <unix time>,
+#     "updated_at": <unix time>,
+# }
+Session = Dict[str, Any]
+
+
+class SessionStore(ABC):
+    """
+    Stores game sessions so that any worker (or node) can serve any game.
+    Backends implement `get`, `put`, `update` and `delete`.
+    """
+
+    @abstractmethod
+    def get(self, game_id: str) -> Optional[Session]:
+        ...
+
+    def get_fresh(self, game_id: str) -> Optional[Session]:
+        """
+        Like `get`, but never served from a per-worker cache, e.g. to poll for other workers' writes.
+        """
+        return self.get(game_id)
+
+    @abstractmethod
+    def put(self, game_id: str, session: Session):
+        ...
+
+    @abstractmethod
+    def update(self, game_id: str, mutate: Callable[[Session], None]) -> Optional[Session]:
+        """
+        Atomically applies `mutate` to the stored session and returns the new session,
+        or None if the game doesn't exist.
+        """
+
+    @abstractmethod
+    def delete(self, game_id: str):
+        ...
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in a SQLite database in WAL mode, shared by all workers on the node.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "game_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # the connection opened at import belongs to the gunicorn master when the app is
+        # preloaded: the workers open their own, and keep the master's referenced since
+        # closing it in a child is as unsafe as using it
+        self._parent_local = self._local
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads, keep one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, game_id: str) -> Optional[Session]:
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE game_id = ?", (game_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, game_id: str, session: Session):
+        session["updated_at"] = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO sessions (game_id, data, updated_at) VALUES (?, ?, ?)",
+            (game_id, json.dumps(session), session["updated_at"]))
+
+    def update(self, game_id: str, mutate: Callable[[Session], None]) -> Optional[Session]:
+        connection = self._connection()
+        # take the write lock up front so concurrent updates can't interleave
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT data FROM sessions WHERE game_id = ?", (game_id,)).fetchone()
+            if not row:
+                connection.execute("ROLLBACK")
+                return None
+            session = json.loads(row[0])
+            mutate(session)
+            session["updated_at"] = time.time()
+            connection.execute(
+                "UPDATE sessions SET data = ?, updated_at = ? WHERE game_id = ?",
+                (json.dumps(session), session["updated_at"], game_id))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return session
+
+    def delete(self, game_id: str):
+        self._connection().execute("DELETE FROM sessions WHERE game_id = ?", (game_id,))
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in any Redis-protocol server (Redis, Valkey or KeyDB), shared by all
+    workers and nodes. Needs the optional 'redis' package, see requirements.txt.
+    """
+
+    def __init__(self, url: str, key_prefix: str = "banana:session:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError(
+                "The redis session store needs the 'redis' package: pip install redis") from e
+
+        self.key_prefix = key_prefix
+        self._redis = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+
+    def _key(self, game_id: str) -> str:
+        return f"{self.key_prefix}{game_id}"
+
+    def get(self, game_id: str) -> Optional[Session]:
+        data = self._redis.get(self._key(game_id))
+        return json.loads(data) if data else None
+
+    def put(self, game_id: str, session: Session):
+        session["updated_at"] = time.time()
+        self._redis.set(self._key(game_id), json.dumps(session))
+
+    def update(self, game_id: str, mutate: Callable[[Session], None]) -> Optional[Session]:
+        key = self._key(game_id)
+        # optimistic transaction, retried if another worker wrote the session in between
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    data = pipe.get(key)
+                    if not data:
+                        pipe.unwatch()
+                        return None
+                    session = json.loads(data)
+                    mutate(session)
+                    session["updated_at"] = time.time()
+                    pipe.multi()
+                    pipe.set(key, json.dumps(session))
+                    pipe.execute()
+                    return session
+                except self._watch_error:
+                    continue
+
+    def delete(self, game_id: str):
+        self._redis.delete(self._key(game_id))
+
+
+class HotSessionCache(SessionStore):
+    """
+    A small per-worker LRU in front of a shared store. Entries expire after
+    `ttl_seconds` so that writes from other workers become visible quickly,
+    and local writes go through to the shared store and refresh the cache.
+    """
+
+    def __init__(self, backend: SessionStore, max_entries: int = 1024, ttl_seconds: float = 1.0):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _remember(self, game_id: str, session: Optional[Session]):
+        with self._lock:
+            if session is None:
+                self._entries.pop(game_id, None)
+                return
+            self._entries[game_id] = (time.monotonic(), json.dumps(session))
+            self._entries.move_to_end(game_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, game_id: str) -> Optional[Session]:
+        with self._lock:
+            entry = self._entries.get(game_id)
+            if entry and time.monotonic() - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(game_id)
+                self.hits += 1
+                # hand out a copy so that callers can't mutate the cached session
+                return json.loads(entry[1])
+            self.misses += 1
+
+        return self.get_fresh(game_id)
+
+    def get_fresh(self, game_id: str) -> Optional[Session]:
+        with span("session_read"):
+            session = self.backend.get(game_id)
+        self._remember(game_id, session)
+        return session
+
+    def put(self, game_id: str, session: Session):
+        with span("session_write"):
+            self.backend.put(game_id, session)
+        self._remember(game_id, session)
+
+    def update(self, game_id: str, mutate: Callable[[Session], None]) -> Optional[Session]:
+        with span("session_write"):
+            session = self.backend.update(game_id, mutate)
+        self._remember(game_id, session)
+        return session
+
+    def delete(self, game_id: str):
+        self.backend.delete(game_id)
+        self._remember(game_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "hot_entries": len(self._entries),
+                "hot_hits": self.hits,
+                "hot_misses": self.misses,
+            }
+
+
+def create_session_store(url: str) -> SessionStore:
+    """
+    Builds the session store from a url:
+        sqlite:///<path>  - SQLite (WAL) database shared by the workers of one node.
+        redis://...       - Redis-protocol server shared by every node.
+    """
+    if url.startswith("sqlite:///"):
+        backend = SQLiteSessionStore(url[len("sqlite:///"):])
+    elif url.startswith(("redis://", "rediss://", "unix://")):
+        backend = RedisSessionStore(url)
+    else:
+        raise ValueError(f"Unsupported session store url: {url}")
+    return HotSessionCache(backend)
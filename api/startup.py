@@ -0,0 +1,78 @@
+import gc
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Imported first by the app, so this is about when the worker (or, with
+# `--preload`, the gunicorn master) started importing it.
+IMPORT_STARTED = time.perf_counter()
+
+
+class StartupProfile:
+    """
+    Wall time of the startup phases of a worker: importing the app, the lifespan up
+    to the first request it can serve, and the background warm-up (provider SDKs &
+    clients, connections). Printed once the worker is ready and served on
+    `/api/startup_stats`, see scripts/profile_startup.py for a per-module breakdown.
+    """
+
+    def __init__(self, started: float):
+        self.started = started
+        self.phases: Dict[str, float] = {}
+        self.ready_seconds: Optional[float] = None
+        self.warm_seconds: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - started, 4)
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = round(seconds, 4)
+
+    def mark_ready(self):
+        """
+        The worker can serve requests, the warm-up may still be running.
+        """
+        self.ready_seconds = round(time.perf_counter() - self.started, 4)
+        print(f"🚀 Ready to serve {self.ready_seconds:.2f}s after the app import started")
+
+    def mark_warm(self):
+        self.warm_seconds = round(time.perf_counter() - self.started, 4)
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        print(f"🔥 Warmed up {self.warm_seconds:.2f}s after the app import started ({phases})")
+
+    def stats(self) -> dict:
+        return {
+            "ready_s": self.ready_seconds,
+            "warm_s": self.warm_seconds,
+            "phases": dict(self.phases),
+        }
+
+
+def preload():
+    """
+    Run by the gunicorn master once it imported the app (`preload_app`, see
+    gunicorn.conf.py): imports what the workers would otherwise import on their
+    own, so they share it copy-on-write and start serving right after the fork.
+    Provider clients & connections are per worker, they are never created here.
+    """
+    from PIL import Image
+
+    from api.providers import import_provider_modules
+
+    with startup_profile.phase("preload"):
+        import_provider_modules()
+        # registers every PIL plugin now rather than on the first image opened
+        Image.init()
+    # the objects allocated so far live as long as the workers, moving them out of
+    # the collector's reach keeps a collection from dirtying (& copying) their pages
+    gc.freeze()
+    print(f"📦 Preloaded the app in {time.perf_counter() - startup_profile.started:.2f}s")
+
+
+# Shared by the app & the gunicorn hooks.
+startup_profile = StartupProfile(IMPORT_STARTED)
@@ -0,0 +1,211 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from api.schemas import StoryNode
+
+# File layout (little endian):
+#   magic (4 bytes) | format version (u16) | reserved (u16) | header length (u32)
+#   header          | json: string table position, theme -> story keys, story key -> record position,
+#                     story key -> signature of its source files (to detect a stale bundle)
+#   string table    | count + 1 offsets (u32) | utf-8 blob
+#   story records   | one compact json object per story (theme, digest, node offsets, adjacency, metadata)
+#   node records    | 7 x u32 (id, scene_description, character_pose_description, narration,
+#                     is_ending, outcome, choice count) + choice count x (text, next_id), as string ids
+# Only the header is parsed when the bundle is opened, everything else is read on first use.
+BUNDLE_MAGIC = b"BSSB"
+BUNDLE_FORMAT_VERSION = 2
+_PREAMBLE = struct.Struct("<4sHHI")
+_NODE = struct.Struct("<7I")
+_NO_STRING = 0xFFFFFFFF
+
+
+class _StringTable:
+    """
+    Interns the strings of every story (step ids, choices, repeated prompts, ...) so each is stored once.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._strings: List[bytes] = []
+
+    def intern(self, value) -> int:
+        if value is None:
+            return _NO_STRING
+        string_id = self._ids.get(value)
+        if string_id is None:
+            string_id = self._ids[value] = len(self._strings)
+            self._strings.append(value.encode("utf-8"))
+        return string_id
+
+    def to_bytes(self) -> bytes:
+        offsets = [0]
+        for string in self._strings:
+            offsets.append(offsets[-1] + len(string))
+        return struct.pack(f"<{len(offsets)}I", *offsets) + b"".join(self._strings)
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+
+def _encode_node(node: StoryNode, strings: _StringTable) -> bytes:
+    choices = [string_id for choice in node.choices
+               for string_id in (strings.intern(choice.text), strings.intern(choice.next_id))]
+    return _NODE.pack(strings.intern(node.id), strings.intern(node.scene_description),
+                      strings.intern(node.character_pose_description), strings.intern(node.narration),
+                      int(node.is_ending), strings.intern(node.outcome), len(node.choices)) \
+        + struct.pack(f"<{len(choices)}I", *choices)
+
+
+def write_bundle(path: Union[str, Path], entries: Iterable[Any],
+                 sources: Optional[Dict[str, Any]] = None) -> dict:
+    """
+    Compiles story index entries (anything with key, theme, prologue, nodes, children,
+    digest & metadata) into a bundle file, written atomically. `sources` maps story
+    keys to a json signature of the files they were read from, kept in the header.
+    Returns a summary: {"stories", "nodes", "strings", "bytes"}.
+    """
+    strings = _StringTable()
+    nodes_blob = bytearray()
+    records = {}
+    node_count = 0
+    for entry in entries:
+        node_offsets = []
+        for step_id, node in entry.nodes.items():
+            node_offsets.append([strings.intern(step_id), len(nodes_blob)])
+            nodes_blob += _encode_node(node, strings)
+            node_count += 1
+        records[entry.key] = {
+            "theme": entry.theme,
+            "digest": entry.digest,
+            "prologue": strings.intern(entry.prologue),
+            "start": strings.intern(entry.start_id),
+            "nodes": node_offsets,
+            "children": [[strings.intern(child_id) for child_id in entry.children[step_id]]
+                         for step_id in entry.nodes],
+            "metadata": dict(entry.metadata),
+        }
+
+    # the offsets in the header depend on the header's length, so lay out everything after it first
+    themes: Dict[str, List[str]] = {}
+    for key, record in records.items():
+        themes.setdefault(record["theme"], []).append(key)
+    strings_blob = strings.to_bytes()
+    story_blobs = {key: json.dumps(record, separators=(",", ":")).encode("utf-8") for key, record in records.items()}
+    relative_offsets = {}
+    position = len(strings_blob)
+    for key, blob in story_blobs.items():
+        relative_offsets[key] = [position, len(blob)]
+        position += len(blob)
+    nodes_offset = position
+
+    header_length = 0
+    while True:
+        base = _PREAMBLE.size + header_length
+        header = json.dumps({
+            "strings": [base, len(strings)],
+            "nodes": base + nodes_offset,
+            "themes": themes,
+            "stories": {key: [base + offset, length] for key, (offset, length) in relative_offsets.items()},
+            "sources": sources or {},
+        }, separators=(",", ":")).encode("utf-8")
+        if len(header) <= header_length:
+            break
+        header_length = len(header)
+    header = header.ljust(header_length)
+
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".bundle-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_PREAMBLE.pack(BUNDLE_MAGIC, BUNDLE_FORMAT_VERSION, 0, header_length))
+            f.write(header)
+            f.write(strings_blob)
+            for blob in story_blobs.values():
+                f.write(blob)
+            f.write(nodes_blob)
+        # mkstemp creates the file private, the workers may run as another user
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {"stories": len(records), "nodes": node_count, "strings": len(strings), "bytes": path.stat().st_size}
+
+
+class StoryBundle:
+    """
+    Read-only view of a bundle file. The file is memory-mapped, so every worker
+    shares the same page-cache copy, and only the header is parsed up front:
+    story records & nodes are decoded when they're first asked for.
+
+    Raises:
+        ValueError: if the file isn't a bundle of the supported format version.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _PREAMBLE.size:
+            raise ValueError(f"{self.path} is not a story bundle")
+        magic, version, _, header_length = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f"{self.path} is not a story bundle")
+        if version != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"{self.path} has format version {version}, expected {BUNDLE_FORMAT_VERSION}")
+        header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        self._strings_offset, self._string_count = header["strings"]
+        self._blob_offset = self._strings_offset + 4 * (self._string_count + 1)
+        self._nodes_offset = header["nodes"]
+        self._stories: Dict[str, Tuple[int, int]] = header["stories"]
+        self._themes: Dict[str, List[str]] = header["themes"]
+        # story key -> signature of its source files when the bundle was built
+        self.sources: Dict[str, Any] = header["sources"]
+
+    def keys(self) -> Tuple[str, ...]:
+        return tuple(self._stories)
+
+    def themes(self) -> Dict[str, str]:
+        """
+        Map of story key -> theme, read from the header.
+        """
+        return {key: theme for theme, keys in self._themes.items() for key in keys}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._stories
+
+    def string(self, string_id: int):
+        if string_id == _NO_STRING:
+            return None
+        start, end = struct.unpack_from("<2I", self._mmap, self._strings_offset + 4 * string_id)
+        return self._mmap[self._blob_offset + start:self._blob_offset + end].decode("utf-8")
+
+    def story(self, key: str) -> dict:
+        """
+        The story's record: theme, digest, prologue & start (string ids), nodes [[step id, offset]],
+        children (string ids, in node order) and metadata.
+        """
+        offset, length = self._stories[key]
+        return json.loads(self._mmap[offset:offset + length])
+
+    def node(self, offset: int) -> StoryNode:
+        position = self._nodes_offset + offset
+        step_id, scene, pose, narration, is_ending, outcome, choice_count = _NODE.unpack_from(self._mmap, position)
+        choices = struct.unpack_from(f"<{2 * choice_count}I", self._mmap, position + _NODE.size)
+        return StoryNode(
+            id=self.string(step_id),
+            scene_description=self.string(scene),
+            character_pose_description=self.string(pose),
+            narration=self.string(narration),
+            choices=[{"text": self.string(choices[i]), "next_id": self.string(choices[i + 1])}
+                     for i in range(0, len(choices), 2)],
+            is_ending=bool(is_ending),
+            outcome=self.string(outcome),
+        )
@@ -1,9 +1,11 @@
 import json
-from pathlib import Path
-import random
 from api.constants import DEFAULT_THEME, MOCK_DATA_DIR, TEXT_MODEL_ID, THEME_CONFIG
 from api.schemas import Story
+from api.story_index import StoryEntry, get_story_index
 from api.prompts import setup_screen_prompt_template
+from api.provider_gateway import provider_gateway
+from api.story_validation import analyse_story, validate_story
+from pydantic import ValidationError
 import re
 
 
@@ -26,58 +28,61 @@ def _clean_and_parse_json(raw_text: str):
     return json.loads(json_str)
 
 
-def _mock_story_generation(theme: str) -> dict:
+def generate_story(theme, step_count=3, client=None, mock=False) -> StoryEntry:
     """
-    Helper funtion to mock the story generation to avoid expensive API calls
-    Returns:
-        _type_: Story data from saved json
+    Picks a story for the theme from the preloaded story index.
+    Mock mode returns the theme's mock story, whose scenes are saved in the mock data.
     """
-    print("🙃 mocking story generation...")
-
-    with open(f"{MOCK_DATA_DIR}/{theme}/story.json", "r") as file:
-        story_data = json.load(file)
-    return story_data
-
-
-def generate_story(theme, step_count=3, client=None, mock=False):
-
-    # skip data generation if mocked data is needed
     if mock:
-        return _mock_story_generation(theme)
+        print("🙃 mocking story generation...")
 
-    ## select random number from 1 to 5
+    ## select a random pregenerated story for the theme
     ## limiting to pregenerated stories for conserve API costs.
-    story_index = random.randint(1, 5)
+    return get_story_index().pick(theme, mock=mock)
 
-    pregenerated_story_path = Path(
-        __file__).resolve().parent.parent / "api"/"data"/theme/f"story_{story_index}.json"
-    
-    with open(pregenerated_story_path, "r") as file:
-        story_data = json.load(file)
-    return story_data
-    
-    # theme_data = THEME_CONFIG.get(theme, THEME_CONFIG[DEFAULT_THEME])
-    # story_theme_prompt = theme_data.get("story_theme_prompt")
 
-    # # format the final prompt
-    # final_prompt = setup_screen_prompt_template.format(
-    #     theme=story_theme_prompt, step_count=step_count)
-
-    # print("🚀 Generating story from theme...")
-
-    # response = client.models.generate_content(
-    #     model=TEXT_MODEL_ID,
-    #     contents=final_prompt,
-    #     config={
-    #         "response_mime_type": "application/json",
-    #         "response_schema": Story,
-    #     },
-    # )
-    # print("✅ Story Generated!")
+def generate_story_from_model(theme, step_count=3, client=None) -> Story:
+    """
+    Asks the text model for a brand new story for the theme and validates it
+    against the story schema & graph rules.
 
-    # # story_json_text = response.text
-    # # parse story data
-    # # story_data = json.loads(story_json_text)
-    # story_data = _clean_and_parse_json(response.text)
-    # # return story data
-    # return story_data
+    Raises:
+        ValueError: if the response isn't a valid, playable story.
+    """
+    theme_data = THEME_CONFIG.get(theme, THEME_CONFIG[DEFAULT_THEME])
+    story_theme_prompt = theme_data.get("story_theme_prompt")
+
+    # format the final prompt
+    final_prompt = setup_screen_prompt_template.format(
+        theme=story_theme_prompt, step_count=step_count)
+
+    print("🚀 Generating story from theme...")
+
+    response = provider_gateway.call(
+        "gemini_text",
+        client.models.generate_content,
+        model=TEXT_MODEL_ID,
+        contents=final_prompt,
+        config={
+            "response_mime_type": "application/json",
+            "response_schema": Story,
+        },
+    )
+    print("✅ Story Generated!")
+
+    # parse story data
+    try:
+        story_data = _clean_and_parse_json(response.text or "")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Response is not valid json: {e}") from e
+    if not isinstance(story_data, dict):
+        raise ValueError(f"Response is a json {type(story_data).__name__}, not a story object")
+    story_data["theme"] = theme
+
+    validate_story(story_data)
+    # the graph rules: every step reachable from the start & able to reach an ending
+    analyse_story(story_data)
+    try:
+        return Story.model_validate(story_data)
+    except ValidationError as e:
+        raise ValueError(f"Story doesn't match the schema: {e}") from e
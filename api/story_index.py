@@ -0,0 +1,344 @@
+import json
+import random
+from collections.abc import Mapping as MappingABC
+from functools import cached_property, lru_cache
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple, Union
+
+from pydantic import ValidationError
+
+from api.cache import content_key
+from api.constants import MOCK_DATA_DIR, STORY_BUNDLE_PATH, STORY_DATA_DIR
+from api.schemas import Story, StoryNode
+from api.story_bundle import StoryBundle
+
+# Written next to each story.json by scripts/verify_stories.py
+METADATA_FILE_NAME = "metadata.json"
+
+
+@dataclass(frozen=True)
+class StoryEntry:
+    """
+    A validated, immutable story with O(1) node lookups.
+
+    Attributes:
+        key: Unique key of the story, e.g. "Haunted Space Station/story_2" or "mock/Haunted Space Station".
+        theme: The story theme.
+        prologue: The story prologue.
+        start_id: Id of the first step.
+        nodes: Map of step id -> story node, in story order.
+        children: Map of step id -> ids of the steps reachable with one choice.
+        digest: Content hash of the story, used in cache keys.
+        metadata: Graph analysis of the story (levels, path lengths, per step reach
+            probability, ...) from scripts/verify_stories.py, empty if it wasn't verified.
+    """
+    key: str
+    theme: str
+    prologue: str
+    start_id: str
+    nodes: Mapping[str, StoryNode]
+    children: Mapping[str, Tuple[str, ...]]
+    digest: str
+    metadata: Mapping[str, Any] = field(default_factory=lambda: MappingProxyType({}))
+
+    @cached_property
+    def story(self) -> Story:
+        """
+        The whole story, built on first use (decodes every node of a bundled story).
+        """
+        return Story(prologue=self.prologue, story_tree=list(self.nodes.values()), theme=self.theme)
+
+    def node(self, step_id: str) -> Optional[StoryNode]:
+        return self.nodes.get(step_id)
+
+    @classmethod
+    def from_dict(cls, key: str, story_data: Dict[str, Any], theme: Optional[str] = None,
+                  metadata: Optional[Dict[str, Any]] = None) -> "StoryEntry":
+        """
+        Validates raw story data (as loaded from json) and builds its lookup maps.
+        Raises pydantic's ValidationError if the story doesn't match the schema.
+        """
+        story = Story.model_validate(story_data)
+        theme = theme or story.theme
+        nodes = {node.id: node for node in story.story_tree}
+        children = {node.id: tuple(choice.next_id for choice in node.choices)
+                    for node in story.story_tree}
+        digest = content_key(json.dumps(story.model_dump(mode="json"), sort_keys=True))
+        return cls(key=key, theme=theme, prologue=story.prologue, start_id=story.story_tree[0].id,
+                   nodes=MappingProxyType(nodes), children=MappingProxyType(children), digest=digest,
+                   metadata=MappingProxyType(metadata or {}))
+
+
+class _BundledNodes(MappingABC):
+    """
+    Step id -> story node of a bundled story, each node decoded from the bundle on first access.
+    """
+
+    def __init__(self, bundle: StoryBundle, offsets: Dict[str, int]):
+        self._bundle = bundle
+        self._offsets = offsets
+        self._nodes: Dict[str, StoryNode] = {}
+
+    def __getitem__(self, step_id: str) -> StoryNode:
+        node = self._nodes.get(step_id)
+        if node is None:
+            node = self._nodes[step_id] = self._bundle.node(self._offsets[step_id])
+        return node
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+
+class _BundledEntries(MappingABC):
+    """
+    Story key -> StoryEntry of a bundle, each entry decoded on first access. A story
+    whose files changed since the bundle was built is read from its json file instead,
+    checked then rather than for every story when a worker starts.
+    """
+
+    def __init__(self, bundle: StoryBundle, story_paths: Optional[Dict[str, Tuple[str, Path]]] = None):
+        self._bundle = bundle
+        self._keys = bundle.keys()
+        # story key -> (theme, story.json path)
+        self._story_paths = story_paths or {}
+        self._entries: Dict[str, StoryEntry] = {}
+
+    def __getitem__(self, key: str) -> StoryEntry:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = self._load(key)
+        return entry
+
+    def _load(self, key: str) -> StoryEntry:
+        source = self._story_paths.get(key)
+        if source is not None and not _is_fresh(self._bundle.sources.get(key), source[1]):
+            print(f"⚠️ {key} changed since the story bundle was built, rebuild it with scripts/build_story_bundle.py")
+            entry = _load_entry(key, source[1], source[0])
+            if entry is not None:
+                return entry
+        return self._decode(key)
+
+    def _decode(self, key: str) -> StoryEntry:
+        record = self._bundle.story(key)
+        string = self._bundle.string
+        step_ids = [string(step_id) for step_id, _ in record["nodes"]]
+        offsets = {step_id: offset for step_id, (_, offset) in zip(step_ids, record["nodes"])}
+        children = {step_id: tuple(string(child_id) for child_id in child_ids)
+                    for step_id, child_ids in zip(step_ids, record["children"])}
+        return StoryEntry(key=key, theme=record["theme"], prologue=string(record["prologue"]),
+                          start_id=string(record["start"]), nodes=_BundledNodes(self._bundle, offsets),
+                          children=MappingProxyType(children), digest=record["digest"],
+                          metadata=MappingProxyType(record["metadata"] or {}))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self._bundle
+
+
+class StoryIndex:
+    """
+    All the pregenerated (and mock) stories, loaded once and shared by every game.
+    Games reference a story by its key instead of keeping a copy of it.
+    """
+
+    def __init__(self, entries: Mapping[str, StoryEntry], themes: Optional[Mapping[str, str]] = None):
+        """
+        Args:
+            entries: Map of story key -> entry, may decode the entries lazily.
+            themes: Map of story key -> theme, so that the entries aren't decoded to group them.
+        """
+        self._entries = entries if isinstance(entries, _BundledEntries) else MappingProxyType(dict(entries))
+        if themes is None:
+            themes = {key: entry.theme for key, entry in self._entries.items()}
+        by_theme: Dict[str, list] = {}
+        for key, theme in themes.items():
+            if not key.startswith("mock/"):
+                by_theme.setdefault(theme, []).append(key)
+        self._keys_by_theme = MappingProxyType(
+            {theme: tuple(sorted(keys)) for theme, keys in by_theme.items()})
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[StoryEntry]:
+        return self._entries.get(key)
+
+    def keys(self) -> Tuple[str, ...]:
+        """
+        Keys of every story, mock stories included.
+        """
+        return tuple(self._entries)
+
+    def keys_for_theme(self, theme: str) -> Tuple[str, ...]:
+        return self._keys_by_theme.get(theme, ())
+
+    def pick(self, theme: str, mock: bool = False) -> StoryEntry:
+        """
+        Picks a random pregenerated story for a theme (or the theme's mock story).
+        """
+        if mock:
+            key = f"mock/{theme}"
+        else:
+            keys = self.keys_for_theme(theme)
+            if not keys:
+                raise ValueError(f"No stories found for theme '{theme}'.")
+            key = random.choice(keys)
+        entry = self.get(key)
+        if entry is None:
+            raise ValueError(f"Story '{key}' not found.")
+        return entry
+
+
+def _load_metadata(story_path: Path, story_bytes: bytes) -> Optional[Dict[str, Any]]:
+    # stale metadata (the story changed since it was verified) is ignored
+    metadata_path = story_path.with_name(METADATA_FILE_NAME)
+    if not metadata_path.exists():
+        return None
+    try:
+        metadata = json.loads(metadata_path.read_text())
+    except json.JSONDecodeError:
+        return None
+    return metadata if metadata.get("story_hash") == content_key(story_bytes) else None
+
+
+def _load_entry(key: str, story_path: Path, theme: str) -> Optional[StoryEntry]:
+    try:
+        story_bytes = story_path.read_bytes()
+        story_data = json.loads(story_bytes)
+        return StoryEntry.from_dict(key, story_data, theme=theme,
+                                    metadata=_load_metadata(story_path, story_bytes))
+    except (json.JSONDecodeError, ValidationError) as e:
+        print(f"❌ Skipping invalid story {story_path}: {e}")
+        return None
+
+
+def _file_stat(path: Path) -> Optional[List[int]]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _source_digest(story_path: Path) -> str:
+    parts = []
+    for path in (story_path, story_path.with_name(METADATA_FILE_NAME)):
+        try:
+            parts.append(path.read_bytes())
+        except FileNotFoundError:
+            parts.append(None)
+    return content_key(*parts)
+
+
+def _source_signature(story_path: Path) -> list:
+    # [size & mtime of story.json, of metadata.json (or None), digest of both]
+    return [_file_stat(story_path), _file_stat(story_path.with_name(METADATA_FILE_NAME)),
+            _source_digest(story_path)]
+
+
+def _is_fresh(signature: Optional[list], story_path: Path) -> bool:
+    # stat first, the files are only hashed when they were touched (e.g. by a fresh checkout)
+    if not signature:
+        return False
+    if [_file_stat(story_path), _file_stat(story_path.with_name(METADATA_FILE_NAME))] == signature[:2]:
+        return True
+    return _source_digest(story_path) == signature[2]
+
+
+def _story_paths(data_root: Union[str, Path], mock_root: Union[str, Path]) -> List[Tuple[str, str, Path]]:
+    """
+    (key, theme, path) of every story under `data_root/<theme>/story_N/story.json`
+    and of the mock stories under `mock_root/<theme>/story.json`.
+    """
+    paths = []
+    for story_path in sorted(Path(data_root).glob("*/story_*/story.json")):
+        theme = story_path.parent.parent.name
+        paths.append((f"{theme}/{story_path.parent.name}", theme, story_path))
+    for story_path in sorted(Path(mock_root).glob("*/story.json")):
+        theme = story_path.parent.name
+        paths.append((f"mock/{theme}", theme, story_path))
+    return paths
+
+
+def story_sources(data_root: Union[str, Path] = STORY_DATA_DIR,
+                  mock_root: Union[str, Path] = MOCK_DATA_DIR) -> Dict[str, list]:
+    """
+    Story key -> signature of the files the story is read from (sizes, mtimes &
+    digest), recorded in the story bundle to tell when it's out of date.
+    """
+    return {key: _source_signature(story_path) for key, _, story_path in _story_paths(data_root, mock_root)}
+
+
+def stale_bundle_stories(bundle_path: Union[str, Path] = STORY_BUNDLE_PATH,
+                         data_root: Union[str, Path] = STORY_DATA_DIR,
+                         mock_root: Union[str, Path] = MOCK_DATA_DIR) -> List[str]:
+    """
+    Keys of the stories added, removed or changed since the bundle was built, for
+    a build or deploy step to check once (e.g. `build_story_bundle.py --check`).
+    Raises OSError / ValueError if the bundle can't be read.
+    """
+    bundle = StoryBundle(bundle_path)
+    story_paths = _story_paths(data_root, mock_root)
+    stale = set(bundle.keys()) ^ {key for key, _, _ in story_paths}
+    stale.update(key for key, _, story_path in story_paths
+                 if key in bundle and not _is_fresh(bundle.sources.get(key), story_path))
+    return sorted(stale)
+
+
+def _load_bundle(bundle_path: Path, story_paths: List[Tuple[str, str, Path]]) -> Optional[StoryIndex]:
+    try:
+        bundle = StoryBundle(bundle_path)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring the story bundle: {e}")
+        return None
+    # a story was added or removed since the bundle was built (edited ones are checked when used)
+    if set(bundle.keys()) != {key for key, _, _ in story_paths}:
+        print("⚠️ The story bundle is out of date, rebuild it with scripts/build_story_bundle.py")
+        return None
+    print(f"📚 Mapped {len(bundle.keys())} stories from {bundle_path.name}")
+    return StoryIndex(_BundledEntries(bundle, {key: (theme, path) for key, theme, path in story_paths}),
+                      themes=bundle.themes())
+
+
+def load_story_index(data_root: Union[str, Path] = STORY_DATA_DIR,
+                     mock_root: Union[str, Path] = MOCK_DATA_DIR,
+                     bundle_path: Optional[Union[str, Path]] = STORY_BUNDLE_PATH) -> StoryIndex:
+    """
+    Loads every story under `data_root/<theme>/story_N/story.json` and the mock
+    stories under `mock_root/<theme>/story.json` into a StoryIndex.
+
+    When the compiled story bundle exists (and has the same stories), the index is
+    served from it instead: nothing but its header is read until a story is used.
+    """
+    story_paths = _story_paths(data_root, mock_root)
+    if bundle_path and Path(bundle_path).exists():
+        index = _load_bundle(Path(bundle_path), story_paths)
+        if index is not None:
+            return index
+
+    entries = {}
+    for key, theme, story_path in story_paths:
+        entry = _load_entry(key, story_path, theme)
+        if entry:
+            entries[key] = entry
+
+    print(f"📚 Loaded {len(entries)} stories into the story index")
+    return StoryIndex(entries)
+
+
+@lru_cache(maxsize=None)
+def get_story_index() -> StoryIndex:
+    """
+    The process-wide story index, loaded on first use.
+    """
+    return load_story_index()
@@ -0,0 +1,219 @@
+# --- Helper Functions  ---
+def is_valid_string_value(obj, key):
+    val = obj.get(key)
+    return isinstance(val, str) and len(val) > 0
+
+def is_valid_list_value(obj, key):
+    val = obj.get(key)
+    return isinstance(val, list)
+
+def is_valid_bool_value(obj, key):
+    val = obj.get(key)
+    return isinstance(val, bool)
+
+
+def validate_story(story_obj: dict):
+    """
+    Checks a story (as loaded from json) against the structural & graph rules
+    every playable story must follow.
+
+    Raises:
+        ValueError: describing the first rule the story breaks.
+    """
+    # --- Structural Validation ---
+    if not all(k in story_obj for k in ["prologue", "story_tree"]):
+        raise ValueError("Missing 'prologue' or 'story_tree' key.")
+
+    story_tree = story_obj["story_tree"]
+    if not isinstance(story_tree, list) or not story_tree:
+        raise ValueError("'story_tree' is not a valid, non-empty list.")
+    if not all(isinstance(step, dict) for step in story_tree):
+        raise ValueError("Every step of 'story_tree' must be an object.")
+
+    # --- Relational Validation (The Optimization) ---
+    # 1. Prepare Once: Create a set of all valid IDs for instant lookups.
+    all_step_ids = {step.get("id") for step in story_tree}
+    if None in all_step_ids:
+        raise ValueError("A step is missing an 'id' key.")
+
+    # 2. Check for ID uniqueness
+    if len(all_step_ids) != len(story_tree):
+        raise ValueError("Duplicate 'id' found in story_tree.")
+
+    # 3. Check for the required 'start' node
+    if "start" not in all_step_ids:
+        raise ValueError("Missing required step with id 'start'.")
+
+    if not is_valid_string_value(story_obj, "theme"):
+        raise ValueError("Missing or invalid 'theme'.")
+
+    # Step 3: loop thru story sections and validate them
+    for step in story_tree:
+        if not all(is_valid_string_value(step, k) for k in ["id", "scene_description", "character_pose_description", "narration"]):
+            raise ValueError(f"Step '{step.get('id')}' has missing or invalid string fields.")
+
+        if not is_valid_bool_value(step, "is_ending"):
+            raise ValueError(f"Step '{step.get('id')}' has invalid 'is_ending' flag.")
+
+        choices = step.get("choices", [])
+        if not isinstance(choices, list) or not all(isinstance(choice, dict) for choice in choices):
+            raise ValueError(f"Step '{step['id']}' has invalid 'choices'.")
+        if step["is_ending"]:
+            if choices:
+                raise ValueError(f"Ending step '{step['id']}' must not have choices.")
+            if not is_valid_string_value(step, "outcome"):
+                raise ValueError(f"Ending step '{step['id']}' is missing an 'outcome'.")
+        else: # Not an ending step
+            if not choices: # Must have at least one choice
+                raise ValueError(f"Non-ending step '{step['id']}' has no choices.")
+            # Validate that all next_ids point to a real step
+            if len(choices) < 2: # Must have at least one choice
+                raise ValueError(f"Non-ending step '{step['id']}' has less than 2 choices.")
+            for choice in choices:
+                next_id = choice.get("next_id")
+                if not next_id or next_id not in all_step_ids:
+                    raise ValueError(f"Step '{step['id']}' has a choice pointing to an invalid next_id: '{next_id}'.")
+
+
+
+# Bump when `analyse_story` changes, cached verification results of older versions are ignored.
+ANALYSIS_VERSION = "1"
+
+
+def analyse_story(story_obj: dict) -> dict:
+    """
+    Full graph analysis of a story that passed `validate_story`: every step must be
+    reachable from "start" and every path must eventually end. Cycles are allowed
+    (e.g. a failed attempt looping back to an earlier step) but are reported, and the
+    path metrics are computed without looping back.
+
+    Returns:
+        dict: Per-story metadata the runtime can use to plan work, e.g. the
+        breadth-first levels of the story, path lengths and, per step, its depth,
+        parents, steps to an ending and the chance to reach it with random choices.
+
+    Raises:
+        ValueError: for unreachable steps or steps that can't reach an ending.
+    """
+    steps = {step["id"]: step for step in story_obj["story_tree"]}
+    children = {
+        step_id: list(dict.fromkeys(choice["next_id"] for choice in step.get("choices", [])))
+        for step_id, step in steps.items()
+    }
+
+    # 1. Reachability & breadth-first levels
+    depth = {"start": 0}
+    parents = {step_id: [] for step_id in steps}
+    levels = [["start"]]
+    while levels[-1]:
+        next_level = []
+        for step_id in levels[-1]:
+            for next_id in children[step_id]:
+                parents[next_id].append(step_id)
+                if next_id not in depth:
+                    depth[next_id] = depth[step_id] + 1
+                    next_level.append(next_id)
+        levels.append(next_level)
+    levels.pop()
+
+    unreachable = sorted(set(steps) - set(depth))
+    if unreachable:
+        raise ValueError(f"Steps not reachable from 'start': {unreachable}.")
+
+    # 2. Cycle detection (iterative DFS). The edges closing a cycle are set aside,
+    # the remaining graph is acyclic and `order` is its post-order (children first).
+    order = []
+    cycles = []
+    forward = {step_id: [] for step_id in steps}
+    on_stack = {"start"}
+    done = set()
+    stack = [("start", iter(children["start"]))]
+    while stack:
+        step_id, pending = stack[-1]
+        next_id = next(pending, None)
+        if next_id is None:
+            stack.pop()
+            on_stack.discard(step_id)
+            done.add(step_id)
+            order.append(step_id)
+        elif next_id in on_stack:
+            path = [frame[0] for frame in stack]
+            cycles.append(path[path.index(next_id):] + [next_id])
+        else:
+            forward[step_id].append(next_id)
+            if next_id not in done:
+                on_stack.add(next_id)
+                stack.append((next_id, iter(children[next_id])))
+
+    # 3. Every step must be able to reach an ending, looping back or not
+    can_end = {step_id for step_id, step in steps.items() if step["is_ending"]}
+    pending = [parent for step_id in can_end for parent in parents[step_id]]
+    while pending:
+        step_id = pending.pop()
+        if step_id not in can_end:
+            can_end.add(step_id)
+            pending.extend(parents[step_id])
+    dead_ends = sorted(set(steps) - can_end)
+    if dead_ends:
+        raise ValueError(f"Steps that never reach an ending: {dead_ends}.")
+
+    # 4. Path lengths, playthroughs & descendants, from the endings up
+    steps_to_end = {}
+    success_steps = {}
+    paths = {}
+    descendants = {}
+    for step_id in order:
+        next_ids = forward[step_id]
+        if steps[step_id]["is_ending"] or not next_ids:
+            # an ending, or a step that only loops back
+            is_success = steps[step_id]["is_ending"] and steps[step_id].get("outcome") == "success"
+            steps_to_end[step_id] = (0, 0)
+            success_steps[step_id] = 0 if is_success else None
+            paths[step_id] = 1
+            descendants[step_id] = set()
+            continue
+        steps_to_end[step_id] = (1 + min(steps_to_end[c][0] for c in next_ids),
+                                 1 + max(steps_to_end[c][1] for c in next_ids))
+        to_success = [success_steps[c] for c in next_ids if success_steps[c] is not None]
+        success_steps[step_id] = 1 + min(to_success) if to_success else None
+        paths[step_id] = sum(paths[c] for c in next_ids)
+        descendants[step_id] = set(next_ids).union(*(descendants[c] for c in next_ids))
+
+    # 5. Chance to reach every step when the choices are picked at random
+    reach_probability = {step_id: 0.0 for step_id in steps}
+    reach_probability["start"] = 1.0
+    for step_id in reversed(order):
+        for next_id in forward[step_id]:
+            reach_probability[next_id] += reach_probability[step_id] / len(children[step_id])
+
+    endings = [step for step in steps.values() if step["is_ending"]]
+    out_degrees = [len(children[step_id]) for step_id, step in steps.items() if not step["is_ending"]]
+    return {
+        "version": ANALYSIS_VERSION,
+        "step_count": len(steps),
+        "ending_count": len(endings),
+        "success_endings": sum(1 for step in endings if step.get("outcome") == "success"),
+        "failure_endings": sum(1 for step in endings if step.get("outcome") == "failure"),
+        "branching_factor": round(sum(out_degrees) / len(out_degrees), 3) if out_degrees else 0.0,
+        "max_branching": max(out_degrees, default=0),
+        "max_depth": len(levels) - 1,
+        "levels": levels,
+        "cycles": cycles,
+        "path_lengths": {
+            "shortest": steps_to_end["start"][0],
+            "longest": steps_to_end["start"][1],
+            "shortest_success": success_steps["start"],
+        },
+        "playthroughs": paths["start"],
+        "steps": {
+            step_id: {
+                "depth": depth[step_id],
+                "parents": parents[step_id],
+                "children": children[step_id],
+                "steps_to_end": list(steps_to_end[step_id]),
+                "descendants": len(descendants[step_id]),
+                "reach_probability": round(reach_probability[step_id], 6),
+            }
+            for step_id in steps
+        },
+    }
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, FC } from "react";
+import React, { useState, useEffect, useRef, useCallback, FC } from "react";
 import { Link, useLocation } from "react-router-dom";
 import { useSound } from "./SoundContext";
 import LoadingSpinner from "./LoadingSpinner";
@@ -55,6 +55,40 @@ const GameEndScreen: FC<GameEndScreenProps> = ({ outcome, message, onRestart })
 );
 
 
+// --- Step Jobs ---
+
+// Follows a step job's server-sent events, merging each piece into the current
+// step as soon as it is ready: the narration audio first, then the scene image.
+const followStepJob = (
+  eventsUrl: string,
+  onUpdate: (fields: any) => void,
+  onComplete: () => void,
+  onFailure: (error: string) => void
+): EventSource => {
+  const events = new EventSource(eventsUrl);
+  events.addEventListener("narration_ready", (e) =>
+    onUpdate(JSON.parse((e as MessageEvent).data))
+  );
+  events.addEventListener("image_ready", (e) =>
+    onUpdate(JSON.parse((e as MessageEvent).data))
+  );
+  events.addEventListener("step_complete", (e) => {
+    onUpdate(JSON.parse((e as MessageEvent).data).step);
+    events.close();
+    onComplete();
+  });
+  events.addEventListener("error", (e) => {
+    // server side job errors carry data, connection errors don't and are retried by the browser
+    if ((e as MessageEvent).data) {
+      const error = JSON.parse((e as MessageEvent).data).error;
+      console.error("Step job failed:", error);
+      events.close();
+      onFailure(error);
+    }
+  });
+  return events;
+};
+
 // --- Main Game Page Component ---
 
 const GamePage: FC = () => {
@@ -64,6 +98,41 @@ const GamePage: FC = () => {
   const [gameId, setGameId] = useState<string | null>(null);
   const { playRandomVoiceLine, playNarration } = useSound();
   const [areChoicesDisabled, setAreChoicesDisabled] = useState(false);
+  // the next step needs the current scene, so choices wait for the step to complete
+  const [isStepComplete, setIsStepComplete] = useState(false);
+  const stepEvents = useRef<EventSource | null>(null);
+  // a step job that failed (its scene was never rendered) and how to request it again
+  const [stepFailure, setStepFailure] = useState<{ error: string; retry: () => Promise<void> } | null>(null);
+
+  // Shows the step's text right away and fills in audio & image as they arrive.
+  // A failed step keeps its choices disabled, the next step would need its scene.
+  const startStepJob = useCallback((job: any, retry: () => Promise<void>) => {
+    stepEvents.current?.close();
+    setIsStepComplete(false);
+    setStepFailure(null);
+    setCurrentStep(job.step);
+    stepEvents.current = followStepJob(
+      job.events_url,
+      (fields) => setCurrentStep((step: any) => ({ ...step, ...fields })),
+      () => setIsStepComplete(true),
+      (error) => setStepFailure({ error, retry })
+    );
+  }, []);
+
+  // Starts a step job (start_game or next_step), retried by sending the same request again.
+  const requestStepJob = useCallback(async (url: string, formData: FormData): Promise<void> => {
+    const response = await fetch(url, {
+      method: "POST",
+      body: formData,
+    });
+    const data = await response.json();
+    if (!response.ok || !data.events_url) {
+      throw new Error(data.detail || response.statusText);
+    }
+    startStepJob(data, () => requestStepJob(url, formData));
+  }, [startStepJob]);
+
+  useEffect(() => () => stepEvents.current?.close(), []);
 
   useEffect(() => {
     const startGame = async () => {
@@ -96,12 +165,7 @@ const GamePage: FC = () => {
       // }
 
       try {
-        const response = await fetch("/api/start_game", {
-          method: "POST",
-          body: formData,
-        });
-        const data = await response.json();
-        setCurrentStep(data.step);
+        await requestStepJob("/api/jobs/start_game", formData);
         setGameId(game_id);
       } catch (error) {
         console.error("Error starting game:", error);
@@ -111,7 +175,9 @@ const GamePage: FC = () => {
     };
 
     startGame();
-  }, [location.state]);
+  }, [location.state, requestStepJob]);
+
+  const narrationAudioUrl = currentStep?.narration_audio_url;
 
   useEffect(() => {
     // const playOutcomeSound = async () => {
@@ -122,14 +188,15 @@ const GamePage: FC = () => {
     // playOutcomeSound();
 
     const playNarrationSound = async () => {
-      if (currentStep && currentStep.narration_audio_url) {
+      if (narrationAudioUrl) {
         setAreChoicesDisabled(true);
-        await playNarration(currentStep.narration_audio_url);
+        await playNarration(narrationAudioUrl);
         setAreChoicesDisabled(false);
       }
     };
     playNarrationSound();
-  }, [currentStep, playNarration, playRandomVoiceLine]);
+    // only (re)play when the narration changes, not when the image arrives
+  }, [narrationAudioUrl, playNarration, playRandomVoiceLine]);
 
   const handleChoice = async (choiceIndex: number) => {
     if (!gameId || !currentStep) return;
@@ -143,12 +210,7 @@ const GamePage: FC = () => {
     formData.append("choice_index", choiceIndex.toString());
 
     try {
-      const response = await fetch("/api/next_step", {
-        method: "POST",
-        body: formData,
-      });
-      const data = await response.json();
-      setCurrentStep(data.step);
+      await requestStepJob("/api/jobs/next_step", formData);
     } catch (error) {
       console.error("Error taking next step:", error);
     } finally {
@@ -156,6 +218,19 @@ const GamePage: FC = () => {
     }
   };
 
+  const handleRetry = async () => {
+    if (!stepFailure) return;
+
+    setIsLoading(true);
+    try {
+      await stepFailure.retry();
+    } catch (error) {
+      console.error("Error retrying step:", error);
+    } finally {
+      setIsLoading(false);
+    }
+  };
+
   const renderContent = () => {
     if (isLoading) {
       return <LoadingSpinner />;
@@ -182,7 +257,13 @@ const GamePage: FC = () => {
           body: formData,
         });
         const data = await response.json();
+        if (!response.ok) {
+          throw new Error(data.detail || response.statusText);
+        }
+        stepEvents.current?.close();
+        setStepFailure(null);
         setCurrentStep(data.step);
+        setIsStepComplete(true);
       } catch (error) {
         console.error("Error restarting game:", error);
       } finally {
@@ -207,6 +288,15 @@ const GamePage: FC = () => {
             </p>
           </div>
 
+          {stepFailure && (
+            <div className="mt-8">
+              <p className="text-red-400 mb-4">
+                Something went wrong while creating this scene.
+              </p>
+              <ChoiceButton text={"Try Again"} onClick={handleRetry} />
+            </div>
+          )}
+
           {currentStep.choices.length > 0 && (
             <div className="mt-8">
               <h3 className="font-newsreader text-xl text-[#f2a20d] mb-4">
@@ -217,7 +307,7 @@ const GamePage: FC = () => {
                   <ChoiceButton
                     key={index}
                     text={choice.text}
-                    disabled={areChoicesDisabled}
+                    disabled={areChoicesDisabled || !isStepComplete}
                     onClick={() => handleChoice(index)}
                   />
                 ))}
@@ -229,11 +319,19 @@ const GamePage: FC = () => {
         {/* Right Column (The Scene) */}
         <div className="w-full md:w-3/5 p-4 bg-black/30">
           <div className="aspect-[9/16] w-full max-w-md mx-auto h-full rounded-lg overflow-hidden shadow-lg shadow-black/50 border-2 border-stone-800/50">
-            <img
-              src={currentStep.scene_image_url}
-              alt="Current game scene"
-              className="w-full h-full object-cover"
-            />
+            {currentStep.scene_image_url ? (
+              <img
+                src={currentStep.scene_image_url}
+                srcSet={currentStep.scene_image_srcset}
+                sizes="(min-width: 768px) 60vw, 100vw"
+                alt="Current game scene"
+                className="w-full h-full object-cover"
+              />
+            ) : (
+              <div className="w-full h-full flex items-center justify-center">
+                <LoadingSpinner />
+              </div>
+            )}
           </div>
         </div>
       </div>
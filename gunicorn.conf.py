@@ -0,0 +1,18 @@
+# Gunicorn settings of the web dyno (see Procfile).
+import os
+
+workers = 4
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app (& the provider SDKs, see `api.startup.preload`) once in the master:
+# the workers fork from it, share that memory copy-on-write and serve right away.
+# Set GUNICORN_PRELOAD=0 to have every worker import the app itself, e.g. so that
+# a HUP reloads the code.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+
+def when_ready(server):
+    # the master, after it imported the app & before it forks the workers
+    if preload_app:
+        from api.startup import preload
+        preload()
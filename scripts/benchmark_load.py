@@ -0,0 +1,330 @@
+"""
+Load test of the game API against fake providers, no API keys or spend needed.
+
+Simulated players play whole journeys (prologue -> start -> choices until an ending
+or `--steps`) concurrently against the app, in process (httpx's ASGI transport), with
+fake Gemini & ElevenLabs clients whose latency, payload size and error rates are
+configurable. Reports the throughput, the p50/p95/p99 latency of every endpoint and
+the event loop lag, and saves them as json to compare commits:
+
+    python scripts/benchmark_load.py --players 20 --journeys 40 --image-latency 6,12
+    python scripts/benchmark_load.py --image-latency 0 --tts-latency 0 --no-provider-limits
+    python scripts/benchmark_load.py --mock --tts-latency 0 --no-provider-limits
+
+The app runs in a scratch directory (`--workdir`), so its caches & sessions start cold
+unless the same workdir is reused. Requires httpx.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Add the parent directory to the Python path to allow imports from the 'api' module
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(REPO_ROOT))
+
+import httpx
+
+from scripts.fake_providers import FakeElevenLabs, FakeGemini, Latency, install
+
+THEMES = ["Haunted Space Station", "Lost Temple of the Jungle",
+          "Cyberpunk Underworld", "Curse of the Banana King"]
+RESULTS_DIR = REPO_ROOT / "bench_results"
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """
+    Nearest-rank percentile of already sorted values.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+def summarise(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(values[-1], 4) if values else 0.0,
+    }
+
+
+class Recorder:
+    """
+    Latencies & failures per endpoint.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def request(self, http: httpx.AsyncClient, endpoint: str, method: str, url: str, **kwargs):
+        """
+        Times one request. Returns the json body, or None if the request failed.
+        """
+        started = time.perf_counter()
+        try:
+            response = await http.request(method, url, **kwargs)
+            body = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+        except Exception as e:
+            return self._fail(endpoint, type(e).__name__)
+        finally:
+            elapsed = time.perf_counter() - started
+        # the endpoints answer errors as a 200 with an ({"error": ...}, status) pair
+        if response.status_code >= 400 or isinstance(body, list):
+            return self._fail(endpoint, str(response.status_code if response.status_code >= 400 else body[-1]))
+        self.latencies.setdefault(endpoint, []).append(elapsed)
+        return body
+
+    def _fail(self, endpoint: str, reason: str):
+        errors = self.errors.setdefault(endpoint, {})
+        errors[reason] = errors.get(reason, 0) + 1
+        return None
+
+    def report(self, seconds: float) -> dict:
+        endpoints = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            latencies = self.latencies.get(endpoint, [])
+            errors = self.errors.get(endpoint, {})
+            endpoints[endpoint] = {
+                **summarise(latencies),
+                "errors": sum(errors.values()),
+                "error_reasons": errors,
+                "per_second": round(len(latencies) / seconds, 3) if seconds else 0.0,
+            }
+        return endpoints
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.05):
+    """
+    Records how late the event loop wakes up from a sleep, i.e. how long it was blocked.
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def play_journey(http, recorder, rng, theme, max_steps, think_seconds, fetch_audio) -> bool:
+    """
+    One player: prologue -> start -> random choices until an ending or `max_steps`.
+    Returns whether the journey made it to the end.
+    """
+    async def listen(url):
+        # a streamed narration is generated while the player listens
+        if fetch_audio and url and url.startswith("/api/narration/"):
+            await recorder.request(http, "narration", "GET", url)
+
+    async def think():
+        if think_seconds:
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * think_seconds)
+
+    prologue = await recorder.request(http, "prologue", "POST", "/api/prologue", data={
+        "theme": theme, "animal": "Wolf",
+        "personalities": json.dumps(["Brave", "Curious"]), "accessories": json.dumps(["Amulet", "Map"]),
+    })
+    if prologue is None:
+        return False
+    game_id = prologue["game_id"]
+    await listen(prologue.get("prologue_narration_url"))
+    await think()
+
+    started = await recorder.request(http, "start_game", "POST", "/api/start_game",
+                                     data={"theme": theme, "game_id": game_id})
+    if started is None:
+        return False
+    step = started["step"]
+    await listen(step.get("narration_audio_url"))
+
+    for _ in range(max_steps):
+        if step["is_ending"]:
+            break
+        await think()
+        next_step = await recorder.request(http, "next_step", "POST", "/api/next_step", data={
+            "game_id": game_id, "current_step_id": step["id"],
+            "choice_index": rng.randrange(len(step["choices"])),
+        })
+        if next_step is None:
+            return False
+        step = next_step["step"]
+        await listen(step.get("narration_audio_url"))
+    return True
+
+
+async def run_load(app, args) -> dict:
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    lag_samples = []
+    journeys = iter(range(args.journeys))
+    completed = 0
+
+    async def player(player_id):
+        nonlocal completed
+        player_rng = random.Random(rng.random())
+        for _ in journeys:
+            theme = player_rng.choice(args.themes)
+            if await play_journey(http, recorder, player_rng, theme, args.steps, args.think, not args.no_audio):
+                completed += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        monitor = asyncio.create_task(monitor_loop_lag(lag_samples))
+        started = time.perf_counter()
+        await asyncio.gather(*(player(player_id) for player_id in range(args.players)))
+        seconds = time.perf_counter() - started
+        monitor.cancel()
+
+    requests = sum(len(latencies) for latencies in recorder.latencies.values())
+    return {
+        "seconds": round(seconds, 3),
+        "journeys": {"started": args.journeys, "completed": completed,
+                     "per_minute": round(completed / seconds * 60, 3) if seconds else 0.0},
+        "requests": {"ok": requests, "failed": sum(sum(errors.values()) for errors in recorder.errors.values()),
+                     "per_second": round(requests / seconds, 3) if seconds else 0.0},
+        "endpoints": recorder.report(seconds),
+        "event_loop_lag": summarise(lag_samples),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def stage_breakdown(registry) -> dict:
+    """
+    Count, total & mean seconds of every instrumented stage (scene generation, TTS, ...),
+    prefetches included, from the app's metrics.
+    """
+    stages = {}
+    values = registry.snapshot()["metrics"]["bss_stage_duration_seconds"]["values"]
+    for labels, (counts, total) in values:
+        count = sum(counts)
+        stages[dict(labels)["stage"]] = {"count": count, "total_s": round(total, 3),
+                                         "mean_s": round(total / count, 4) if count else 0.0}
+    return dict(sorted(stages.items(), key=lambda item: -item[1]["total_s"]))
+
+
+def print_report(results: dict):
+    print(f"\n--- Load test: {results['config']['players']} players, {results['journeys']['started']} journeys ---")
+    print(f"⏱️ {results['seconds']}s, {results['journeys']['completed']} journeys completed "
+          f"({results['journeys']['per_minute']}/min), {results['requests']['per_second']} requests/s, "
+          f"{results['requests']['failed']} failed")
+    print(f"{'endpoint':<12} {'count':>6} {'errors':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for endpoint, stats in results["endpoints"].items():
+        print(f"{endpoint:<12} {stats['count']:>6} {stats['errors']:>6} {stats['p50']:>8.3f} "
+              f"{stats['p95']:>8.3f} {stats['p99']:>8.3f} {stats['max']:>8.3f}")
+    lag = results["event_loop_lag"]
+    print(f"🌀 event loop lag: p50 {lag['p50'] * 1000:.1f} ms, p99 {lag['p99'] * 1000:.1f} ms, "
+          f"max {lag['max'] * 1000:.1f} ms")
+    for stage, stats in results["stages"].items():
+        print(f"  ⏳ {stage:<22} {stats['count']:>6} x {stats['mean_s']:.3f}s = {stats['total_s']:.1f}s")
+    for name, stats in results["providers"].items():
+        print(f"🤖 {name}: {stats['calls']} calls, {stats['throttled']} throttled, {stats['errors']} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-tests the game API against fake providers.")
+    parser.add_argument("--players", type=int, default=10, help="concurrent players (default: 10)")
+    parser.add_argument("--journeys", type=int, default=20, help="journeys played in total (default: 20)")
+    parser.add_argument("--steps", type=int, default=5, help="maximum choices per journey (default: 5)")
+    parser.add_argument("--think", type=float, default=1.0,
+                        help="average seconds a player reads before choosing, lets prefetch work (default: 1)")
+    parser.add_argument("--themes", nargs="+", default=THEMES)
+    parser.add_argument("--image-latency", type=Latency.parse, default=Latency(6.0, 12.0),
+                        help="image model latency 'median[,p95]' in seconds (default: 6,12)")
+    parser.add_argument("--tts-latency", type=Latency.parse, default=Latency(1.0, 2.5),
+                        help="TTS latency 'median[,p95]' in seconds (default: 1,2.5)")
+    parser.add_argument("--image-size", type=int, default=1024, help="generated image size in px (default: 1024)")
+    parser.add_argument("--audio-bytes-per-char", type=int, default=1100,
+                        help="narration audio size per character of text (default: 1100)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of provider calls answered with a 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of provider calls failing with a 500")
+    parser.add_argument("--no-audio", action="store_true", help="don't fetch the streamed narrations")
+    parser.add_argument("--mock", action="store_true",
+                        help="play the mock stories with the pooled mock images, the app's baseline without image work")
+    parser.add_argument("--no-provider-limits", action="store_true",
+                        help="lift the provider gateway's rate & concurrency limits to measure the app alone")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", type=Path, help="the app's working directory (default: a new temp dir)")
+    parser.add_argument("--output", type=Path, help="results json (default: bench_results/load-<commit>-<time>.json)")
+    parser.add_argument("--verbose", action="store_true", help="show the app's logs")
+    args = parser.parse_args()
+    output = (args.output.resolve() if args.output else None)
+
+    # the app keeps its caches, sessions & gateway state relative to the working directory
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="bss-bench-"))
+    # the app serves the built frontend from there, the load test doesn't need it
+    os.makedirs(Path(workdir, "frontend", "build"), exist_ok=True)
+    # and reads the mock stories & images relative to it
+    mock_data = Path(workdir, "data", "mock")
+    if not mock_data.exists():
+        os.makedirs(mock_data.parent, exist_ok=True)
+        mock_data.symlink_to(REPO_ROOT / "data" / "mock", target_is_directory=True)
+    os.chdir(workdir)
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("ELEVENLABS_API_KEY", "benchmark")
+    random.seed(args.seed)
+
+    print(f"🏗️ Preparing fake providers & the app in {workdir}...")
+    gemini = FakeGemini(args.image_latency, args.image_size, args.throttle_rate, args.error_rate, seed=args.seed)
+    elevenlabs = FakeElevenLabs(args.tts_latency, args.audio_bytes_per_char, args.throttle_rate,
+                                args.error_rate, seed=args.seed)
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with logs:
+        fakes = install(gemini, elevenlabs)
+        import api.main
+        api.main.mock = args.mock
+        from api.metrics import registry
+        from api.provider_gateway import provider_gateway
+        if args.no_provider_limits:
+            for limit in provider_gateway.limits.values():
+                limit.update(max_concurrency=10_000, rate_per_second=10_000.0, burst=10_000)
+
+    print(f"🎮 {args.players} players, {args.journeys} journeys...")
+    with logs:
+        results = asyncio.run(run_load(api.main.app, args))
+
+    results = {
+        "commit": _git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "players": args.players, "journeys": args.journeys, "steps": args.steps, "think_s": args.think,
+            "themes": args.themes, "image_latency": args.image_latency.to_dict(),
+            "tts_latency": args.tts_latency.to_dict(), "image_size": args.image_size,
+            "audio_bytes_per_char": args.audio_bytes_per_char, "throttle_rate": args.throttle_rate,
+            "error_rate": args.error_rate, "fetch_audio": not args.no_audio, "mock": args.mock,
+            "provider_limits": not args.no_provider_limits, "seed": args.seed,
+        },
+        **results,
+        "stages": stage_breakdown(registry),
+        "providers": {name: fake.stats() for name, fake in fakes.items()},
+        "gateway": provider_gateway.stats(),
+    }
+    print_report(results)
+
+    output = output or RESULTS_DIR / f"load-{results['commit'] or 'local'}-{int(time.time())}.json"
+    os.makedirs(output.parent, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"📝 Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
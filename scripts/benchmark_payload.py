@@ -0,0 +1,138 @@
+"""
+Compares the reference image payloads sent to the image model before and after
+compaction (see `api.image_cache.compact_image`).
+
+    python scripts/benchmark_payload.py                   # payload bytes + estimated upload time
+    python scripts/benchmark_payload.py --live 3          # + real scene latency, needs GEMINI_API_KEY
+    python scripts/benchmark_payload.py --json out.json   # also write the results as json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add the parent directory to the Python path to allow imports from the 'api' module
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+
+from api.constants import MOCK_DATA_DIR
+from api.image_cache import CachedImage
+
+load_dotenv()
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def measure_payloads(mock_dir: Path) -> list:
+    """
+    Original vs compacted size of every mock image (character sheets & scenes).
+    """
+    results = []
+    for image_path in sorted(mock_dir.glob("*/*.png")):
+        cached_image = CachedImage(image_path.read_bytes())
+        started = time.perf_counter()
+        part = cached_image.reference_part()
+        compact_ms = (time.perf_counter() - started) * 1000
+        results.append({
+            "image": f"{image_path.parent.name}/{image_path.name}",
+            "size": cached_image.size,
+            "original_bytes": len(cached_image.encoded),
+            "compacted_bytes": len(part.inline_data.data),
+            "compacted_mime_type": part.inline_data.mime_type,
+            "compact_ms": round(compact_ms, 2),
+        })
+    return results
+
+
+def measure_latency(theme: str, runs: int) -> dict:
+    """
+    End-to-end scene latency against the real model, with the original and the
+    compacted reference images. Every run is a real (billed) image generation.
+    """
+    from google import genai
+    from api.scene_generator import generate_scene
+    from api.story_index import get_story_index
+
+    client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+    story = get_story_index().pick(theme, mock=True)
+    step = story.node(story.start_id)
+    next_step_id = step.choices[0].next_id
+
+    theme_dir = Path(REPO_ROOT, MOCK_DATA_DIR, theme)
+    character_sheet = CachedImage(Path(theme_dir, "character_sheet.png").read_bytes())
+    previous_scene = CachedImage(Path(theme_dir, f"{story.start_id}.png").read_bytes())
+
+    payloads = {
+        "original": (character_sheet.part, previous_scene.part),
+        "compacted": (character_sheet.reference_part(), previous_scene.reference_part()),
+    }
+    latencies = {}
+    for label, (character_part, previous_part) in payloads.items():
+        timings = []
+        for run in range(runs):
+            print(f"  ⏱️ {label} run {run + 1}/{runs}...")
+            started = time.perf_counter()
+            generate_scene(theme, next_step_id, story, character_part, previous_part, client)
+            timings.append(time.perf_counter() - started)
+        latencies[label] = {
+            "runs": runs,
+            "mean_s": round(statistics.mean(timings), 3),
+            "median_s": round(statistics.median(timings), 3),
+            "min_s": round(min(timings), 3),
+        }
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uplink-mbps", type=float, default=20.0,
+                        help="uplink bandwidth used to estimate upload time (default: 20)")
+    parser.add_argument("--live", type=int, default=0, metavar="RUNS",
+                        help="also time RUNS real scene generations per payload")
+    parser.add_argument("--theme", default="Haunted Space Station")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    print(f"📦 Measuring reference payloads in {MOCK_DATA_DIR}...")
+    payloads = measure_payloads(Path(REPO_ROOT, MOCK_DATA_DIR))
+    for result in payloads:
+        print(f"  {result['image']:<50} {result['original_bytes'] / 1024:>8.0f} KB -> "
+              f"{result['compacted_bytes'] / 1024:>6.0f} KB ({result['compact_ms']:.0f} ms)")
+
+    original = sum(result["original_bytes"] for result in payloads)
+    compacted = sum(result["compacted_bytes"] for result in payloads)
+    bytes_per_second = args.uplink_mbps * 1e6 / 8
+    # a scene request carries two reference images: the character sheet & the previous scene
+    per_request = 2 / len(payloads) if payloads else 0
+    summary = {
+        "images": len(payloads),
+        "original_bytes": original,
+        "compacted_bytes": compacted,
+        "reduction": round(1 - compacted / original, 4) if original else 0.0,
+        "uplink_mbps": args.uplink_mbps,
+        "est_upload_s_per_request_original": round(original * per_request / bytes_per_second, 3),
+        "est_upload_s_per_request_compacted": round(compacted * per_request / bytes_per_second, 3),
+    }
+    print(f"\n📊 {original / 1024 ** 2:.1f} MB -> {compacted / 1024 ** 2:.1f} MB "
+          f"({summary['reduction']:.0%} smaller)")
+    print(f"📡 Estimated upload per scene request at {args.uplink_mbps} Mbps: "
+          f"{summary['est_upload_s_per_request_original']} s -> {summary['est_upload_s_per_request_compacted']} s")
+
+    results = {"payloads": payloads, "summary": summary}
+    if args.live:
+        print(f"\n🚀 Timing {args.live} live scene generation(s) per payload...")
+        results["latency"] = measure_latency(args.theme, args.live)
+        for label, latency in results["latency"].items():
+            print(f"  {label:<10} mean {latency['mean_s']} s, median {latency['median_s']} s")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"✅ Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
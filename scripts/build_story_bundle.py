@@ -0,0 +1,62 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add the parent directory to the Python path to allow imports from the 'api' module
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from api.constants import STORY_BUNDLE_PATH
+from api.story_bundle import StoryBundle, write_bundle
+from api.story_index import load_story_index, stale_bundle_stories, story_sources
+
+
+def build_story_bundle(bundle_path: Path = STORY_BUNDLE_PATH) -> dict:
+    """
+    Compiles every story (and its verified metadata) from the json files into the story bundle.
+    """
+    started = time.perf_counter()
+    # always read the json files, never a previous bundle
+    index = load_story_index(bundle_path=None)
+    summary = write_bundle(bundle_path, (index.get(key) for key in index.keys()), story_sources())
+
+    # read everything back, so that a broken bundle never ships
+    bundle = StoryBundle(bundle_path)
+    for key in index.keys():
+        record = bundle.story(key)
+        for step_id, offset in record["nodes"]:
+            if bundle.node(offset) != index.get(key).node(bundle.string(step_id)):
+                raise RuntimeError(f"Step {bundle.string(step_id)} of {key} doesn't round-trip")
+
+    print(f"📦 {summary['stories']} stories, {summary['nodes']} steps & {summary['strings']} unique strings "
+          f"in {summary['bytes'] / 1024:.1f} KB, built in {time.perf_counter() - started:.2f}s")
+    print(f"📝 Bundle written to {bundle_path}")
+    return summary
+
+
+def check_story_bundle(bundle_path: Path = STORY_BUNDLE_PATH) -> bool:
+    """
+    Checks that the bundle was built from the current story files, e.g. in a deploy
+    step, so that the workers don't serve an edited story from the json files.
+    """
+    try:
+        stale = stale_bundle_stories(bundle_path)
+    except (OSError, ValueError) as e:
+        print(f"❌ Can't read the story bundle: {e}")
+        return False
+    if stale:
+        print(f"❌ {len(stale)} stories changed since the bundle was built: {', '.join(stale)}")
+        return False
+    print(f"✅ The story bundle {bundle_path} is up to date")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compiles all the stories into one memory-mapped bundle.")
+    parser.add_argument("--output", type=Path, default=STORY_BUNDLE_PATH, help=f"(default: {STORY_BUNDLE_PATH})")
+    parser.add_argument("--check", action="store_true",
+                        help="only check that the bundle is up to date, exits with 1 if it isn't")
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(0 if check_story_bundle(args.output) else 1)
+    build_story_bundle(args.output)
@@ -0,0 +1,241 @@
+import asyncio
+import io
+import math
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import AsyncIterator, Dict, Iterator, List
+
+from PIL import Image
+
+
+class Latency:
+    """
+    A lognormal latency (the usual shape of provider latencies), fitted to a median & p95 in seconds.
+    """
+
+    def __init__(self, median: float, p95: float):
+        self.median = median
+        self.p95 = max(p95, median)
+        self._mu = math.log(median) if median > 0 else 0.0
+        self._sigma = math.log(self.p95 / median) / 1.645 if median > 0 else 0.0
+
+    @classmethod
+    def parse(cls, value: str) -> "Latency":
+        """
+        "6" or "6,12" (median, p95 in seconds).
+        """
+        median, _, p95 = value.partition(",")
+        return cls(float(median), float(p95 or median))
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        return rng.lognormvariate(self._mu, self._sigma)
+
+    def to_dict(self) -> dict:
+        return {"median_s": self.median, "p95_s": self.p95}
+
+
+class FakeProviderError(Exception):
+    """
+    A provider error, with the status code where both provider SDKs put it.
+    """
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code} {message}")
+        self.code = status_code
+        self.status_code = status_code
+
+
+class FakeProvider:
+    """
+    Shared behaviour of the fakes: a latency, a rate of 429s & of 500s, and call counters.
+    Thread safe, the app calls the providers from its provider pool.
+    """
+
+    def __init__(self, name: str, latency: Latency, throttle_rate: float = 0.0, error_rate: float = 0.0,
+                 seed: int = None):
+        self.name = name
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"calls": 0, "throttled": 0, "errors": 0, "bytes": 0}
+
+    def _roll(self) -> tuple:
+        with self._lock:
+            self.counts["calls"] += 1
+            return self.latency.sample(self._rng), self._rng.random()
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counts[name] += value
+
+    def _error(self, latency: float, roll: float) -> tuple:
+        # the sampled error, if any, and how long the provider takes to answer with it
+        if roll < self.throttle_rate:
+            # providers answer 429s quickly
+            self._count("throttled")
+            return FakeProviderError(429, f"{self.name}: Resource has been exhausted"), min(latency, 0.05)
+        if roll < self.throttle_rate + self.error_rate:
+            self._count("errors")
+            return FakeProviderError(500, f"{self.name}: Internal error"), latency
+        return None, 0.0
+
+    def _fail(self, latency: float, roll: float):
+        # raises the sampled error, if any
+        error, delay = self._error(latency, roll)
+        if error is not None:
+            time.sleep(delay)
+            raise error
+
+    async def _fail_async(self, latency: float, roll: float):
+        error, delay = self._error(latency, roll)
+        if error is not None:
+            await asyncio.sleep(delay)
+            raise error
+
+    def _call(self):
+        """
+        Waits for the sampled latency, or raises the sampled error.
+        """
+        latency, roll = self._roll()
+        self._fail(latency, roll)
+        time.sleep(latency)
+
+    async def _call_async(self):
+        latency, roll = self._roll()
+        await self._fail_async(latency, roll)
+        await asyncio.sleep(latency)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+def _noise_png(size: int, seed: int) -> bytes:
+    # noise barely compresses, so the payload is as large as a detailed generated scene
+    image = Image.frombytes("RGB", (size, size), random.Random(seed).randbytes(size * size * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeGemini(FakeProvider):
+    """
+    Stands in for `genai.Client`: `models.generate_content` (and `aio.models.generate_content`)
+    answers with one of a few pre-encoded PNGs of `image_size` x `image_size`, shaped like
+    a google-genai response.
+    """
+
+    def __init__(self, latency: Latency, image_size: int = 1024, throttle_rate: float = 0.0,
+                 error_rate: float = 0.0, seed: int = None, variety: int = 4):
+        super().__init__("gemini", latency, throttle_rate, error_rate, seed)
+        self.images: List[bytes] = [_noise_png(image_size, (seed or 0) + i) for i in range(variety)]
+        self.models = SimpleNamespace(generate_content=self.generate_content)
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=self.generate_content_async))
+
+    def generate_content(self, model: str, contents, config=None):
+        self._call()
+        return self._response()
+
+    async def generate_content_async(self, model: str, contents, config=None):
+        await self._call_async()
+        return self._response()
+
+    def _response(self):
+        with self._lock:
+            data = self._rng.choice(self.images)
+        self._count("bytes", len(data))
+        part = SimpleNamespace(inline_data=SimpleNamespace(data=data, mime_type="image/png"), text=None)
+        candidate = SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason="STOP")
+        return SimpleNamespace(candidates=[candidate], text=None)
+
+
+class FakeElevenLabs(FakeProvider):
+    """
+    Stands in for the `ElevenLabs` client (and for `AsyncElevenLabs` as `async_client`):
+    `text_to_speech.convert` & `.stream` return `bytes_per_char` bytes of "audio" per
+    character of text, 128 kbps mp3 is ~1.1 KB per character of speech. The latency is
+    the time to the whole audio, a stream yields its first chunk after `first_chunk_ratio` of it.
+    """
+
+    def __init__(self, latency: Latency, bytes_per_char: int = 1100, throttle_rate: float = 0.0,
+                 error_rate: float = 0.0, seed: int = None, chunk_bytes: int = 16 * 1024,
+                 first_chunk_ratio: float = 0.3):
+        super().__init__("elevenlabs", latency, throttle_rate, error_rate, seed)
+        self.bytes_per_char = bytes_per_char
+        self.chunk_bytes = chunk_bytes
+        self.first_chunk_ratio = first_chunk_ratio
+        self.text_to_speech = SimpleNamespace(convert=self.convert, stream=self.stream)
+        self.async_client = SimpleNamespace(
+            text_to_speech=SimpleNamespace(convert=self.convert_async, stream=self.stream_async))
+
+    def _audio(self, text: str) -> bytes:
+        audio = b"ID3" + os.urandom(max(0, len(text) * self.bytes_per_char - 3))
+        self._count("bytes", len(audio))
+        return audio
+
+    def convert(self, text: str, voice_id: str = None, **kwargs) -> Iterator[bytes]:
+        self._call()
+        return iter(self._chunks(text))
+
+    def _chunks(self, text: str) -> List[bytes]:
+        audio = self._audio(text)
+        return [audio[i:i + self.chunk_bytes] for i in range(0, len(audio), self.chunk_bytes)]
+
+    def stream(self, text: str, voice_id: str = None, **kwargs) -> Iterator[bytes]:
+        latency, roll = self._roll()
+        # errors come before the first byte, like the real API
+        self._fail(latency, roll)
+        chunks = self._chunks(text)
+
+        def generate():
+            time.sleep(latency * self.first_chunk_ratio)
+            pause = latency * (1 - self.first_chunk_ratio) / max(1, len(chunks) - 1)
+            for index, chunk in enumerate(chunks):
+                if index:
+                    time.sleep(pause)
+                yield chunk
+        return generate()
+
+    async def convert_async(self, text: str, voice_id: str = None, **kwargs) -> AsyncIterator[bytes]:
+        await self._call_async()
+        for chunk in self._chunks(text):
+            yield chunk
+
+    async def stream_async(self, text: str, voice_id: str = None, **kwargs) -> AsyncIterator[bytes]:
+        latency, roll = self._roll()
+        await self._fail_async(latency, roll)
+        chunks = self._chunks(text)
+        await asyncio.sleep(latency * self.first_chunk_ratio)
+        pause = latency * (1 - self.first_chunk_ratio) / max(1, len(chunks) - 1)
+        for index, chunk in enumerate(chunks):
+            if index:
+                await asyncio.sleep(pause)
+            yield chunk
+
+
+def install(gemini: FakeGemini = None, elevenlabs: FakeElevenLabs = None) -> Dict[str, FakeProvider]:
+    """
+    Swaps the app's provider clients (the async ones the API uses & the blocking ones
+    the scripts use) for the fakes. Import the app after the working directory &
+    environment are set up, it creates its caches on import.
+    """
+    import api.narration_generator
+    from api.providers import provider_clients
+
+    fakes = {}
+    if gemini is not None:
+        # set before the app starts, so its lifespan doesn't create the real ones
+        provider_clients.gemini = gemini
+        fakes["gemini"] = gemini
+    if elevenlabs is not None:
+        provider_clients.elevenlabs = elevenlabs.async_client
+        api.narration_generator.client = elevenlabs
+        fakes["elevenlabs"] = elevenlabs
+    return fakes
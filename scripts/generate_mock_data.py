@@ -1,18 +1,26 @@
-from dotenv import load_dotenv
-from google import genai
-from api.scene_generator import generate_scene
-from api.character_generator import generate_character_asset
-from api.story_generator import generate_story
+import argparse
 import json
 import os
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from PIL import Image
-from io import BytesIO
 
 # Add the parent directory to the Python path to allow imports from the 'api' module
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
+from dotenv import load_dotenv
+from google import genai
+from PIL import Image
+
+from api.character_generator import generate_character_asset
+from api.image_cache import CachedImage
+from api.scene_generator import generate_scene
+from api.story_generator import generate_story
+from api.story_index import get_story_index
+
 
 # --- Configuration ---
 load_dotenv()
@@ -21,15 +29,6 @@ if not API_KEY:
     raise ValueError(
         "GEMINI_API_KEY not found in .env file or environment variables.")
 
-# genai.configure(api_key=API_KEY)
-
-# We need both a text and an image model client for this script
-# text_model_client = genai.GenerativeModel('gemini-1.5-flash-latest')
-# image_model_client = genai.GenerativeModel('gemini-2.5-flash-image-preview')
-# read api key
-API_KEY = os.environ.get("GEMINI_API_KEY")
-
-
 # configure the client with your API key
 client = genai.Client(api_key=API_KEY)
 
@@ -37,126 +36,222 @@ client = genai.Client(api_key=API_KEY)
 THEMES = ["Haunted Space Station", "Lost Temple of the Jungle",
           "Cyberpunk Underworld", "Curse of the Banana King"]
 
-# THEMES = ["Haunted Space Station"]
-
 GENDER = "male"
 MOCK_DATA_ROOT = Path(__file__).resolve().parent.parent / "data" / "mock"
 IMAGE_DIR = Path(__file__).resolve().parent.parent / "images"
+MANIFEST_PATH = MOCK_DATA_ROOT / "manifest.json"
 
 
-def generate_scenes_recursively(theme, step_id, story_data, character_asset, previous_scene_image, theme_dir, visited_steps):
+class RateLimiter:
     """
-    Recursively traverses the story tree to generate a scene for each step.
-    This is a classic Depth-First Search (DFS) algorithm.
+    Spaces out calls to at most `rate_per_second`, shared by all the worker threads.
+    (The provider gateway still enforces the node-wide limits on top of this.)
     """
-    # Base Case: If we have already generated this scene, stop.
-    if step_id in visited_steps:
-        return
-
-    print(f"  -> Generating scene for step: {step_id}")
-    visited_steps.add(step_id)
-
-    try:
-        # Generate the current scene's image
-        current_scene_image = generate_scene(
-            theme=theme,
-            step_id=step_id,
-            story_data=story_data,
-            character_asset=character_asset,
-            previous_scene_image=previous_scene_image,
-            client=client
-        )
 
-        # Extract the image from the response
-        # image_bytes = scene_response.parts[0].data
-        # current_scene_image = Image.open(BytesIO(image_bytes))
+    def __init__(self, rate_per_second: float):
+        self.interval = 1 / rate_per_second if rate_per_second > 0 else 0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
 
-        # Save the image
-        current_scene_image.save(theme_dir / f"{step_id}.png")
 
-        # Find the current step data in the story tree
-        current_step = next(
-            (s for s in story_data["story_tree"] if s["id"] == step_id), None)
-        if not current_step:
-            return  # Should not happen if story is well-formed
+class Manifest:
+    """
+    Checkpoint of the finished outputs, rewritten (atomically) after every one of them
+    so that a rerun skips what's done and resumes after a crash:
+        {"<theme>": {"story_key": "...", "character_sheet": true, "scenes": {"<step_id>": {...}},
+                     "failed": {"<step_id>": "<error>"}}}
+    """
 
-        # Recursive Step: For each choice, call this function again
-        for choice in current_step.get("choices", []):
-            generate_scenes_recursively(
-                theme=theme,
-                step_id=choice["next_id"],
-                story_data=story_data,
-                character_asset=character_asset,
-                previous_scene_image=current_scene_image,  # Pass the current image down
-                theme_dir=theme_dir,
-                visited_steps=visited_steps
-            )
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = json.loads(path.read_text()) if path.exists() else {}
 
-    except Exception as e:
-        print(f"  🚨 FAILED to generate scene for step: {step_id}. Error: {e}")
+    def theme(self, theme: str) -> dict:
+        with self._lock:
+            return self.data.setdefault(theme, {"story_key": None, "character_sheet": False,
+                                                "scenes": {}, "failed": {}})
+
+    def update(self, theme: str, mutate):
+        with self._lock:
+            mutate(self.data.setdefault(theme, {}))
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".manifest-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def scene_levels(story) -> list:
+    """
+    Breadth-first levels of the story tree: [[(step_id, parent_id), ...], ...].
+    Every step is rendered once, after the parent it was first reached from.
+    """
+    levels = []
+    seen = {story.start_id}
+    level = [(story.start_id, None)]
+    while level:
+        levels.append(level)
+        next_level = []
+        for step_id, _ in level:
+            for next_id in story.children.get(step_id, ()):
+                if next_id not in seen:
+                    seen.add(next_id)
+                    next_level.append((next_id, step_id))
+        level = next_level
+    return levels
+
+
+def render_scene(theme, step_id, story, character_sheet, parent_scene, theme_dir, limiter):
+    """
+    Generates & saves one scene. Runs on the worker pool.
+    """
+    limiter.wait()
+    started = time.perf_counter()
+    scene_image = generate_scene(
+        theme=theme,
+        step_id=step_id,
+        story=story,
+        character_asset=character_sheet.reference_part(),
+        previous_scene_image=parent_scene.reference_part() if parent_scene else None,
+        client=client
+    )
+    if scene_image is None:
+        raise RuntimeError("the model returned no image")
+    # kept as the model encoded it, unless it isn't a PNG
+    scene = scene_image.as_png()
+    Path(theme_dir, f"{step_id}.png").write_bytes(scene.encoded)
+    return scene, time.perf_counter() - started
+
+
+def _load_scene(path: Path) -> CachedImage:
+    return CachedImage(path.read_bytes())
+
+
+def build_theme(theme, manifest, pool, limiter, force=False) -> dict:
+    """
+    Builds a theme's story, character sheet and every scene, level by level.
+    The scenes of a level only depend on the previous level, so they are all
+    rendered concurrently. Returns the number of rendered, skipped & failed scenes.
+    """
+    print(f"\n🌀 Processing Theme: {theme}")
+    theme_dir = MOCK_DATA_ROOT / theme
+    os.makedirs(theme_dir, exist_ok=True)
+    state = manifest.theme(theme)
+    counts = {"rendered": 0, "skipped": 0, "failed": 0}
+
+    # 1. The story, kept across reruns so the finished scenes still match it
+    story = get_story_index().get(state["story_key"]) if state["story_key"] and not force else None
+    if story is None:
+        story = generate_story(theme=theme, step_count=3, client=client)
+        with open(theme_dir / "story.json", "w") as f:
+            json.dump(story.story.model_dump(exclude_none=True), f, indent=4)
+
+        def reset(theme_state):
+            theme_state.update({"story_key": story.key, "character_sheet": False, "scenes": {}, "failed": {}})
+        manifest.update(theme, reset)
+        print(f"  ✅ Story {story.key} saved.")
+
+    # 2. The character sheet
+    character_sheet_path = theme_dir / "character_sheet.png"
+    if manifest.theme(theme)["character_sheet"] and character_sheet_path.exists():
+        character_sheet = _load_scene(character_sheet_path)
+    else:
+        limiter.wait()
+        character_sheet_image = generate_character_asset(
+            theme=theme, gender=GENDER, selfie_image=Image.open(Path(IMAGE_DIR, "me.jpg")), client=client
+        )
+        character_sheet = character_sheet_image.as_png()
+        character_sheet_path.write_bytes(character_sheet.encoded)
+        manifest.update(theme, lambda theme_state: theme_state.update({"character_sheet": True}))
+        print("  ✅ Character sheet saved.")
+
+    # 3. The scenes, one level of the story tree at a time
+    scenes = {}
+    for depth, level in enumerate(scene_levels(story)):
+        futures = {}
+        for step_id, parent_id in level:
+            if parent_id is not None and parent_id not in scenes:
+                print(f"  ⏭️ Skipping {step_id}, its parent scene failed")
+                counts["failed"] += 1
+                continue
+
+            scene_path = theme_dir / f"{step_id}.png"
+            if step_id in manifest.theme(theme)["scenes"] and scene_path.exists():
+                scenes[step_id] = _load_scene(scene_path)
+                counts["skipped"] += 1
+                continue
+
+            futures[pool.submit(render_scene, theme, step_id, story, character_sheet,
+                                scenes.get(parent_id), theme_dir, limiter)] = (step_id, parent_id)
+
+        print(f"  -> Level {depth}: {len(futures)} to render, {len(level) - len(futures)} done or skipped")
+        for future in as_completed(futures):
+            step_id, parent_id = futures[future]
+            try:
+                scenes[step_id], seconds = future.result()
+            except Exception as e:
+                print(f"  🚨 FAILED to generate scene for step: {step_id}. Error: {e}")
+                manifest.update(theme, lambda theme_state: theme_state["failed"].update({step_id: str(e)}))
+                counts["failed"] += 1
+                continue
+
+            def done(theme_state):
+                theme_state["scenes"][step_id] = {"parent": parent_id, "seconds": round(seconds, 2)}
+                theme_state["failed"].pop(step_id, None)
+            manifest.update(theme, done)
+            counts["rendered"] += 1
+            print(f"  ✅ {step_id} ({seconds:.1f}s)")
+
+        # the parents of the previous level aren't needed anymore
+        scenes = {step_id: scenes[step_id] for step_id, _ in level if step_id in scenes}
+
+    print(f"  🏁 {theme}: {counts['rendered']} rendered, {counts['skipped']} already done, {counts['failed']} failed.")
+    return counts
 
 
 def main():
     """Main function to generate all mock data."""
+    parser = argparse.ArgumentParser(description="Generates the mock stories, character sheets & scenes.")
+    parser.add_argument("--themes", nargs="+", default=THEMES)
+    parser.add_argument("--workers", type=int, default=8, help="scenes rendered at once (default: 8)")
+    parser.add_argument("--rate", type=float, default=1.0, help="maximum image requests per second (default: 1)")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and rebuild everything")
+    args = parser.parse_args()
+
     print("--- Starting Mock Data Generation ---")
     os.makedirs(MOCK_DATA_ROOT, exist_ok=True)
-
-    # Create a placeholder selfie image since we don't have a user input.
-    # This is a 1x1 black pixel, which is enough to satisfy the function signature.
-
-    placeholder_selfie = Image.open(Path(IMAGE_DIR, "me.jpg"))
-
-    for theme in THEMES:
-        print(f"\nProcessing Theme: {theme}")
-        theme_dir = MOCK_DATA_ROOT / theme
-        os.makedirs(theme_dir, exist_ok=True)
-
-        try:
-            # 1. Generate and save the story JSON
-            print("  -> Generating story JSON...")
-            story_data = generate_story(
-                theme=theme, step_count=3, client=client)
-            story_data["theme"] = theme
-            with open(theme_dir / "story.json", "w") as f:
-                json.dump(story_data, f, indent=4)
-            print("  ✅ Story JSON saved.")
-
-            # 2. Generate and save the character sheet
-            print("  -> Generating character sheet...")
-            character_asset_image = generate_character_asset(
-                theme=theme, gender=GENDER, selfie_image=placeholder_selfie, client=client
-            )
-            character_asset_image.save(theme_dir / "character_sheet.png")
-            print("  ✅ Character sheet saved.")
-
-            # 3. Generate the initial prologue scene (our visual anchor)
-            # print("  -> Generating prologue scene...")
-            # prologue_response = generate_scene(
-            #     story_data=story_data,
-            #     character_asset=character_asset_image,
-            #     client=client
-            # )
-            # prologue_image = Image.open(BytesIO(prologue_response.parts[0].data))
-            # prologue_image.save(theme_dir / "prologue.png")
-            # print("  ✅ Prologue scene saved.")
-
-            # 4. Kick off the recursive generation for all story steps
-            visited_steps = set()
-            generate_scenes_recursively(
-                theme=theme,
-                step_id="start",
-                story_data=story_data,
-                character_asset=character_asset_image,
-                previous_scene_image=None,  # Start with the prologue image
-                theme_dir=theme_dir,
-                visited_steps=visited_steps
-            )
-            print(f"  ✅ All scenes generated for {theme}.")
-
-        except Exception as e:
-            print(f"🚨 FAILED to process theme: {theme}. Error: {e}")
-
+    manifest = Manifest(MANIFEST_PATH)
+    limiter = RateLimiter(args.rate)
+    started = time.perf_counter()
+    totals = {"rendered": 0, "skipped": 0, "failed": 0}
+
+    # the themes are independent, build them side by side on the shared scene pool
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="scene") as pool, \
+            ThreadPoolExecutor(max_workers=len(args.themes), thread_name_prefix="theme") as themes_pool:
+        theme_futures = {themes_pool.submit(build_theme, theme, manifest, pool, limiter, args.force): theme
+                         for theme in args.themes}
+        for future in as_completed(theme_futures):
+            try:
+                for name, count in future.result().items():
+                    totals[name] += count
+            except Exception as e:
+                print(f"🚨 FAILED to process theme: {theme_futures[future]}. Error: {e}")
+
+    minutes = (time.perf_counter() - started) / 60
     print("\n--- Mock Data Generation Complete ---")
+    print(f"📊 {totals['rendered']} scenes rendered in {minutes:.1f} min "
+          f"({totals['rendered'] / minutes if minutes else 0:.1f} nodes/min), "
+          f"{totals['skipped']} already done, {totals['failed']} failed.")
+    if totals["failed"]:
+        print("🔁 Rerun the script to retry the failed scenes.")
 
 
 if __name__ == "__main__":
@@ -1,68 +1,169 @@
+import argparse
 import json
 import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from time import sleep
-from elevenlabs import ElevenLabs
-from elevenlabs import Voice, VoiceSettings, play, save
-import emoji
 
+# Add the parent directory to the Python path to allow imports from the 'api' module
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import emoji
 from dotenv import load_dotenv
+
+from api.constants import ELEVENLABS_PLAN, ELEVENLABS_PLAN_CONCURRENCY, NARRATION_PRERENDER_DIR, NARRATION_PRERENDER_MANIFEST
+from api.narration_generator import (TTS_MODEL_ID, TTS_OUTPUT_FORMAT, VOICE_ID, narration_cache,
+                                     narration_cache_key, prerendered_path, synthesise)
+from api.story_index import get_story_index
+
 load_dotenv()
-# Initialize the ElevenLabs client
-# It will automatically pick up the ELEVENLABS_API_KEY from your environment
-ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
-client = ElevenLabs(
-    api_key=ELEVENLABS_API_KEY
-)
 
-# A good, deep voice for a Dungeon Master.
-VOICE_ID = "HAvvFKatz0uu0Fv55Riy"
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average and bursts of up to `burst`,
+    shared by all the worker threads.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
 
 
-def generate_narration(data_root: str):
+def collect_narration(index) -> tuple:
+    """
+    The prologue & every node narration of every story, deduplicated by content hash.
+    Returns ({cache key: text}, {story key: {"prologue": cache key, "steps": {step id: cache key}}}).
+    """
+    texts = {}
+    stories = {}
+    for story_key in index.keys():
+        story = index.get(story_key).story
+        story_keys = {"prologue": None, "steps": {}}
+        if story.prologue:
+            key = narration_cache_key(story.prologue)
+            texts[key] = story.prologue
+            story_keys["prologue"] = key
+        for node in story.story_tree:
+            key = narration_cache_key(node.narration)
+            texts[key] = node.narration
+            story_keys["steps"][node.id] = key
+        stories[story_key] = story_keys
+    return texts, stories
+
+
+def render(key: str, text: str, bucket: TokenBucket) -> str:
+    """
+    Writes the narration of `text` to the pre-render directory. Audio we already
+    synthesised at request time (narration cache) is copied instead of re-synthesised.
+    Returns how the file was produced.
+    """
+    path = prerendered_path(key)
+    os.makedirs(path.parent, exist_ok=True)
+    cached_path = narration_cache.get(key)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if cached_path:
+                with open(cached_path, "rb") as cached:
+                    shutil.copyfileobj(cached, f)
+                source = "copied"
+            else:
+                bucket.take()
+                f.write(synthesise(text))
+                source = "synthesised"
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return source
+
+
+def write_manifest(files: dict, stories: dict):
+    os.makedirs(NARRATION_PRERENDER_DIR, exist_ok=True)
+    manifest = {
+        "voice_id": VOICE_ID,
+        "model_id": TTS_MODEL_ID,
+        "output_format": TTS_OUTPUT_FORMAT,
+        "files": files,
+        "stories": stories,
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=NARRATION_PRERENDER_DIR, prefix=".manifest-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, NARRATION_PRERENDER_MANIFEST)
+
+
+def generate_narration(plan: str, rate: float, burst: int, workers: int = None):
     print(emoji.emojize(":moai: generating narration"))
-    print(emoji.emojize(f":file_folder: Reading stories from {data_root}..."))
-    for theme in os.listdir(data_root):
-        theme_dir = Path(data_root, theme)
-        if not theme_dir.is_dir(): continue        
-        print(emoji.emojize(f"\n:cyclone: Processing Theme: {theme}"))
-        
-        for story_file in os.listdir(theme_dir):
-            if not story_file.endswith('.json'): continue
-
-            story_path = Path(theme_dir, story_file)
-            print(emoji.emojize(f"  :eyes: Reading {story_file}..."), end=" ")
-            
-            with open(story_path, 'r') as file:
-                story_obj = json.load(file)
-
-            ## step 1 - generate audio for prologue
-            ## define prologue audio path
-            prologue_audio_path = Path(theme_dir, "prologue.mp3")
-            
-            ## only generate audio if prologue mp3 doesn't exist
-            if not os.path.exists(prologue_audio_path):
-                print(emoji.emojize(f"    :microphone: generating prologue..."))
-                prologue_text = story_obj["prologue"]
-                # audio_bytes = client.text_to_speech.convert(text=prologue_text,voice_id=VOICE_ID)
-                # save(audio_bytes, prologue_audio_path)
-                
-            ## sleep a 5 seconds to avoid rate limiting
-            sleep(5)
-            
-            for step in story_obj["story_tree"]:
-                # narration_audio_path = Path(th)
-                pass
-            
-
-            
-    print(emoji.emojize(" -> :check_mark_button: OK!"))            
-
-
-    pass
+    texts, stories = collect_narration(get_story_index())
+
+    # the content hash covers the text, voice, model & format, so existing audio is still valid
+    files = {}
+    todo = {}
+    for key, text in texts.items():
+        path = prerendered_path(key)
+        if path.exists():
+            files[key] = path.relative_to(NARRATION_PRERENDER_DIR).as_posix()
+        else:
+            todo[key] = text
+    print(emoji.emojize(f":file_folder: {len(texts)} narrations in {len(stories)} stories, "
+                        f"{len(files)} already rendered, {len(todo)} to go"))
+
+    workers = workers or ELEVENLABS_PLAN_CONCURRENCY[plan]
+    bucket = TokenBucket(rate, burst)
+    counts = {"synthesised": 0, "copied": 0, "failed": 0}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts") as pool:
+        futures = {pool.submit(render, key, text, bucket): key for key, text in todo.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            key = futures[future]
+            try:
+                counts[future.result()] += 1
+                files[key] = prerendered_path(key).relative_to(NARRATION_PRERENDER_DIR).as_posix()
+            except Exception as e:
+                print(emoji.emojize(f"  :cross_mark: FAILED {key[:12]}: {e}"))
+                counts["failed"] += 1
+            if done % 25 == 0:
+                # checkpoint, so an interrupted run keeps what it rendered
+                write_manifest(files, stories)
+                print(f"  {done}/{len(todo)}")
 
+    write_manifest(files, stories)
+    minutes = (time.perf_counter() - started) / 60
+    print(emoji.emojize(f" -> :check_mark_button: {counts['synthesised']} synthesised, {counts['copied']} copied "
+                        f"from the narration cache, {counts['failed']} failed in {minutes:.1f} min "
+                        f"({workers} workers, {rate}/s)"))
+    print(f"📝 Manifest written to {NARRATION_PRERENDER_MANIFEST}")
 
 
 if __name__ == "__main__":
-    data_root = Path(__file__).resolve().parent.parent / "api"/"data"
-    generate_narration(data_root)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Pre-renders the narration of every story.")
+    parser.add_argument("--plan", choices=sorted(ELEVENLABS_PLAN_CONCURRENCY), default=ELEVENLABS_PLAN,
+                        help=f"ElevenLabs plan, sets the number of parallel requests (default: {ELEVENLABS_PLAN})")
+    parser.add_argument("--workers", type=int, help="override the plan's parallel requests")
+    # the provider gateway still caps the node-wide rate at PROVIDER_LIMITS["elevenlabs"]
+    parser.add_argument("--rate", type=float, default=2.0, help="requests per second (default: 2)")
+    parser.add_argument("--burst", type=int, default=5, help="requests allowed in a burst (default: 5)")
+    args = parser.parse_args()
+    generate_narration(args.plan, args.rate, args.burst, args.workers)
@@ -1,18 +1,24 @@
-from dotenv import load_dotenv
-from google import genai
-from api.scene_generator import generate_scene
-from api.character_generator import generate_character_asset
-from api.story_generator import generate_story
+import argparse
+import asyncio
 import json
 import os
+import random
 import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from PIL import Image
-from io import BytesIO
 
 # Add the parent directory to the Python path to allow imports from the 'api' module
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
+from dotenv import load_dotenv
+from google import genai
+
+from api.cache import content_key
+from api.story_generator import generate_story_from_model
+from api.story_index import get_story_index
+
 
 # --- Configuration ---
 load_dotenv()
@@ -21,15 +27,6 @@ if not API_KEY:
     raise ValueError(
         "GEMINI_API_KEY not found in .env file or environment variables.")
 
-# genai.configure(api_key=API_KEY)
-
-# We need both a text and an image model client for this script
-# text_model_client = genai.GenerativeModel('gemini-1.5-flash-latest')
-# image_model_client = genai.GenerativeModel('gemini-2.5-flash-image-preview')
-# read api key
-API_KEY = os.environ.get("GEMINI_API_KEY")
-
-
 # configure the client with your API key
 client = genai.Client(api_key=API_KEY)
 
@@ -37,40 +34,148 @@ client = genai.Client(api_key=API_KEY)
 THEMES = ["Haunted Space Station", "Lost Temple of the Jungle",
           "Cyberpunk Underworld", "Curse of the Banana King"]
 
-# THEMES = ["Haunted Space Station"]
-
-MOCK_DATA_ROOT = Path(__file__).resolve().parent.parent / "api"/"data"
+STORY_DATA_ROOT = Path(__file__).resolve().parent.parent / "api" / "data"
+
+
+class ThemeBatch:
+    """
+    Generates stories for one theme until it has `target` valid ones. Every
+    response is validated in-process, invalid & duplicate stories are dropped
+    and replaced by new requests, up to `attempts_per_story` requests per story
+    the theme is missing.
+    """
+
+    def __init__(self, theme: str, target: int, attempts_per_story: int):
+        self.theme = theme
+        self.theme_dir = STORY_DATA_ROOT / theme
+        index = get_story_index()
+        existing = [index.get(key) for key in index.keys_for_theme(theme)]
+        self.digests = {entry.digest for entry in existing}
+        self.valid = len(existing)
+        self.target = target
+        # the stories the theme already has don't need any request
+        self.attempts_left = max(0, target - self.valid) * attempts_per_story
+        self.saved = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.errors = 0
+        numbers = [int(path.name.split("_")[-1]) for path in self.theme_dir.glob("story_*")
+                   if path.name.split("_")[-1].isdigit()]
+        self._next_number = max(numbers, default=0) + 1
+
+    def save(self, story) -> bool:
+        """
+        Saves a new story as the theme's next story_N/story.json, False if we already have it.
+        """
+        story_json = json.dumps(story.model_dump(exclude_none=True), indent=4)
+        digest = content_key(json.dumps(story.model_dump(mode="json"), sort_keys=True))
+        if digest in self.digests:
+            self.duplicates += 1
+            return False
+        self.digests.add(digest)
+
+        story_dir = self.theme_dir / f"story_{self._next_number}"
+        self._next_number += 1
+        os.makedirs(story_dir, exist_ok=True)
+        # write to a temp file first so a crash never leaves a half-written story behind
+        fd, tmp_path = tempfile.mkstemp(dir=story_dir, prefix=".story-")
+        with os.fdopen(fd, "w") as f:
+            f.write(story_json)
+        os.replace(tmp_path, story_dir / "story.json")
+        self.saved += 1
+        self.valid += 1
+        return True
+
+
+async def request_story(theme, step_count, semaphore, executor, retries):
+    """
+    One story request, retried with exponential backoff on provider errors.
+    Returns the validated story, or None if the model's story was invalid.
+    (429s are already retried by the provider gateway.)
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(retries + 1):
+        async with semaphore:
+            try:
+                return await loop.run_in_executor(
+                    executor, generate_story_from_model, theme, step_count, client)
+            except ValueError as e:
+                print(f"  ❌ Invalid story for {theme}: {e}")
+                return None
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                print(f"  🔁 Request failed for {theme} (attempt {attempt + 1}): {e}")
+        await asyncio.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+async def fill_theme(batch, step_count, semaphore, executor, retries):
+    """
+    Keeps as many requests in flight as there are stories missing, until the
+    theme reaches its target or runs out of attempts.
+    """
+    print(f"\n🌀 {batch.theme}: {batch.valid} valid stories, target {batch.target}")
+    in_flight = set()
+    while True:
+        while batch.valid + len(in_flight) < batch.target and batch.attempts_left > 0:
+            batch.attempts_left -= 1
+            in_flight.add(asyncio.create_task(
+                request_story(batch.theme, step_count, semaphore, executor, retries)))
+        if not in_flight:
+            break
+
+        done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            try:
+                story = task.result()
+            except Exception as e:
+                print(f"  🚨 FAILED to generate a story for {batch.theme}. Error: {e}")
+                batch.errors += 1
+                continue
+            if story is None:
+                batch.invalid += 1
+            elif batch.save(story):
+                print(f"  ✅ {batch.theme}: {batch.valid}/{batch.target}")
+
+    if batch.valid < batch.target:
+        print(f"  ⚠️ {batch.theme} stopped at {batch.valid}/{batch.target}, out of attempts.")
+
+
+async def generate_stories(themes, target, step_count, concurrency, retries, attempts_per_story):
+    semaphore = asyncio.Semaphore(concurrency)
+    batches = [ThemeBatch(theme, target, attempts_per_story) for theme in themes]
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="story") as executor:
+        await asyncio.gather(*(fill_theme(batch, step_count, semaphore, executor, retries)
+                               for batch in batches))
+    return batches
 
 
 def main():
-    """Main function to generate all mock data."""
-    print("--- Starting Mock Data Generation ---")
-    os.makedirs(MOCK_DATA_ROOT, exist_ok=True)
-
-    # Create a placeholder selfie image since we don't have a user input.
-    # This is a 1x1 black pixel, which is enough to satisfy the function signature.
-
-    number_of_stories = 5
-    for theme in THEMES:
-        print(f"\nProcessing Theme: {theme}")
-        theme_dir = MOCK_DATA_ROOT / theme
-        os.makedirs(theme_dir, exist_ok=True)
-
-        try:
-            # 1. Generate and save the story JSON
-            for i in range(number_of_stories):
-                print(f"  -> Generating story number {i+1}...")
-                story_data = generate_story(
-                    theme=theme, step_count=3, client=client)
-                story_data["theme"] = theme
-                with open(theme_dir / f"story_{i+1}.json", "w") as f:
-                    json.dump(story_data, f, indent=4)
-                print("  ✅ Story JSON saved.")
-
-        except Exception as e:
-            print(f"🚨 FAILED to process theme: {theme}. Error: {e}")
-
-    print("\n--- Mock Data Generation Complete ---")
+    """Generates stories for every theme until each one has `--target` valid stories."""
+    parser = argparse.ArgumentParser(description="Generates & validates pools of stories per theme.")
+    parser.add_argument("--themes", nargs="+", default=THEMES)
+    parser.add_argument("--target", type=int, default=5, help="valid stories wanted per theme (default: 5)")
+    parser.add_argument("--step-count", type=int, default=3, help="length of the successful path (default: 3)")
+    parser.add_argument("--concurrency", type=int, default=16, help="story requests in flight (default: 16)")
+    parser.add_argument("--retries", type=int, default=3, help="retries of a failed request (default: 3)")
+    parser.add_argument("--attempts-per-story", type=int, default=4,
+                        help="requests allowed per missing story, to cap the spend on invalid ones (default: 4)")
+    args = parser.parse_args()
+
+    print("--- Starting Story Generation ---")
+    started = time.perf_counter()
+    batches = asyncio.run(generate_stories(args.themes, args.target, args.step_count,
+                                           args.concurrency, args.retries, args.attempts_per_story))
+    minutes = (time.perf_counter() - started) / 60
+
+    print("\n--- Story Generation Complete ---")
+    for batch in batches:
+        print(f"  {batch.theme}: {batch.valid}/{batch.target} valid, {batch.saved} new, "
+              f"{batch.invalid} invalid, {batch.duplicates} duplicates, {batch.errors} errors")
+    saved = sum(batch.saved for batch in batches)
+    print(f"📊 {saved} stories in {minutes:.1f} min ({saved / minutes if minutes else 0:.1f} stories/min)")
+    if saved:
+        print("🔁 Run scripts/verify_stories.py to analyse the new stories and rebuild the story bundle.")
 
 
 if __name__ == "__main__":
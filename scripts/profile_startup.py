@@ -0,0 +1,194 @@
+"""
+Profiles the cold start of an API worker, to keep its time to first request under a
+second. Reports:
+
+- the import time of the app's modules & of the packages they pull in (from
+  `python -X importtime`, so a slow import shows up with its module),
+- the time to import the app, run its lifespan & answer a first request, and the
+  phases of the background warm-up (provider SDKs & clients, mock images, connections),
+  each in a fresh interpreter like a freshly started worker.
+
+    python scripts/profile_startup.py
+    python scripts/profile_startup.py --runs 5 --budget 1.0 --top 30
+    python scripts/profile_startup.py --preload
+
+`--preload` imports the app in a "master" process and forks it, like gunicorn's
+`preload_app`, and times the forked worker. The provider connections are only
+pre-opened with `--connect` (it calls the providers' hosts, no API keys needed).
+Exits with 1 when the median time to first request is over `--budget` seconds.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+# Add the parent directory to the Python path to allow imports from the 'api' module
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(REPO_ROOT))
+
+# The timings of a probe, in seconds from the start of its interpreter (or from the fork).
+PROBE_TIMINGS = ("import_s", "lifespan_s", "first_request_s", "warm_s")
+
+
+def import_times(workdir: Path) -> list:
+    """
+    [(module, self seconds, cumulative seconds, depth)] of `import api.main`, in import order.
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import api.main"],
+                               cwd=workdir, env=_env(workdir, connect=False), capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing the app failed:\n{completed.stderr[-2000:]}")
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return modules
+
+
+def print_import_report(modules: list, top: int):
+    print("\n📦 App modules (cumulative import time, including what they import first)")
+    app_modules = sorted((m for m in modules if m[0].split(".")[0] == "api"), key=lambda m: -m[2])
+    for name, _, cumulative, _ in app_modules[:top]:
+        print(f"  {cumulative * 1000:8.1f} ms  {name}")
+
+    # every module's own time, grouped by top-level package: what each dependency costs in total
+    packages = defaultdict(float)
+    for name, self_seconds, _, _ in modules:
+        packages[name.split(".")[0]] += self_seconds
+    print("\n📚 Packages (import time of all their modules)")
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {seconds * 1000:8.1f} ms  {package}")
+    print(f"  {sum(packages.values()) * 1000:8.1f} ms  total")
+
+
+def probe(preload: bool, warm_timeout: float):
+    """
+    Runs in a fresh interpreter: imports the app, runs its lifespan, sends a first
+    request and waits for the warm-up, then prints the timings as json.
+    """
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        import api.main
+        from api.startup import preload as preload_app, startup_profile
+    imported = time.perf_counter()
+    if preload:
+        with contextlib.redirect_stdout(io.StringIO()):
+            preload_app()
+        pid = os.fork()
+        if pid:
+            _, status = os.waitpid(pid, 0)
+            sys.exit(os.waitstatus_to_exitcode(status))
+        # the forked worker: its start is the fork, the app is already imported
+        started = imported = time.perf_counter()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        lifespan_done, first_response, warm = asyncio.run(_first_request(api.main.app, warm_timeout))
+    print(json.dumps({
+        "import_s": imported - started,
+        "lifespan_s": lifespan_done - started,
+        "first_request_s": first_response - started,
+        "warm_s": warm - started if warm is not None else None,
+        "phases": startup_profile.stats()["phases"],
+    }))
+
+
+async def _first_request(app, warm_timeout: float) -> tuple:
+    import httpx
+
+    from api.startup import startup_profile
+
+    async with app.router.lifespan_context(app):
+        lifespan_done = time.perf_counter()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://startup") as client:
+            response = await client.get("/api/startup_stats")
+            response.raise_for_status()
+        first_response = time.perf_counter()
+        deadline = first_response + warm_timeout
+        while startup_profile.warm_seconds is None and time.perf_counter() < deadline:
+            await asyncio.sleep(0.005)
+        warm = time.perf_counter() if startup_profile.warm_seconds is not None else None
+    return lifespan_done, first_response, warm
+
+
+def run_probe(workdir: Path, preload: bool, connect: bool, warm_timeout: float) -> dict:
+    command = [sys.executable, str(Path(__file__).resolve()), "--probe", "--warm-timeout", str(warm_timeout)]
+    if preload:
+        command.append("--preload")
+    completed = subprocess.run(command, cwd=workdir, env=_env(workdir, connect), capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"The startup probe failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _env(workdir: Path, connect: bool) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO_ROOT), env.get("PYTHONPATH")]))
+    env["PROVIDER_WARM_UP"] = "1" if connect else "0"
+    env.setdefault("GEMINI_API_KEY", "profile")
+    env.setdefault("ELEVENLABS_API_KEY", "profile")
+    return env
+
+
+def print_probe_report(runs: list, preload: bool):
+    print(f"\n⏱️ Worker startup, median of {len(runs)} runs" + (" (forked from a preloaded master)" if preload else ""))
+    for timing in PROBE_TIMINGS:
+        values = [run[timing] for run in runs if run[timing] is not None]
+        value = f"{statistics.median(values) * 1000:8.1f} ms" if values else "     n/a   "
+        print(f"  {value}  {timing[:-2].replace('_', ' ')}")
+    phases = defaultdict(list)
+    for run in runs:
+        for name, seconds in run["phases"].items():
+            phases[name].append(seconds)
+    print("\n🔥 Startup phases (median)")
+    for name, values in phases.items():
+        print(f"  {statistics.median(values) * 1000:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profiles the cold start of an API worker.")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to time (default: 3)")
+    parser.add_argument("--top", type=int, default=20, help="modules & packages listed (default: 20)")
+    parser.add_argument("--budget", type=float, default=1.0,
+                        help="maximum median time to first request in seconds (default: 1.0)")
+    parser.add_argument("--preload", action="store_true", help="time a worker forked from a preloaded master")
+    parser.add_argument("--connect", action="store_true", help="pre-open the provider connections in the warm-up")
+    parser.add_argument("--warm-timeout", type=float, default=30.0,
+                        help="seconds to wait for the warm-up after the first request (default: 30)")
+    parser.add_argument("--workdir", type=Path, help="the app's working directory (default: a new temp dir)")
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        probe(args.preload, args.warm_timeout)
+        return
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="bss-startup-"))
+    # the app mounts the React build relative to its working directory
+    os.makedirs(Path(workdir, "frontend", "build"), exist_ok=True)
+    print(f"🔬 Profiling the startup of the app in {workdir}...")
+
+    print_import_report(import_times(workdir), args.top)
+    runs = [run_probe(workdir, args.preload, args.connect, args.warm_timeout) for _ in range(args.runs)]
+    print_probe_report(runs, args.preload)
+
+    first_request = statistics.median(run["first_request_s"] for run in runs)
+    if first_request > args.budget:
+        print(f"\n❌ Time to first request {first_request:.2f}s is over the {args.budget:.2f}s budget")
+        sys.exit(1)
+    print(f"\n✅ Time to first request {first_request:.2f}s is within the {args.budget:.2f}s budget")
+
+
+if __name__ == "__main__":
+    main()
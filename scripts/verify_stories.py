@@ -1,119 +1,137 @@
+import argparse
 import json
 import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import emoji
-
-
-# --- Helper Functions  ---
-def is_valid_string_value(obj, key):
-    val = obj.get(key)
-    return isinstance(val, str) and len(val) > 0
-
-def is_valid_list_value(obj, key):
-    val = obj.get(key)
-    return isinstance(val, list)
 
-def is_valid_bool_value(obj, key):
-    val = obj.get(key)
-    return isinstance(val, bool)
-    
+import emoji
 
-def verify_stories(data_root: str) -> list[str]:
+# Add the parent directory to the Python path to allow imports from the 'api' module
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from api.cache import content_key
+from api.constants import CACHE_DIR
+from api.story_index import METADATA_FILE_NAME
+from api.story_validation import ANALYSIS_VERSION, analyse_story, validate_story
+from scripts.build_story_bundle import build_story_bundle
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+STORY_DATA_ROOT = REPO_ROOT / "api" / "data"
+MOCK_DATA_ROOT = REPO_ROOT / "data" / "mock"
+RESULTS_CACHE_PATH = REPO_ROOT / CACHE_DIR / "verify_stories.json"
+
+
+def find_stories(data_root: Path, mock_root: Path) -> list:
+    """
+    Every story file, laid out as `<theme>/story_N/story.json` (and `<theme>/story.json` for the mocks).
+    """
+    return sorted(data_root.glob("*/story_*/story.json")) + sorted(mock_root.glob("*/story.json"))
+
+
+def _write_json(path: Path, data: dict):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def verify_story(story_path: str, story_hash: str) -> dict:
+    """
+    Validates & analyses one story and writes its metadata next to it. Runs in the process pool.
+    Returns the result to cache: {"hash", "version", "error", "summary"}.
+    """
+    result = {"hash": story_hash, "version": ANALYSIS_VERSION, "error": None, "summary": None}
+    try:
+        with open(story_path, "r") as file:
+            story_obj = json.load(file)
+        validate_story(story_obj)
+        metadata = analyse_story(story_obj)
+    except (json.JSONDecodeError, ValueError) as e:
+        result["error"] = str(e)
+        return result
+
+    # the runtime only trusts metadata that matches the story file it sits next to
+    _write_json(Path(story_path).with_name(METADATA_FILE_NAME), {"story_hash": story_hash, **metadata})
+    result["summary"] = {name: metadata[name] for name in
+                         ("step_count", "ending_count", "branching_factor", "max_depth", "path_lengths", "playthroughs")}
+    result["summary"]["cycles"] = len(metadata["cycles"])
+    return result
+
+
+def _load_results(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def verify_stories(story_paths: list, workers: int = None, force: bool = False) -> list:
+    """
+    Verifies the stories in a process pool. Results are cached by content hash, so
+    a rerun only re-checks the stories that changed since the last run.
+    Returns the paths of the invalid stories.
+    """
     print("--- Verifying Stories ---")
-    invalid_stories = set() # Use a set to avoid duplicate entries
-    print(emoji.emojize(f":file_folder: Verifying stories from {data_root}..."))
-
-    for theme in os.listdir(data_root):
-        theme_dir = Path(data_root, theme)
-        if not theme_dir.is_dir(): continue        
-        print(emoji.emojize(f"\n:cyclone: Verifying Theme: {theme}"))
-
-        for story in os.listdir(theme_dir):
-            story_dir = Path(theme_dir,story)
-            print(emoji.emojize(f"\n    :file_folder: reading story from {story}"))
-            
-            for story_file in os.listdir(story_dir):
-                if not story_file.endswith('.json'): continue
-
-                story_path = Path(story_dir, story_file)
-                print(emoji.emojize(f"      :eyes: Verifying {story_file}..."), end=" ")
-
-                try:
-                    
-                    # read the json file from
-                    with open(story_path, 'r') as file:
-                        story_obj = json.load(file)
-
-                    # --- Structural Validation ---
-                    if not all(k in story_obj for k in ["prologue", "story_tree"]):
-                        raise ValueError("Missing 'prologue' or 'story_tree' key.")
-
-                    story_tree = story_obj["story_tree"]
-                    if not isinstance(story_tree, list) or not story_tree:
-                        raise ValueError("'story_tree' is not a valid, non-empty list.")
-
-                    # --- Relational Validation (The Optimization) ---
-                    # 1. Prepare Once: Create a set of all valid IDs for instant lookups.
-                    all_step_ids = {step.get("id") for step in story_tree}
-                    if None in all_step_ids:
-                        raise ValueError("A step is missing an 'id' key.")
-                    
-                    # 2. Check for ID uniqueness
-                    if len(all_step_ids) != len(story_tree):
-                        raise ValueError("Duplicate 'id' found in story_tree.")
-                    
-                    # 3. Check for the required 'start' node
-                    if "start" not in all_step_ids:
-                        raise ValueError("Missing required step with id 'start'.")
-                    
-                    if (not is_valid_string_value(story_obj, "theme")):
-                        print(f"🚨 Found invalid theme in {story_path}")
-                        invalid_stories.append(story_path)
-                        continue
-
-
-                    # Step 3: loop thru story sections and validate them
-                    for step in story_tree:
-                        if not all(is_valid_string_value(step, k) for k in ["id", "scene_description", "character_pose_description", "narration"]):
-                            raise ValueError(f"Step '{step.get('id')}' has missing or invalid string fields.")
-
-                        if not is_valid_bool_value(step, "is_ending"):
-                            raise ValueError(f"Step '{step.get('id')}' has invalid 'is_ending' flag.")
-
-                        choices = step.get("choices", [])
-                        if step["is_ending"]:
-                            if choices:
-                                raise ValueError(f"Ending step '{step['id']}' must not have choices.")
-                            if not is_valid_string_value(step, "outcome"):
-                                raise ValueError(f"Ending step '{step['id']}' is missing an 'outcome'.")                    
-                        else: # Not an ending step
-                            if not choices: # Must have at least one choice
-                                raise ValueError(f"Non-ending step '{step['id']}' has no choices.")
-                            # Validate that all next_ids point to a real step
-                            if len(choices) < 2: # Must have at least one choice
-                                raise ValueError(f"Non-ending step '{step['id']}' has less than 2 choices.")
-                            for choice in choices:
-                                next_id = choice.get("next_id")
-                                if not next_id or next_id not in all_step_ids:
-                                    raise ValueError(f"Step '{step['id']}' has a choice pointing to an invalid next_id: '{next_id}'.")
-
-                    print(emoji.emojize(" -> :check_mark_button: OK!"))
-                except (json.JSONDecodeError, ValueError) as e:
-                    print(emoji.emojize(f" -> :cross_mark: FAIL! Reason: {e}"))
-                    invalid_stories.add(str(story_path))                
-
-
-    return list(invalid_stories)
+    cached = {} if force else _load_results(RESULTS_CACHE_PATH)
+    results = {}
+    todo = {}
+    for story_path in story_paths:
+        name = story_path.relative_to(REPO_ROOT).as_posix()
+        story_hash = content_key(story_path.read_bytes())
+        previous = cached.get(name)
+        metadata_path = story_path.with_name(METADATA_FILE_NAME)
+        if (previous and previous["hash"] == story_hash and previous["version"] == ANALYSIS_VERSION
+                and (previous["error"] or metadata_path.exists())):
+            results[name] = previous
+        else:
+            todo[name] = story_hash
+    print(emoji.emojize(f":file_folder: {len(story_paths)} stories, {len(results)} unchanged, {len(todo)} to verify"))
+
+    started = time.perf_counter()
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {name: pool.submit(verify_story, str(REPO_ROOT / name), story_hash)
+                       for name, story_hash in todo.items()}
+            for name, future in futures.items():
+                results[name] = future.result()
+
+    os.makedirs(RESULTS_CACHE_PATH.parent, exist_ok=True)
+    _write_json(RESULTS_CACHE_PATH, results)
+
+    for name in sorted(results):
+        result = results[name]
+        marker = "" if name in todo else " (cached)"
+        if result["error"]:
+            print(emoji.emojize(f"  :cross_mark: {name}{marker}: {result['error']}"))
+        else:
+            summary = result["summary"]
+            lengths = summary["path_lengths"]
+            print(emoji.emojize(
+                f"  :check_mark_button: {name}{marker}: {summary['step_count']} steps, "
+                f"{summary['playthroughs']} playthroughs of {lengths['shortest']}-{lengths['longest']} choices, "
+                f"branching {summary['branching_factor']}, {summary['cycles']} cycles"))
+    print(f"⏱️ Verified {len(todo)} stories in {time.perf_counter() - started:.2f}s")
+
+    return [name for name in sorted(results) if results[name]["error"]]
 
 
 if __name__ == "__main__":
-    data_root = Path(__file__).resolve().parent.parent / "api"/"data"
-    invalid_stories = verify_stories(data_root=data_root)    
+    parser = argparse.ArgumentParser(description="Validates every story and writes its graph metadata.")
+    parser.add_argument("--workers", type=int, help="verifier processes (default: one per CPU)")
+    parser.add_argument("--force", action="store_true", help="ignore the cached results and re-check everything")
+    args = parser.parse_args()
+
+    invalid_stories = verify_stories(find_stories(STORY_DATA_ROOT, MOCK_DATA_ROOT), args.workers, args.force)
     if invalid_stories:
         story_str = "stories" if len(invalid_stories) > 1 else "story"
         print(emoji.emojize(f"\n:exploding_head: Found {len(invalid_stories)} invalid {story_str}:"))
         for story_path in invalid_stories:
             print(f"- {story_path}")
+        sys.exit(1)
     else:
         print(emoji.emojize("\n:sparkles::tada: All stories are valid and ready for production! :tada::sparkles:"))
-
+        # ship the verified stories & their fresh metadata
+        build_story_bundle()